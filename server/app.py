@@ -1,10 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response, Response, g
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event, desc, ForeignKey
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from datetime import datetime, timezone, timedelta
-import os, pytz
+from functools import wraps
+import os, json, pytz
 from werkzeug.security import generate_password_hash, check_password_hash
+from point_codec import iter_xyz_blocks
+from blob_store import BlobWriter, remove_points
+from job_queue import SQLiteJobQueue
+from volume_history import parse_window, history_series, iter_raw_points, columnar
+from live_updates import VolumeBroker
+from auth_context import AuthContext, AuthCache
+from json_stream import stream_json, stream_json_object, JSONRows, YIELD_PER
+import volume_engines
 
 # ------------------ Flask App & SQLite Setup ------------------
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -15,7 +26,9 @@ app.secret_key = "your_secret_key_here"
 if not os.path.exists(os.path.join(basedir, 'Database')):
     os.makedirs(os.path.join(basedir, 'Database'))
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'Database', 'Server_db.sqlite3')
+# DATABASE_URL: ใช้ฐานข้อมูลอื่นแทน Database/Server_db.sqlite3 (เช่น check_query_counts.py ใช้ไฟล์ชั่วคราว)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'Database', 'Server_db.sqlite3'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SESSION_COOKIE_SECURE'] = False  # สำหรับ development
 app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -27,6 +40,7 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 }
 
 db = SQLAlchemy(app)
+mesh_queue = SQLiteJobQueue(db)
 
 # ------------------ Models ------------------
 class User(db.Model):
@@ -57,17 +71,24 @@ class UserBranchAccess(db.Model):
     
     user = db.relationship('User', backref=db.backref('branch_access', lazy=True, cascade='all, delete-orphan'))
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'province', name='_user_province_uc'),)
+    # unique (user_id, province) ใช้เป็น index ของ filter_by(user_id=...) ได้อยู่แล้ว
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'province', name='_user_province_uc'),
+        db.Index('ix_user_branch_access_province', 'province'),
+    )
 
 class SiloMeta(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.String(50), unique=True, nullable=False)
     plant_type = db.Column(db.String(50))
-    province = db.Column(db.String(50))
+    province = db.Column(db.String(50), index=True)
     site_code = db.Column(db.String(20))
     silo_no = db.Column(db.String(10))
     capacity = db.Column(db.Float, default=1000.0)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # engine ใน volume_engines.ENGINES ที่ worker ใช้ (NULL = VOLUME_METHOD / VOLUME_VERIFY_METHOD ของ worker)
+    volume_engine = db.Column(db.String(20))
+    verify_engine = db.Column(db.String(20))
     
     volume_data = db.relationship('VolumeData', backref='silo', lazy=True, cascade='all, delete-orphan')
     silo_data = db.relationship('SiloData', backref='silo', lazy=True, cascade='all, delete-orphan')
@@ -79,6 +100,21 @@ class VolumeData(db.Model):
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     volume = db.Column(db.Float)
     volume_percentage = db.Column(db.Float)
+    air_volume_m3 = db.Column(db.Float)  # ปริมาตรอากาศที่ engine วัดได้ (NULL = แถวก่อนมีคอลัมน์นี้)
+
+    # history window (device_id = ? AND timestamp >= ?) และ MAX(timestamp) ต่อ device
+    __table_args__ = (db.Index('ix_volume_data_device_timestamp', 'device_id', 'timestamp'),)
+
+class LatestVolume(db.Model):
+    # projection ของ VolumeData ล่าสุดต่อ device (1 แถวต่อไซโล) ให้ dashboard อ่านได้ในการ lookup เดียว
+    # worker upsert พร้อมกับการ insert VolumeData ใน transaction เดียวกัน
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    volume_data_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    volume = db.Column(db.Float)
+    volume_percentage = db.Column(db.Float)
+
+    silo = db.relationship('SiloMeta')
 
 class SiloData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -89,7 +125,11 @@ class SiloData(db.Model):
     chunk_id = db.Column(db.Integer)
     point_cloud = db.Column(db.Text)
     
-    __table_args__ = (db.UniqueConstraint('batch_id', 'chunk_id', name='_batch_chunk_uc'),)
+    # unique (batch_id, chunk_id) เป็น index ของการนับ/อ่าน chunk ตาม batch อยู่แล้ว
+    __table_args__ = (
+        db.UniqueConstraint('batch_id', 'chunk_id', name='_batch_chunk_uc'),
+        db.Index('ix_silo_data_device', 'device_id'),
+    )
 
 class MergedData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -97,10 +137,259 @@ class MergedData(db.Model):
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     batch_id = db.Column(db.String(100))
     total_points = db.Column(db.Integer)
-    merged_points = db.Column(db.Text)
+    merged_points = db.Column(db.Text)  # legacy: ข้อความ "x y z" (แถวเก่าก่อนมี merged_blob)
+    merged_blob = db.Column(db.LargeBinary)  # legacy: point_codec float32 Nx3 + header
+    blob_path = db.Column(db.String(200))  # blob_store: .npy ใต้ Database/blobs
+    blob_checksum = db.Column(db.String(64))
     mesh_processed = db.Column(db.Boolean, default=False, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_merged_data_device_timestamp', 'device_id', 'timestamp'),
+        # partial index: มีแค่แถวที่ยังไม่ประมวลผล (ส่วนน้อยของตาราง) สำหรับ worker
+        db.Index('ix_merged_data_unprocessed', 'timestamp', sqlite_where=db.text('mesh_processed = 0')),
+    )
+
+class SiloGeometry(db.Model):
+    # เรขาคณิตผนังไซโลที่ fit ไว้ (หน่วย cm) และความจุอ้างอิงจากการ calibrate ตอนไซโลว่าง
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    center_x = db.Column(db.Float)
+    center_y = db.Column(db.Float)
+    radius = db.Column(db.Float)
+    floor_z = db.Column(db.Float)
+    lid_z = db.Column(db.Float)
+    height = db.Column(db.Float)
+    empty_volume_m3 = db.Column(db.Float)
+    inlier_ratio = db.Column(db.Float)
+    calibration_merged_id = db.Column(db.Integer)
+    calibrated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    voxel_size = db.Column(db.Float)  # cm สำหรับ voxel downsample ใน worker (NULL = ค่า default)
+
+class SurfaceSnapshot(db.Model):
+    # heightmap ผิววัสดุของสแกนล่าสุดต่อไซโล (float32 zlib, surface_diff) ให้ worker เทียบกับสแกนถัดไป
+    # ถ้าผิวเปลี่ยนน้อย worker ปรับ air_volume_m3 จากช่องที่เปลี่ยนแทนการคำนวณใหม่ทั้งหมด
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    merged_id = db.Column(db.Integer, nullable=False)
+    grid_res = db.Column(db.Float, nullable=False)
+    x0 = db.Column(db.Integer, nullable=False)
+    y0 = db.Column(db.Integer, nullable=False)
+    nx = db.Column(db.Integer, nullable=False)
+    ny = db.Column(db.Integer, nullable=False)
+    heights = db.Column(db.LargeBinary, nullable=False)
+    air_volume_m3 = db.Column(db.Float, nullable=False)
+    volume_engine = db.Column(db.String(20))
+    voxel_size = db.Column(db.Float)
+    calibrated_at = db.Column(db.DateTime)  # SiloGeometry.calibrated_at ตอนสร้าง (calibrate ใหม่ = ใช้ไม่ได้)
+    incremental_run = db.Column(db.Integer, default=0, nullable=False)  # จำนวนครั้งที่ปรับแบบ incremental ติดกัน
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class BatchLedger(db.Model):
+    # สมุดบันทึกการมาถึงของ chunk ต่อ batch (อัปเดตพร้อมกับการ insert SiloData ใน transaction เดียวกัน)
+    batch_id = db.Column(db.String(100), primary_key=True)
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    received_chunks = db.Column(db.Integer, default=0, nullable=False)
+    merged = db.Column(db.Boolean, default=False, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ProvinceRollup(db.Model):
+    # ผลรวมต่อจังหวัดของไซโลที่มี LatestVolume สำหรับ /api/overview_data
+    # trigger ใน SQLite บวก/ลบส่วนของไซโลเมื่อ latest_volume หรือ province/capacity ของ silo_meta เปลี่ยน
+    province = db.Column(db.String(50), primary_key=True)
+    silo_count = db.Column(db.Integer, default=0, nullable=False)
+    total_capacity = db.Column(db.Float, default=0, nullable=False)
+    total_used = db.Column(db.Float, default=0, nullable=False)
+    low_capacity_count = db.Column(db.Integer, default=0, nullable=False)
+
+class DataVersion(db.Model):
+    # ตัวนับเวอร์ชันข้อมูลตามชื่อ ('dashboard', 'auth'): trigger ใน SQLite เพิ่มค่าเมื่อตารางที่ผูกไว้เปลี่ยน
+    # (รวมการเขียนจาก worker/สคริปต์อื่น) ใช้เป็น ETag ของ endpoint ที่ dashboard poll
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # epoch seconds
+
 # ------------------ Initialize DB ------------------
+# คอลัมน์ที่เพิ่มภายหลัง: db.create_all() ไม่แก้ตารางเดิม จึงต้อง ALTER TABLE เอง
+# (index ที่ประกาศใน model ก็เช่นกัน migrate_schema สร้างให้ถ้ายังไม่มี)
+SCHEMA_MIGRATIONS = [
+    ('merged_data', 'merged_blob', 'BLOB'),
+    ('merged_data', 'blob_path', 'VARCHAR(200)'),
+    ('merged_data', 'blob_checksum', 'VARCHAR(64)'),
+    ('silo_geometry', 'voxel_size', 'FLOAT'),
+    ('silo_meta', 'volume_engine', 'VARCHAR(20)'),
+    ('silo_meta', 'verify_engine', 'VARCHAR(20)'),
+    ('volume_data', 'air_volume_m3', 'FLOAT'),
+]
+
+# Convex Hull เดิมหาร cm^3 ด้วย 1e9 (ควรเป็น 1e6) อากาศจึงเหลือ 1/1000 ของจริงและไซโลดูเต็ม > 99.9%
+# แถวที่ engine จริงวัดได้ไม่ขึ้นไปถึงช่วงนี้ (ผิววัสดุไม่ถึงระดับ lid ที่เซนเซอร์ติดอยู่)
+LEGACY_HULL_MIN_PERCENT = 99.9
+
+def rescale_legacy_hull_volumes(conn):
+    """
+    แก้แถว VolumeData ที่ Convex Hull เดิมบันทึกให้อยู่หน่วยเดียวกับ engine ปัจจุบัน (กราฟ history ไม่กระโดด 1000 เท่า)
+    อากาศ/ความจุ = 1 - % / 100 คูณ 1000 แล้วคำนวณ % ใหม่ และปรับ mass ตามสัดส่วน % (ความจุและความหนาแน่นเท่าเดิม)
+    """
+    new_percentage = "MAX(0.0, 100.0 - 1000.0 * (100.0 - volume_percentage))"
+    result = conn.exec_driver_sql(f"""
+        UPDATE volume_data
+        SET volume = volume * {new_percentage} / volume_percentage,
+            volume_percentage = {new_percentage}
+        WHERE volume_percentage > ? AND volume_percentage < 100.0
+    """, (LEGACY_HULL_MIN_PERCENT,))
+    if result.rowcount:
+        # latest_volume เป็น projection ของ volume_data (trigger ปรับ province_rollup ตาม)
+        conn.exec_driver_sql("""
+            UPDATE latest_volume
+            SET volume = (SELECT v.volume FROM volume_data v WHERE v.id = latest_volume.volume_data_id),
+                volume_percentage = (SELECT v.volume_percentage FROM volume_data v
+                                     WHERE v.id = latest_volume.volume_data_id)
+            WHERE EXISTS (SELECT 1 FROM volume_data v WHERE v.id = latest_volume.volume_data_id
+                          AND v.volume_percentage IS NOT latest_volume.volume_percentage)
+        """)
+        print(f"Rescaled {result.rowcount} legacy convex hull volume row(s)")
+
+# ข้อมูลที่ต้องแก้ครั้งเดียวพร้อมกับการเพิ่มคอลัมน์ (รันใน transaction เดียวกับ ALTER TABLE)
+DATA_MIGRATIONS = {
+    ('volume_data', 'air_volume_m3'): rescale_legacy_hull_volumes,
+}
+
+def migrate_schema():
+    with db.engine.begin() as conn:
+        for table, column, ddl in SCHEMA_MIGRATIONS:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+                print(f"Migrated schema: {table}.{column}")
+                if (table, column) in DATA_MIGRATIONS:
+                    DATA_MIGRATIONS[(table, column)](conn)
+        existing_indexes = {row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    print(f"Migrated schema: index {index.name}")
+
+DASHBOARD_DATA_VERSION = 'dashboard'
+# ตารางที่มีผลต่อ /api/volume_data, /api/overview_data, /api/silos (user/สิทธิ์สาขาเปลี่ยนผลของ role user)
+DATA_VERSION_TABLES = ('volume_data', 'silo_meta', 'user_branch_access', 'user')
+AUTH_DATA_VERSION = 'auth'
+# ตารางที่มีผลต่อ AuthContext: auth_cache โหลดสิทธิ์ใหม่เมื่อตัวนับนี้เปลี่ยน (ทุก process เห็นพร้อมกัน)
+AUTH_DATA_VERSION_TABLES = ('user_branch_access', 'user')
+
+def ensure_data_version_triggers():
+    counters = (
+        (DASHBOARD_DATA_VERSION, DATA_VERSION_TABLES, 'data_version'),
+        (AUTH_DATA_VERSION, AUTH_DATA_VERSION_TABLES, 'auth_version'),
+    )
+    with db.engine.begin() as conn:
+        for name, tables, suffix in counters:
+            conn.exec_driver_sql(
+                "INSERT OR IGNORE INTO data_version (name, version, updated_at) "
+                "VALUES (?, 0, CAST(strftime('%s', 'now') AS REAL))", (name,))
+            for table in tables:
+                for op in ('INSERT', 'UPDATE', 'DELETE'):
+                    conn.exec_driver_sql(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_{suffix}
+                        AFTER {op} ON "{table}"
+                        BEGIN
+                            UPDATE data_version SET version = version + 1,
+                                   updated_at = CAST(strftime('%s', 'now') AS REAL)
+                            WHERE name = '{name}';
+                        END
+                    """)
+
+def backfill_latest_volume():
+    """สร้าง LatestVolume จาก VolumeData เดิม (ครั้งแรกหลังเพิ่มตาราง หรือเมื่อ projection ว่าง)"""
+    if db.session.query(LatestVolume.device_id).first() is not None:
+        return
+    with db.engine.begin() as conn:
+        result = conn.exec_driver_sql("""
+            INSERT OR REPLACE INTO latest_volume (device_id, volume_data_id, timestamp, volume, volume_percentage)
+            SELECT v.device_id, v.id, v.timestamp, v.volume, v.volume_percentage
+            FROM volume_data v
+            JOIN (SELECT device_id, MAX(timestamp) AS max_timestamp FROM volume_data GROUP BY device_id) m
+              ON v.device_id = m.device_id AND v.timestamp = m.max_timestamp
+            ORDER BY v.id
+        """)
+        if result.rowcount:
+            print(f"Backfilled latest_volume for {result.rowcount} device(s)")
+
+LOW_CAPACITY_PERCENT = 35
+
+def rollup_terms(capacity, volume):
+    """(capacity, used, low) ของไซโลหนึ่งตัวเป็น SQL expression ตรงกับที่ overview คำนวณเดิม
+    (capacity ว่าง/0 ใช้ 1000, volume ว่างเป็น 0)"""
+    capacity = f"COALESCE(NULLIF({capacity}, 0), 1000)"
+    used = f"COALESCE({volume}, 0)"
+    low = f"(CASE WHEN {capacity} > 0 THEN {used} * 100.0 / {capacity} < {LOW_CAPACITY_PERCENT} ELSE 1 END)"
+    return capacity, used, low
+
+_capacity, _used, _low = rollup_terms('s.capacity', 'v.volume')
+# rollup ที่ถูกต้องคำนวณจากศูนย์ (ใช้ rebuild และตรวจความถูกต้องใน rebuild_rollups.py)
+PROVINCE_ROLLUP_SQL = f"""
+    SELECT s.province, COUNT(*), SUM({_capacity}), SUM({_used}), SUM({_low})
+    FROM latest_volume v JOIN silo_meta s ON s.device_id = v.device_id
+    WHERE s.province IS NOT NULL
+    GROUP BY s.province
+"""
+
+def rollup_delta_sql(sign, province, capacity, volume, source):
+    """statement ใน trigger: บวก (sign=1) หรือลบ (sign=-1) ส่วนของไซโลออกจาก province_rollup"""
+    capacity, used, low = rollup_terms(capacity, volume)
+    return f"""
+        INSERT INTO province_rollup (province, silo_count, total_capacity, total_used, low_capacity_count)
+        SELECT {province}, {sign}, {sign} * {capacity}, {sign} * {used}, {sign} * {low}
+        {source}
+        ON CONFLICT (province) DO UPDATE SET
+            silo_count = silo_count + excluded.silo_count,
+            total_capacity = total_capacity + excluded.total_capacity,
+            total_used = total_used + excluded.total_used,
+            low_capacity_count = low_capacity_count + excluded.low_capacity_count;
+    """
+
+def ensure_province_rollup_triggers():
+    def from_silo(row):
+        return f"FROM silo_meta s WHERE s.device_id = {row}.device_id AND s.province IS NOT NULL"
+
+    def from_latest(row):
+        return f"FROM latest_volume v WHERE v.device_id = {row}.device_id AND {row}.province IS NOT NULL"
+
+    add_volume = rollup_delta_sql(1, 's.province', 's.capacity', 'NEW.volume', from_silo('NEW'))
+    remove_volume = rollup_delta_sql(-1, 's.province', 's.capacity', 'OLD.volume', from_silo('OLD'))
+    add_silo = rollup_delta_sql(1, 'NEW.province', 'NEW.capacity', 'v.volume', from_latest('NEW'))
+    remove_silo = rollup_delta_sql(-1, 'OLD.province', 'OLD.capacity', 'v.volume', from_latest('OLD'))
+    drop_empty = "DELETE FROM province_rollup WHERE silo_count <= 0;"
+    triggers = {
+        'trg_latest_volume_insert_rollup': ("AFTER INSERT ON latest_volume", add_volume),
+        'trg_latest_volume_update_rollup': ("AFTER UPDATE ON latest_volume", remove_volume + add_volume + drop_empty),
+        'trg_latest_volume_delete_rollup': ("AFTER DELETE ON latest_volume", remove_volume + drop_empty),
+        # silo ที่เพิ่งเพิ่ม (add_silo) ยังไม่มี latest_volume จึงไม่มีส่วนใน rollup
+        # ตอนลบ (delete_silo_by_device) latest_volume ถูกลบก่อน trigger ข้างบนจึงลบส่วนนั้นให้แล้ว
+        'trg_silo_meta_update_rollup': ("AFTER UPDATE OF province, capacity ON silo_meta",
+                                        remove_silo + add_silo + drop_empty),
+    }
+    with db.engine.begin() as conn:
+        for name, (when, body) in triggers.items():
+            conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {when} BEGIN {body} END")
+
+def rebuild_province_rollup(conn):
+    """คำนวณ province_rollup ใหม่ทั้งตารางจาก latest_volume (ใน transaction ของ conn)"""
+    conn.exec_driver_sql("DELETE FROM province_rollup")
+    result = conn.exec_driver_sql(
+        "INSERT INTO province_rollup (province, silo_count, total_capacity, total_used, low_capacity_count) "
+        + PROVINCE_ROLLUP_SQL)
+    return result.rowcount
+
+def backfill_province_rollup():
+    """สร้าง province_rollup ครั้งแรกหลังเพิ่มตาราง (ฐานข้อมูลที่มี latest_volume อยู่แล้ว)"""
+    if db.session.query(ProvinceRollup.province).first() is not None:
+        return
+    if db.session.query(LatestVolume.device_id).first() is None:
+        return
+    with db.engine.begin() as conn:
+        print(f"Backfilled province_rollup for {rebuild_province_rollup(conn)} province(s)")
+
 def init_db():
     with app.app_context():
         @event.listens_for(db.engine, "connect")
@@ -112,41 +401,193 @@ def init_db():
             cursor.close()
         
         db.create_all()
+        migrate_schema()
+        ensure_data_version_triggers()
+        ensure_province_rollup_triggers()
+        backfill_latest_volume()
+        backfill_province_rollup()
+        mesh_queue.ensure_schema()
         print("Database initialized successfully!")
 
 init_db()
 
+# ------------------ Auth Context ------------------
+auth_cache = AuthCache()
+
+def load_auth_context(user_id):
+    user = User.query.filter_by(id=user_id, is_active=True).options(selectinload(User.branch_access)).first()
+    if user is None:
+        return None
+    return AuthContext(user.id, user.username, user.role, [branch.province for branch in user.branch_access])
+
+@app.before_request
+def load_request_auth():
+    """g.auth: สิทธิ์ของผู้ใช้ใน session (None ถ้าไม่ได้ login หรือบัญชีถูกลบ)"""
+    g.auth = None
+    if request.endpoint == 'static' or 'user_id' not in session:
+        return
+    version = db.session.query(DataVersion.version).filter_by(name=AUTH_DATA_VERSION).scalar()
+    g.auth = auth_cache.get(session['user_id'], version, load_auth_context)
+
+# ------------------ Conditional GET ------------------
+def conditional_on_data_version(view):
+    """ETag/Last-Modified จาก DataVersion: ถ้า client ส่ง If-None-Match ตรงกัน ตอบ 304 โดยไม่รัน query ของ view
+
+    ETag รวม user_id ด้วย เพราะผลลัพธ์ของ role user กรองตามสาขาที่มีสิทธิ์
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'user_id' not in session:
+            return view(*args, **kwargs)
+        state = db.session.get(DataVersion, DASHBOARD_DATA_VERSION)
+        if state is None:
+            return view(*args, **kwargs)
+
+        etag = f"{state.version}-{session['user_id']}"
+        last_modified = datetime.fromtimestamp(state.updated_at, timezone.utc)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified.replace(microsecond=0)
+
+        response = make_response(('', 304) if not_modified else view(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            # ให้ browser ถามใหม่ทุกครั้ง (ได้ 304 ถ้าไม่เปลี่ยน) และไม่แชร์ cache ระหว่างผู้ใช้
+            response.cache_control.no_cache = True
+            response.cache_control.private = True
+        return response
+    return wrapper
+
+# ------------------ Live Updates ------------------
+def volume_row(volume):
+    """แถวของ /api/volume_data (และ event ของ /api/stream) จาก LatestVolume ที่ join silo แล้ว"""
+    silo = volume.silo
+    percentage = (volume.volume / silo.capacity * 100) if silo.capacity else 0
+    return {
+        "device_id": volume.device_id,
+        "volume": volume.volume,
+        "volume_percentage": round(percentage, 1),
+        "timestamp": volume.timestamp.isoformat(),
+        "plant_type": silo.plant_type,
+        "province": silo.province,
+        "site_code": silo.site_code,
+        "silo_no": silo.silo_no,
+        "capacity": silo.capacity
+    }
+
+def load_volume_updates(cursor):
+    """LatestVolume ที่เปลี่ยนหลัง cursor (volume_data_id ล่าสุดที่ส่งไปแล้ว) สำหรับ VolumeBroker
+
+    เรียกจาก thread ของ broker จึงต้องเปิด app context เอง
+    """
+    with app.app_context():
+        if cursor is None:
+            latest = db.session.query(db.func.max(LatestVolume.volume_data_id)).scalar()
+            return latest or 0, []
+        updates = db.session.query(LatestVolume).join(
+            SiloMeta, LatestVolume.device_id == SiloMeta.device_id
+        ).options(contains_eager(LatestVolume.silo)).filter(
+            LatestVolume.volume_data_id > cursor
+        ).order_by(LatestVolume.volume_data_id).all()
+        if not updates:
+            return cursor, []
+        return updates[-1].volume_data_id, [(volume.silo.province, volume_row(volume)) for volume in updates]
+
+# หนึ่ง broker ต่อ web process (thread เริ่มเมื่อมี subscriber แรก หลัง gunicorn fork แล้ว)
+volume_broker = VolumeBroker(load_volume_updates)
+
 # ------------------ Merge Logic ------------------
-merged_batches = set()
+def record_chunk(record, total_chunks):
+    """บันทึก chunk และเพิ่มตัวนับใน BatchLedger ภายใน transaction เดียวกัน
+    คืนค่า False ถ้า chunk นี้เคยได้รับแล้ว"""
+    db.session.add(record)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+    ledger = BatchLedger.__table__
+    # ครั้งแรกที่เห็น batch ให้นับ chunk ที่มีอยู่แล้วด้วย (เผื่อ batch ที่ค้างมาก่อนมี ledger)
+    existing_chunks = db.session.query(db.func.count(SiloData.id)).filter(
+        SiloData.batch_id == record.batch_id
+    ).scalar_subquery()
+    stmt = sqlite_insert(ledger).values(
+        batch_id=record.batch_id,
+        device_id=record.device_id,
+        total_chunks=total_chunks,
+        received_chunks=existing_chunks,
+        merged=False,
+        updated_at=datetime.now(timezone.utc)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ledger.c.batch_id],
+        set_={
+            'received_chunks': ledger.c.received_chunks + 1,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+    return True
 
 def try_merge(batch_id, total_chunks, device_id):
-    if batch_id in merged_batches:
-        return None
-    chunks = SiloData.query.filter_by(batch_id=batch_id).order_by(SiloData.chunk_id).all()
-    current_chunk_count = len(chunks)
     if total_chunks is None or total_chunks == 0:
         print(f"[{device_id}] total_chunks not set in payload!")
         return None
-    if current_chunk_count != total_chunks:
-        print(f"[{device_id}] Waiting for all chunks: {current_chunk_count}/{total_chunks}")
+    ledger = db.session.get(BatchLedger, batch_id)
+    if ledger is None or ledger.merged:
         return None
-    batch_timestamp = chunks[0].timestamp
-    all_points_text = "".join([c.point_cloud for c in chunks])
-    total_points = len(all_points_text.splitlines())
-    print(f"[{device_id}] [Batch_id: {batch_id}] Merge complete: ~{total_points} points")
-    merged_record = MergedData(
-        device_id=device_id,
-        timestamp=batch_timestamp,
-        batch_id=batch_id,
-        total_points=total_points,
-        merged_points=all_points_text
-    )
+    if ledger.received_chunks < ledger.total_chunks:
+        print(f"[{device_id}] Waiting for all chunks: {ledger.received_chunks}/{ledger.total_chunks}")
+        return None
+
+    # จอง batch นี้ด้วย conditional UPDATE กันไม่ให้ request อื่น merge ซ้ำ
+    claimed = BatchLedger.query.filter_by(batch_id=batch_id, merged=False).update({'merged': True})
+    if not claimed:
+        db.session.rollback()
+        return None
+
+    # อ่าน payload ของ chunk เฉพาะตอนที่ ledger บอกว่าครบแล้ว ทีละ chunk ตามลำดับ chunk_id
+    # (stream_results) แล้วเขียนต่อท้าย blob ไปเรื่อยๆ ไม่ต้อง join ข้อความทั้ง batch
+    batch_timestamp = db.session.query(SiloData.timestamp).filter_by(
+        batch_id=batch_id
+    ).order_by(SiloData.chunk_id).limit(1).scalar()
+    chunk_texts = db.session.execute(
+        db.select(SiloData.point_cloud)
+        .where(SiloData.batch_id == batch_id)
+        .order_by(SiloData.chunk_id)
+        .execution_options(stream_results=True, yield_per=1)
+    ).scalars()
+
+    writer = BlobWriter()
+    parse_stats = {}
     try:
+        for block in iter_xyz_blocks(chunk_texts, parse_stats):
+            writer.write(block)
+        total_points = writer.n_points
+        blob_path, blob_checksum = writer.finalize()
+        print(f"[{device_id}] [Batch_id: {batch_id}] Merge complete: {total_points} points")
+        if parse_stats.get('skipped'):
+            print(f"[{device_id}] [Batch_id: {batch_id}] Skipped {parse_stats['skipped']} malformed line(s)")
+        merged_record = MergedData(
+            device_id=device_id,
+            timestamp=batch_timestamp,
+            batch_id=batch_id,
+            total_points=total_points,
+            blob_path=blob_path,
+            blob_checksum=blob_checksum
+        )
         db.session.add(merged_record)
+        db.session.flush()
+        mesh_queue.enqueue(merged_record.id, device_id)
         db.session.commit()
-        merged_batches.add(batch_id)
+        mesh_queue.notify()  # ปลุก worker ทันที
         return True
     except Exception as e:
+        writer.abort()
         db.session.rollback()
         print(f"Error saving MergedData for batch {batch_id}: {e}")
         return None
@@ -208,127 +649,170 @@ def user_dashboard():
 # API สำหรับดึงข้อมูลตามสิทธิ์ผู้ใช้
 @app.route("/api/user_branches")
 def get_user_branches():
-    if 'user_id' not in session:
+    if g.auth is None:
         return jsonify([])
     
-    user_id = session['user_id']
-    user = User.query.filter_by(id=user_id, is_active=True).first()
-    
-    if user.role == 'admin':
+    if g.auth.role == 'admin':
         branches = db.session.query(SiloMeta.province).distinct().all()
         return jsonify([branch[0] for branch in branches])
     else:
-        user_branches = UserBranchAccess.query.filter_by(user_id=user_id).all()
-        return jsonify([branch.province for branch in user_branches])
+        return jsonify(list(g.auth.provinces))
 
 @app.route("/api/volume_data")
+@conditional_on_data_version
 def get_volume_data():
     try:
-        if 'user_id' not in session:
+        if g.auth is None:
             return jsonify({"error": "Unauthorized"}), 401
-            
-        user_id = session['user_id']
-        user = User.query.get(user_id)
         
-        subquery = db.session.query(
-            VolumeData.device_id,
-            db.func.max(VolumeData.timestamp).label('max_timestamp')
-        ).group_by(VolumeData.device_id).subquery()
-
-        query = db.session.query(VolumeData).join(
-            subquery,
-            (VolumeData.device_id == subquery.c.device_id) & 
-            (VolumeData.timestamp == subquery.c.max_timestamp)
-        ).join(SiloMeta, VolumeData.device_id == SiloMeta.device_id)
+        query = db.session.query(LatestVolume).join(
+            SiloMeta, LatestVolume.device_id == SiloMeta.device_id
+        ).options(contains_eager(LatestVolume.silo))
         
-        if user.role == 'user':
-            user_branches = UserBranchAccess.query.filter_by(user_id=user_id).all()
-            if not user_branches:
+        if g.auth.restricted:
+            if not g.auth.provinces:
                 return jsonify([])
-            allowed_provinces = [branch.province for branch in user_branches]
-            query = query.filter(SiloMeta.province.in_(allowed_provinces))
+            query = query.filter(SiloMeta.province.in_(g.auth.provinces))
 
         latest_volumes = query.all()
 
-        result = []
-        for volume in latest_volumes:
-            silo = volume.silo
-            percentage = (volume.volume / silo.capacity * 100) if silo.capacity else 0
-            
-            result.append({
-                "device_id": volume.device_id,
-                "volume": volume.volume,
-                "volume_percentage": round(percentage, 1),
-                "timestamp": volume.timestamp.isoformat(),
-                "plant_type": silo.plant_type,
-                "province": silo.province,
-                "site_code": silo.site_code,
-                "silo_no": silo.silo_no,
-                "capacity": silo.capacity
-            })
+        result = [volume_row(volume) for volume in latest_volumes]
 
         return jsonify(result)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+STREAM_KEEPALIVE = 15  # วินาที: comment line กัน proxy ตัด connection ที่เงียบ
+STREAM_MAX_AGE = 600  # ปิด stream เป็นระยะ ให้ EventSource reconnect และตรวจสิทธิ์สาขาใหม่
+
+@app.route("/api/stream")
+def stream_volume_updates():
+    """Server-Sent Events: ส่งแถวของ /api/volume_data ที่เปลี่ยนทันทีที่ worker commit
+
+    กรองตาม UserBranchAccess ของผู้ใช้ (ตรวจตอนเปิด stream) client โหลด snapshot จาก /api/volume_data เอง
+    แต่ละ stream ถือ worker ไว้จนปิด: ต้องรัน gunicorn แบบ gthread (server/gunicorn.conf.py)
+    sync worker จะหมดเมื่อเปิด dashboard ไม่กี่จอ
+    """
+    if g.auth is None:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    subscription = volume_broker.subscribe(g.auth.provinces if g.auth.restricted else None)
+
+    # generator ทำงานหลัง request context ถูก pop แล้ว (session DB คืน pool แล้ว) จึงใช้แค่ subscription
+    def events():
+        deadline = datetime.now(timezone.utc) + timedelta(seconds=STREAM_MAX_AGE)
+        try:
+            yield "retry: 5000\n\n"
+            while datetime.now(timezone.utc) < deadline:
+                payload = subscription.get(STREAM_KEEPALIVE)
+                if payload is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: volume\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            volume_broker.unsubscribe(subscription)
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # nginx: ส่งทันทีไม่ buffer
+    })
+
 @app.route("/api/volume_history/<device_id>")
 def get_volume_history(device_id):
     try:
-        if 'user_id' not in session:
+        if g.auth is None:
             return jsonify({"error": "Unauthorized"}), 401
-            
-        user_id = session['user_id']
-        user = User.query.get(user_id)
         
-        if user.role == 'user':
+        if g.auth.restricted:
             silo = SiloMeta.query.filter_by(device_id=device_id).first()
             if not silo:
                 return jsonify({"error": "Device not found"}), 404
                 
-            user_branches = UserBranchAccess.query.filter_by(user_id=user_id).all()
-            allowed_provinces = [branch.province for branch in user_branches]
-            if silo.province not in allowed_provinces:
+            if not g.auth.can_access(silo.province):
                 return jsonify({"error": "Access denied"}), 403
 
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        
-        volumes = VolumeData.query.filter(
-            VolumeData.device_id == device_id,
-            VolumeData.timestamp >= seven_days_ago
-        ).order_by(VolumeData.timestamp).all()
+        # from/to (ISO, default 7 วันล่าสุด), bucket (5m/1h/1d) และ max_points จำกัดขนาด payload
+        try:
+            start, end, bucket, max_points = parse_window(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        result = [{
-            "timestamp": vol.timestamp.isoformat(),
-            "volume": vol.volume,
-            "volume_percentage": vol.volume_percentage
-        } for vol in volumes]
+        if max_points is None and bucket is None:
+            # export ทั้งหน้าต่าง: stream จาก cursor โดยไม่โหลดทุกแถวเข้า memory
+            return stream_json(iter_raw_points(db.session, device_id, start, end, YIELD_PER))
 
-        return jsonify(result)
+        series = history_series(db.session, [device_id], start, end, bucket, max_points)
+        return stream_json(series.get(device_id, []))
     
+    # ครอบแค่การสร้าง response: error ระหว่าง stream body ถูก log และตัด connection ใน json_stream
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+MAX_HISTORY_DEVICES = 200
+
+@app.route("/api/volume_history")
+def get_volume_history_batch():
+    """ประวัติหลายไซโลใน request เดียว: ?device_ids=A,B,C หรือ ?province=X
+    (รับ from/to/bucket/max_points เหมือน /api/volume_history/<device_id>)"""
+    try:
+        if g.auth is None:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        device_ids = [d.strip() for arg in request.args.getlist('device_ids') for d in arg.split(',') if d.strip()]
+        province = request.args.get('province')
+        if not device_ids and not province:
+            return jsonify({"error": "device_ids or province is required"}), 400
+        if len(device_ids) > MAX_HISTORY_DEVICES:
+            return jsonify({"error": f"At most {MAX_HISTORY_DEVICES} device_ids per request"}), 400
+
+        try:
+            start, end, bucket, max_points = parse_window(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if max_points is None:
+            return jsonify({"error": "max_points=all is only supported by /api/volume_history/<device_id>"}), 400
+
+        # ตรวจสิทธิ์ครั้งเดียวใน query เดียว แทนการเช็คทีละไซโล
+        query = db.session.query(SiloMeta.device_id)
+        if device_ids:
+            query = query.filter(SiloMeta.device_id.in_(device_ids))
+        if province:
+            query = query.filter(SiloMeta.province == province)
+        if g.auth.restricted:
+            query = query.filter(SiloMeta.province.in_(g.auth.provinces))
+        # ?province= ไม่มีรายชื่อให้นับล่วงหน้า จำกัดจำนวนไซโลหลังตรวจสิทธิ์ด้วยเพดานเดียวกัน
+        allowed = [row.device_id for row in query.limit(MAX_HISTORY_DEVICES + 1)]
+        if len(allowed) > MAX_HISTORY_DEVICES:
+            return jsonify({"error": f"At most {MAX_HISTORY_DEVICES} silos per request, "
+                                     "use device_ids to select a subset"}), 400
+
+        series = history_series(db.session, allowed, start, end, bucket, max_points) if allowed else {}
+        return jsonify({
+            # columnar: {device_id: {timestamp: [...], volume: [...], ...}}
+            "series": {device_id: columnar(series.get(device_id, [])) for device_id in allowed},
+            # ไม่มีอยู่จริงหรือไม่มีสิทธิ์ (ไม่แยกกัน)
+            "unavailable": sorted(set(device_ids) - set(allowed))
+        })
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/silos")
+@conditional_on_data_version
 def get_silos():
     try:
-        if 'user_id' not in session:
+        if g.auth is None:
             return jsonify({"error": "Unauthorized"}), 401
-            
-        user_id = session['user_id']
-        user = User.query.get(user_id)
         
         query = SiloMeta.query
         
-        if user.role == 'user':
-            user_branches = UserBranchAccess.query.filter_by(user_id=user_id).all()
-            if not user_branches:
+        if g.auth.restricted:
+            if not g.auth.provinces:
                 return jsonify([])
-            allowed_provinces = [branch.province for branch in user_branches]
-            query = query.filter(SiloMeta.province.in_(allowed_provinces))
+            query = query.filter(SiloMeta.province.in_(g.auth.provinces))
 
-        silos = query.all()
-        result = [{
+        return stream_json(query.yield_per(YIELD_PER), lambda silo: {
             "id": silo.id,
             "device_id": silo.device_id,
             "plant_type": silo.plant_type,
@@ -337,9 +821,7 @@ def get_silos():
             "silo_no": silo.silo_no,
             "capacity": silo.capacity,
             "created_at": silo.created_at.isoformat()
-        } for silo in silos]
-        
-        return jsonify(result)
+        })
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -422,16 +904,15 @@ def get_all_branches():
         return jsonify({"error": "Unauthorized"}), 403
         
     try:
-        branches = db.session.query(SiloMeta.province).distinct().all()
-        provinces = [branch[0] for branch in branches if branch[0]]
+        # นับไซโลของทุกสาขาใน GROUP BY เดียว (ไม่ count ทีละจังหวัด)
+        branches = db.session.query(SiloMeta.province, db.func.count(SiloMeta.id)).filter(
+            SiloMeta.province.isnot(None), SiloMeta.province != ''
+        ).group_by(SiloMeta.province).all()
         
-        branch_stats = []
-        for province in provinces:
-            silo_count = SiloMeta.query.filter_by(province=province).count()
-            branch_stats.append({
-                "province": province,
-                "silo_count": silo_count
-            })
+        branch_stats = [{
+            "province": province,
+            "silo_count": silo_count
+        } for province, silo_count in branches]
         
         return jsonify(branch_stats)
         
@@ -449,16 +930,15 @@ def get_current_user():
         return jsonify({"error": "Not logged in"}), 401
     
     try:
-        user_id = session['user_id']
-        user = User.query.filter_by(id=user_id, is_active=True).first()
+        user = g.auth
         
         if not user:
-            print(f"❌ User {user_id} not found or inactive")
+            print(f"❌ User {session['user_id']} not found or inactive")
             session.clear()
             return jsonify({"error": "User not found"}), 404
         
         user_data = {
-            "id": user.id,
+            "id": user.user_id,
             "username": user.username,
             "role": user.role,
             "is_logged_in": True
@@ -480,7 +960,8 @@ def list_users():
         
     try:
         # ✅ นี้ถูกต้องแล้ว - ดึงเฉพาะ user ที่ active
-        users = User.query.filter_by(is_active=True).all()
+        # สิทธิ์สาขาของทุก user โหลดใน query เดียว (selectin) แทนการ query ทีละ user
+        users = User.query.filter_by(is_active=True).options(selectinload(User.branch_access)).all()
         result = []
         for u in users:
             user_data = {
@@ -492,7 +973,7 @@ def list_users():
             }
             
             if u.role == 'user':
-                user_branches = UserBranchAccess.query.filter_by(user_id=u.id).all()
+                user_branches = u.branch_access
                 user_data["allowed_branches"] = [branch.province for branch in user_branches]
                 user_data["branch_count"] = len(user_branches)
             else:
@@ -771,11 +1252,8 @@ def upload_chunk():
         )
         
         try:
-            db.session.add(record)
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-            print(f"Chunk {chunk_id}/{total_chunks} from {device_id} ALREADY EXISTS. Checking for merge.")
+            if not record_chunk(record, total_chunks):
+                print(f"Chunk {chunk_id}/{total_chunks} from {device_id} ALREADY EXISTS. Checking for merge.")
         except Exception as e:
             db.session.rollback()
             raise e
@@ -800,20 +1278,23 @@ def debug_data():
     volume_count = VolumeData.query.count()
     silo_count = SiloData.query.count()
     merged_count = MergedData.query.count()
-    silo_meta_count = SiloMeta.query.count()
-    user_count = User.query.filter_by(is_active=True).count()
-    user_branch_count = UserBranchAccess.query.count()
+    silos = SiloMeta.query
+    users = User.query.filter_by(is_active=True)
+    # user ของแต่ละสิทธิ์มาพร้อมกันใน join เดียว (ไม่ lazy load ทีละแถว)
+    user_branches = UserBranchAccess.query.options(joinedload(UserBranchAccess.user))
     
-    return jsonify({
+    return stream_json_object({
         "volume_data_count": volume_count,
         "silo_data_count": silo_count, 
         "merged_data_count": merged_count,
-        "silo_meta_count": silo_meta_count,
-        "user_count": user_count,
-        "user_branch_count": user_branch_count,
-        "all_silo_meta": [{"device_id": s.device_id, "plant_type": s.plant_type, "province": s.province} for s in SiloMeta.query.all()],
-        "all_users": [{"username": u.username, "role": u.role} for u in User.query.filter_by(is_active=True).all()],
-        "user_branches": [{"user": ua.user.username, "province": ua.province} for ua in UserBranchAccess.query.all()]
+        "silo_meta_count": silos.count(),
+        "user_count": users.count(),
+        "user_branch_count": user_branches.count(),
+        "all_silo_meta": JSONRows(silos.yield_per(YIELD_PER),
+                                  lambda s: {"device_id": s.device_id, "plant_type": s.plant_type, "province": s.province}),
+        "all_users": JSONRows(users.yield_per(YIELD_PER), lambda u: {"username": u.username, "role": u.role}),
+        "user_branches": JSONRows(user_branches.yield_per(YIELD_PER),
+                                  lambda ua: {"user": ua.user.username, "province": ua.province})
     })
 
 @app.route("/api/debug/delete_user/<int:user_id>")
@@ -848,25 +1329,23 @@ def debug_users():
     if session.get('role') != 'admin':
         return jsonify({"error": "Unauthorized"}), 403
         
-    all_users = User.query.all()
-    active_users = User.query.filter_by(is_active=True).all()
+    all_users = User.query
+    active_users = User.query.filter_by(is_active=True)
     
-    result = {
-        "all_users_count": len(all_users),
-        "active_users_count": len(active_users),
-        "all_users": [{
+    return stream_json_object({
+        "all_users_count": all_users.count(),
+        "active_users_count": active_users.count(),
+        "all_users": JSONRows(all_users.yield_per(YIELD_PER), lambda u: {
             "id": u.id,
             "username": u.username, 
             "is_active": u.is_active,
             "deleted_at": u.deleted_at.isoformat() if u.deleted_at else None
-        } for u in all_users],
-        "active_users": [{
+        }),
+        "active_users": JSONRows(active_users.yield_per(YIELD_PER), lambda u: {
             "id": u.id,
             "username": u.username
-        } for u in active_users]
-    }
-    
-    return jsonify(result)
+        })
+    })
 
 @app.route("/overview")
 def overview_dashboard():
@@ -884,69 +1363,43 @@ def overview_dashboard():
 
 # API for overview data
 @app.route("/api/overview_data")
+@conditional_on_data_version
 def get_overview_data():
     try:
         if 'user_id' not in session or session.get('role') != 'admin':
             return jsonify({"error": "Unauthorized"}), 401
             
-        print("📊 Fetching overview data from database...")
+        print("📊 Fetching overview data from province rollups...")
         
-        # Get all silos with their latest volume data
-        subquery = db.session.query(
-            VolumeData.device_id,
-            db.func.max(VolumeData.timestamp).label('max_timestamp')
-        ).group_by(VolumeData.device_id).subquery()
-
-        latest_volumes = db.session.query(VolumeData).join(
-            subquery,
-            (VolumeData.device_id == subquery.c.device_id) & 
-            (VolumeData.timestamp == subquery.c.max_timestamp)
-        ).join(SiloMeta, VolumeData.device_id == SiloMeta.device_id).all()
+        # ผลรวมต่อจังหวัดคำนวณไว้แล้วใน ProvinceRollup (อ่านแถวละจังหวัด ไม่วนทุกไซโล)
+        rollups = ProvinceRollup.query.filter(ProvinceRollup.silo_count > 0).all()
 
-        print(f"📈 Found {len(latest_volumes)} silos with volume data")
-
-        # Process data for overview
         branches_map = {}
         total_silos = 0
         total_capacity = 0
         total_used = 0
         total_low_capacity = 0
 
-        for volume in latest_volumes:
-            silo = volume.silo
-            province = silo.province
+        for rollup in rollups:
+            province = rollup.province
             
             # Skip invalid provinces
             if not province or 'deleted' in province.lower():
                 continue
-                
-            if province not in branches_map:
-                branches_map[province] = {
-                    'name': province,
-                    'siloCount': 0,
-                    'totalCapacity': 0,
-                    'totalUsed': 0,
-                    'lowCapacityCount': 0
-                }
-
-            silo_capacity = silo.capacity or 1000
-            current_amount = volume.volume or 0
-            percentage = (current_amount / silo_capacity) * 100 if silo_capacity > 0 else 0
-            is_low_capacity = percentage < 35
-            
-            # Update branch stats
-            branches_map[province]['siloCount'] += 1
-            branches_map[province]['totalCapacity'] += silo_capacity
-            branches_map[province]['totalUsed'] += current_amount
-            
-            if is_low_capacity:
-                branches_map[province]['lowCapacityCount'] += 1
-                total_low_capacity += 1
+
+            branches_map[province] = {
+                'name': province,
+                'siloCount': rollup.silo_count,
+                'totalCapacity': rollup.total_capacity,
+                'totalUsed': rollup.total_used,
+                'lowCapacityCount': rollup.low_capacity_count
+            }
             
             # Update total stats
-            total_silos += 1
-            total_capacity += silo_capacity
-            total_used += current_amount
+            total_silos += rollup.silo_count
+            total_capacity += rollup.total_capacity
+            total_used += rollup.total_used
+            total_low_capacity += rollup.low_capacity_count
 
         # Calculate percentages for each branch
         for branch in branches_map.values():
@@ -1070,6 +1523,49 @@ def delete_multiple_branches():
         return jsonify({"error": f"Failed to delete branches: {str(e)}"}), 500
 
 # API สำหรับเพิ่มไซโล (แก้ไข endpoint)
+def invalid_volume_engine(data):
+    """ข้อความ error ถ้า volume_engine / verify_engine ไม่อยู่ใน registry (ค่าว่าง = ใช้ default ของ worker)"""
+    for field in ('volume_engine', 'verify_engine'):
+        name = data.get(field)
+        if name and volume_engines.get_engine(name) is None:
+            return f"Unknown {field}: {name} (available: {', '.join(volume_engines.ENGINES)})"
+    return None
+
+@app.route("/api/admin/volume_engines", methods=["GET"])
+def list_volume_engines():
+    """engine คำนวณปริมาตรที่เลือกได้ต่อไซโล พร้อม cost (Admin only)"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(volume_engines.describe_engines())
+
+@app.route("/api/admin/silos/by_device/<string:device_id>/volume_engine", methods=["PUT"])
+def update_silo_volume_engine(device_id):
+    """ตั้ง engine หลัก / engine ตรวจสอบของไซโล (Admin only) ค่า null = ใช้ default ของ worker"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "No JSON data provided"}), 400
+    engine_error = invalid_volume_engine(data)
+    if engine_error:
+        return jsonify({"error": engine_error}), 400
+
+    silo = SiloMeta.query.filter_by(device_id=device_id).first()
+    if not silo:
+        return jsonify({"error": f"ไม่พบไซโลด้วย Device ID: {device_id}"}), 404
+    for field in ('volume_engine', 'verify_engine'):
+        if field in data:
+            setattr(silo, field, data[field] or None)
+    db.session.commit()
+
+    return jsonify({
+        "status": "success",
+        "device_id": silo.device_id,
+        "volume_engine": silo.volume_engine,
+        "verify_engine": silo.verify_engine
+    })
+
 @app.route("/api/admin/silos", methods=["POST"])
 def add_silo():
     """เพิ่มไซโลใหม่ (Admin only)"""
@@ -1087,6 +1583,10 @@ def add_silo():
             if not data.get(field):
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
+        engine_error = invalid_volume_engine(data)
+        if engine_error:
+            return jsonify({"error": engine_error}), 400
+
         # ตรวจสอบว่า device_id ซ้ำหรือไม่
         existing_silo = SiloMeta.query.filter_by(device_id=data['device_id']).first()
         if existing_silo:
@@ -1099,7 +1599,9 @@ def add_silo():
             province=data['province'],
             site_code=data['site_code'],
             silo_no=data['silo_no'],
-            capacity=data.get('capacity', 1000.0)
+            capacity=data.get('capacity', 1000.0),
+            volume_engine=data.get('volume_engine') or None,
+            verify_engine=data.get('verify_engine') or None
         )
         
         db.session.add(new_silo)
@@ -1134,13 +1636,28 @@ def delete_silo_by_device(device_id):
         
         silo_name = f"ไซโล {silo.silo_no} - {silo.site_code}"
         
+        blob_paths = {row.blob_path for row in db.session.query(MergedData.blob_path).filter(
+            MergedData.device_id == device_id, MergedData.blob_path.isnot(None))}
+
         # ลบข้อมูลที่เกี่ยวข้องทั้งหมด
         volume_deleted = VolumeData.query.filter_by(device_id=device_id).delete()
+        LatestVolume.query.filter_by(device_id=device_id).delete()
         silo_data_deleted = SiloData.query.filter_by(device_id=device_id).delete()
         merged_data_deleted = MergedData.query.filter_by(device_id=device_id).delete()
+        BatchLedger.query.filter_by(device_id=device_id).delete()
+        SiloGeometry.query.filter_by(device_id=device_id).delete()
+        SurfaceSnapshot.query.filter_by(device_id=device_id).delete()
+        mesh_queue.remove_device(device_id)
         
         db.session.delete(silo)
         db.session.commit()
+
+        # ลบไฟล์ blob ที่ไม่มี MergedData แถวอื่นอ้างถึงแล้ว (content-addressed อาจใช้ร่วมกัน)
+        if blob_paths:
+            still_used = {row.blob_path for row in db.session.query(MergedData.blob_path).filter(
+                MergedData.blob_path.in_(blob_paths))}
+            for path in blob_paths - still_used:
+                remove_points(path)
         
         print(f"✅ ลบไซโลสำเร็จ (by device_id): {silo_name}")
         
@@ -1213,16 +1730,7 @@ def debug_overview():
         volume_data = VolumeData.query.all()
         
         # นับข้อมูลล่าสุด
-        subquery = db.session.query(
-            VolumeData.device_id,
-            db.func.max(VolumeData.timestamp).label('max_timestamp')
-        ).group_by(VolumeData.device_id).subquery()
-
-        latest_volumes = db.session.query(VolumeData).join(
-            subquery,
-            (VolumeData.device_id == subquery.c.device_id) & 
-            (VolumeData.timestamp == subquery.c.max_timestamp)
-        ).all()
+        latest_volumes = LatestVolume.query.all()
         
         debug_info = {
             "total_silos": len(silos),
@@ -0,0 +1,54 @@
+"""
+สิทธิ์ของผู้ใช้ที่ login อยู่ (role และจังหวัดที่เข้าถึงได้) สำหรับ request ปัจจุบัน
+
+- AuthContext: โหลดครั้งเดียวใน before_request เก็บไว้ที่ flask.g.auth handler อ่านได้โดยไม่ query
+- AuthCache: cache ระดับ process แบบ LRU ข้าม request ผูกกับตัวนับ DataVersion 'auth'
+  trigger ใน SQLite เพิ่มตัวนับเมื่อ user/user_branch_access เปลี่ยน (จาก process ไหนก็ได้)
+  entry ที่โหลดตอนตัวนับเป็นค่าอื่นถือว่าเก่า ทุก process ของ gunicorn จึงเห็นสิทธิ์ใหม่ใน request ถัดไป
+"""
+import threading
+from collections import OrderedDict
+
+
+class AuthContext:
+    __slots__ = ('user_id', 'username', 'role', 'provinces')
+
+    def __init__(self, user_id, username, role, provinces):
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+        self.provinces = tuple(provinces)
+
+    @property
+    def restricted(self):
+        """role user เห็นเฉพาะจังหวัดใน UserBranchAccess role อื่นเห็นทุกสาขา"""
+        return self.role == 'user'
+
+    def can_access(self, province):
+        return not self.restricted or province in self.provinces
+
+
+class AuthCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # user_id -> (version, AuthContext หรือ None)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version, load):
+        """
+        AuthContext ของ user_id (None ถ้าไม่มี/ถูกลบ) version คือตัวนับ DataVersion ปัจจุบัน
+        เรียก load(user_id) เมื่อไม่มีใน cache หรือ entry โหลดไว้ตอน version อื่น
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        context = load(user_id)
+        with self._lock:
+            self._entries[user_id] = (version, context)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return context
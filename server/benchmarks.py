@@ -0,0 +1,286 @@
+"""
+Benchmark ของขั้นตอนประมวลผล point cloud ฝั่ง server
+
+    python benchmarks.py surface [--file ../sender/test/scan_data.xyz] [--grid-res 0.5]
+    python benchmarks.py circle [--file ...] [--seed 0]
+    python benchmarks.py volume [--file ...] [--grid-res 0.5]
+    python benchmarks.py parse [--file ...] [--seed 0]
+"""
+import argparse
+import io
+import multiprocessing as mp
+import os
+import resource
+import time
+import warnings
+
+import numpy as np
+
+from mesh_recon import (extract_surface_grid, fit_circle_ransac, circle_inliers,
+                        heightmap_empty_volume, poisson_empty_volume)
+from xyz_parser import parse_xyz, load_xyz
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_SCAN = os.path.join(basedir, '..', 'sender', 'test', 'scan_data.xyz')
+
+
+def load_scan(path):
+    points, _ = load_xyz(path)
+    return points
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def report(name, baseline_s, new_s):
+    print(f"{name:<28} {baseline_s * 1000:10.1f} ms -> {new_s * 1000:8.1f} ms  ({baseline_s / new_s:6.1f}x)")
+
+
+# ------------------ Surface (Grid Max Z) ------------------
+def surface_loop_reference(points, grid_res):
+    """loop เดิมของ mesh_recon (ก่อน vectorise) ใช้เป็น baseline"""
+    grid_map = {}
+    noise_points = []
+    for p in points:
+        x, y, z = p
+        key = (int(np.floor(x / grid_res)), int(np.floor(y / grid_res)))
+        if key not in grid_map:
+            grid_map[key] = p
+        elif z > grid_map[key][2]:
+            noise_points.append(grid_map[key])
+            grid_map[key] = p
+        else:
+            noise_points.append(p)
+    return np.array(list(grid_map.values())), np.array(noise_points).reshape(-1, 3)
+
+
+def bench_surface(points, grid_res):
+    (ref_surface, ref_noise), loop_s = timed(surface_loop_reference, points, grid_res, repeat=1)
+    (surface, noise_mask), vec_s = timed(extract_surface_grid, points, grid_res)
+
+    same_surface = np.array_equal(ref_surface, surface)
+    same_noise = np.array_equal(np.sort(ref_noise, axis=0), np.sort(points[noise_mask], axis=0))
+    print(f"Surface points: {len(surface)}, noise points: {int(noise_mask.sum())}")
+    print(f"Identical to loop: surface={same_surface}, noise={same_noise}")
+    report("grid max-z", loop_s, vec_s)
+    return same_surface and same_noise
+
+
+def dig_pit(points, geometry, radius=3.0, depth=3.0):
+    """ขุดหลุมลึก depth cm ที่ผิววัสดุกลางไซโล (จุดในวงรัศมี radius ลดลง)"""
+    inside = (points[:, 0] - geometry.center_x)**2 + (points[:, 1] - geometry.center_y)**2 < radius**2
+    dug = points.copy()
+    dug[inside, 2] -= depth
+    return dug
+
+
+def bench_incremental(points, seed=0, tolerance=0.01):
+    """
+    surface diff ของ run_meshing: incremental + baseline ต้องเท่ากับการคำนวณเต็ม
+    - สแกนเดิมซ้ำ (ผิวไม่เปลี่ยน): ต้องเท่ากันพอดี
+    - สแกนใหม่ของผิวเดิม (จุด jitter 0.05 cm) และผิวที่ถูกขุด: ต่างจากการคำนวณเต็มไม่เกิน tolerance
+    """
+    from types import SimpleNamespace
+
+    import silo_geometry
+    from run_meshing import DeviceState, GEOMETRY_FIELDS, StageTimer, clean_points, compute_scan
+
+    wall = silo_geometry.fit_wall(clean_points(points), seed=seed)
+    geometry = dict(dict.fromkeys(GEOMETRY_FIELDS), **wall)
+    geometry['calibrated_at'] = 1
+
+    def new_state():
+        return DeviceState('benchmark', 'heightmap', None, SimpleNamespace(**geometry))
+
+    rng = np.random.default_rng(seed)
+    rescan = points + rng.normal(0.0, 0.05, points.shape)
+    dug = dig_pit(points, SimpleNamespace(**geometry))
+
+    ok = True
+    for name, scan in (("same scan", points), ("rescan", rescan), ("dug pit", dug)):
+        state = new_state()
+        compute_scan(points, state, 1, StageTimer())
+        incremental, run = compute_scan(scan, state, 2, StageTimer())
+        full, _ = compute_scan(scan, new_state(), 2, StageTimer())
+        error = abs(incremental - full) / full
+        passed = run == 1 and (incremental == full if name == "same scan" else error <= tolerance)
+        print(f"{name}: incremental {incremental:.6f} m3, full {full:.6f} m3, diff {error:.3%} -> {passed}")
+        ok = ok and passed
+    return ok
+
+
+# ------------------ Circle fit (RANSAC) ------------------
+def circle_loop_reference(points_2d, iterations=5000, threshold=0.5):
+    """RANSAC เดิมของ mesh_recon (loop ทีละรอบ) ใช้เป็น baseline"""
+    best_circle = None
+    best_inliers = 0
+    n_points = len(points_2d)
+    for _ in range(iterations):
+        idx = np.random.choice(n_points, 3, replace=False)
+        p1, p2, p3 = points_2d[idx]
+        temp = p2[0]**2 + p2[1]**2
+        bc = (p1[0]**2 + p1[1]**2 - temp) / 2
+        cd = (temp - p3[0]**2 - p3[1]**2) / 2
+        det = (p1[0] - p2[0]) * (p2[1] - p3[1]) - (p2[0] - p3[0]) * (p1[1] - p2[1])
+        if abs(det) < 1e-6: continue
+        cx = (bc*(p2[1] - p3[1]) - cd*(p1[1] - p2[1])) / det
+        cy = ((p1[0] - p2[0])*cd - (p2[0] - p3[0])*bc) / det
+        radius = np.sqrt((p1[0] - cx)**2 + (p1[1] - cy)**2)
+        if radius < 10 or radius > 150: continue
+        dists = np.sqrt((points_2d[:, 0] - cx)**2 + (points_2d[:, 1] - cy)**2)
+        inliers = np.sum(np.abs(dists - radius) < threshold)
+        if inliers > best_inliers:
+            best_inliers = inliers
+            best_circle = (cx, cy, radius)
+    return best_circle
+
+
+def circle_quality(points_2d, circle, threshold=0.5):
+    mask = circle_inliers(points_2d, circle, threshold)
+    cx, cy, radius = circle
+    resid = np.sqrt((points_2d[mask, 0] - cx)**2 + (points_2d[mask, 1] - cy)**2) - radius
+    return int(mask.sum()), float(np.sqrt(np.mean(resid**2))) if mask.any() else float('nan')
+
+
+def synthetic_silo(n_wall=20000, n_clutter=60000, center=(3.0, -2.0), radius=25.0, seed=0):
+    """ผนังไซโลรัศมีที่รู้ค่า + noise + จุดผิวปูนภายใน สำหรับวัดความแม่นยำ"""
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0, 2 * np.pi, n_wall)
+    r = radius + rng.normal(0, 0.15, n_wall)
+    wall = np.column_stack([center[0] + r * np.cos(theta), center[1] + r * np.sin(theta)])
+    rr = radius * np.sqrt(rng.uniform(0, 0.9, n_clutter))
+    tt = rng.uniform(0, 2 * np.pi, n_clutter)
+    clutter = np.column_stack([center[0] + rr * np.cos(tt), center[1] + rr * np.sin(tt)])
+    return np.vstack([wall, clutter])
+
+
+def bench_circle(points, seed=0):
+    xy = np.ascontiguousarray(points[:, :2])
+    np.random.seed(seed)
+    ref, loop_s = timed(circle_loop_reference, xy, repeat=1)
+    new, vec_s = timed(fit_circle_ransac, xy, seed=seed)
+    for name, circle in (("loop", ref), ("batched", new)):
+        n_in, rms = circle_quality(xy, circle)
+        print(f"{name:<8} center=({circle[0]:.2f}, {circle[1]:.2f}) r={circle[2]:.2f}  inliers={n_in}  rms={rms:.3f}")
+    report("circle RANSAC (scan)", loop_s, vec_s)
+
+    truth = (3.0, -2.0, 25.0)
+    syn = synthetic_silo(center=truth[:2], radius=truth[2], seed=seed)
+    np.random.seed(seed)
+    ref, loop_s = timed(circle_loop_reference, syn, repeat=1)
+    new, vec_s = timed(fit_circle_ransac, syn, seed=seed)
+    for name, circle in (("loop", ref), ("batched", new)):
+        err_c = np.hypot(circle[0] - truth[0], circle[1] - truth[1])
+        print(f"{name:<8} synthetic: center error={err_c:.3f} cm, radius error={abs(circle[2] - truth[2]):.3f} cm")
+    report("circle RANSAC (synthetic)", loop_s, vec_s)
+
+
+# ------------------ XYZ text parsing ------------------
+def corrupt_lines(text, fraction=0.01, seed=0):
+    """จำลองข้อมูลจาก serial: ตัดบรรทัดกลางคัน และแทรกบรรทัดสถานะ (คืน text, จำนวนบรรทัดที่เสีย)"""
+    rng = np.random.default_rng(seed)
+    lines = text.splitlines()
+    bad = rng.choice(len(lines), max(1, int(len(lines) * fraction)), replace=False)
+    for i in bad:
+        lines[i] = lines[i][:len(lines[i]) // 2] if i % 2 else "[STATUS] tilt step"
+    return "\n".join(lines) + "\n", len(bad)
+
+
+def bench_parse(path, seed=0):
+    with open(path) as f:
+        text = f.read()
+
+    ref, loadtxt_s = timed(lambda: np.loadtxt(io.StringIO(text), dtype=np.float64, ndmin=2, usecols=(0, 1, 2)))
+    (points, skipped), parse_s = timed(parse_xyz, text)
+    print(f"Clean: {len(points)} points, skipped={skipped}, identical to loadtxt: {np.array_equal(ref, points)}")
+    report("xyz parse (clean)", loadtxt_s, parse_s)
+
+    # loadtxt หยุดที่บรรทัดเสีย baseline ที่ทนได้คือ genfromtxt(invalid_raise=False)
+    dirty, n_bad = corrupt_lines(text, seed=seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # genfromtxt เตือนทุกบรรทัดที่ข้าม
+        ref, genfromtxt_s = timed(lambda: np.genfromtxt(io.StringIO(dirty), dtype=np.float64, usecols=(0, 1, 2),
+                                                        invalid_raise=False, comments="[", loose=True), repeat=1)
+    ref = ref[~np.isnan(ref).any(axis=1)]
+    (points, skipped), parse_s = timed(parse_xyz, dirty)
+    print(f"Dirty: {n_bad} corrupted lines, {len(points)} points, skipped={skipped}, "
+          f"identical to genfromtxt: {np.array_equal(ref, points)}")
+    report("xyz parse (dirty)", genfromtxt_s, parse_s)
+
+    # แถว nan/inf ต้องถูกข้ามเสมอ และบรรทัดสั้นคู่กับบรรทัดยาว (token รวมครบ) ต้องไม่ทำให้จุดถัดไปเลื่อน
+    lines = text.splitlines()
+    mid = len(lines) // 2
+    odd_lines = (lines[:mid] + ["nan 1 2", "1 inf 3", "1e999 0 0"]
+                 + [" ".join(lines[mid].split()[:2]), lines[mid + 1] + " 9"] + lines[mid + 2:])
+    clean_points, _ = parse_xyz(text)
+    expected = np.delete(clean_points, [mid, mid + 1], axis=0)
+    for name, odd in (("clean", "\n".join(odd_lines)), ("dirty", "\n".join(odd_lines + ["[STATUS] tilt step"]))):
+        points, skipped = parse_xyz(odd)
+        print(f"Non-finite + misaligned lines ({name}): skipped={skipped}, "
+              f"only bad rows dropped: {np.array_equal(expected, points)}")
+
+
+# ------------------ Volume (heightmap vs Poisson) ------------------
+def _volume_child(method, points, circle, grid_res, out):
+    cx, cy, radius = circle
+    lid_z = float(np.max(points[:, 2]))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if method == "heightmap":
+        volume_cm3, _ = heightmap_empty_volume(points, cx, cy, radius, grid_res, lid_z=lid_z)
+    else:
+        dists = np.sqrt((points[:, 0] - cx)**2 + (points[:, 1] - cy)**2)
+        surface, _ = extract_surface_grid(points[dists < radius - 1.5], grid_res)
+        volume_cm3, _ = poisson_empty_volume(surface, cx, cy, radius, lid_z, grid_res)
+    elapsed = time.perf_counter() - t0
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out.put((volume_cm3, elapsed, (rss_peak - rss_before) / 1024.0))
+
+
+def bench_volume(points, grid_res, seed=0):
+    circle = fit_circle_ransac(points[:, :2], seed=seed)
+    print(f"Circle: center=({circle[0]:.2f}, {circle[1]:.2f}) r={circle[2]:.2f} cm")
+    # แยก process ต่อวิธี เพื่อให้ peak RSS (รวมหน่วยความจำของ Open3D) วัดแยกกันได้
+    ctx = mp.get_context("fork")
+    results = {}
+    for method in ("poisson", "heightmap"):
+        out = ctx.Queue()
+        p = ctx.Process(target=_volume_child, args=(method, points, circle, grid_res, out))
+        p.start()
+        results[method] = out.get()
+        p.join()
+        volume_cm3, elapsed, rss_mb = results[method]
+        print(f"{method:<10} empty volume={volume_cm3 / 1e6:.6f} m3  time={elapsed * 1000:8.1f} ms  peak +{rss_mb:7.1f} MB")
+    diff = abs(results["heightmap"][0] - results["poisson"][0]) / results["poisson"][0] * 100
+    print(f"Heightmap vs Poisson volume difference: {diff:.2f}%")
+    report("empty volume", results["poisson"][1], results["heightmap"][1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the meshing pipeline")
+    parser.add_argument("bench", choices=["surface", "circle", "volume", "parse"])
+    parser.add_argument("--file", default=DEFAULT_SCAN)
+    parser.add_argument("--grid-res", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.bench == "parse":
+        bench_parse(args.file, args.seed)
+        raise SystemExit
+
+    pts = load_scan(args.file)
+    print(f"Loaded {len(pts)} points from {args.file}")
+    if args.bench == "surface":
+        bench_surface(pts, args.grid_res)
+        bench_incremental(pts, args.seed)
+    elif args.bench == "circle":
+        bench_circle(pts, args.seed)
+    elif args.bench == "volume":
+        bench_volume(pts, args.grid_res, args.seed)
@@ -0,0 +1,119 @@
+"""
+Blob store แบบ content-addressed สำหรับ point cloud ที่ merge แล้ว
+
+ไฟล์ .npy (float32 Nx3) ถูกเก็บที่ Database/blobs/<sha[:2]>/<sha>.npy
+MergedData เก็บแค่ path, จำนวนจุด และ checksum ทำให้ payload ใหญ่ๆ ไม่ต้องผ่าน SQLite
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+BLOB_DIR = os.path.join(basedir, 'Database', 'blobs')
+
+
+def blob_abspath(rel_path, root=BLOB_DIR):
+    return os.path.join(root, rel_path)
+
+
+def _write_atomic(path, arr):
+    # เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกันแล้ว rename เพื่อไม่ให้ worker เห็นไฟล์ที่เขียนไม่เสร็จ
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, arr, allow_pickle=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def put_points(points, root=BLOB_DIR):
+    """บันทึก array (N, 3) แล้วคืน (rel_path, checksum)"""
+    arr = np.ascontiguousarray(np.asarray(points).reshape(-1, 3), dtype='<f4')
+    checksum = hashlib.sha256(arr.tobytes()).hexdigest()
+    rel_path = os.path.join(checksum[:2], f"{checksum}.npy")
+    path = blob_abspath(rel_path, root)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, arr)
+    return rel_path, checksum
+
+
+class BlobWriter:
+    """เขียน point cloud ทีละส่วน (streaming) แล้ว finalize เป็น .npy ตาม checksum
+
+    ใช้หน่วยความจำแค่ส่วนที่กำลังเขียน ไม่ต้องมี array ทั้งก้อนอยู่ในหน่วยความจำ
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        fd, self._raw_path = tempfile.mkstemp(dir=root, suffix='.raw')
+        self._raw = os.fdopen(fd, 'wb')
+        self._hash = hashlib.sha256()
+        self.n_points = 0
+
+    def write(self, points):
+        arr = np.ascontiguousarray(np.asarray(points).reshape(-1, 3), dtype='<f4')
+        if len(arr) == 0:
+            return
+        data = arr.tobytes()
+        self._hash.update(data)
+        self._raw.write(data)
+        self.n_points += len(arr)
+
+    def finalize(self):
+        """คืน (rel_path, checksum) เหมือน put_points"""
+        self._raw.close()
+        checksum = self._hash.hexdigest()
+        rel_path = os.path.join(checksum[:2], f"{checksum}.npy")
+        path = blob_abspath(rel_path, self.root)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as out, open(self._raw_path, 'rb') as raw:
+                        np.lib.format.write_array_header_1_0(out, {
+                            'descr': np.lib.format.dtype_to_descr(np.dtype('<f4')),
+                            'fortran_order': False,
+                            'shape': (self.n_points, 3),
+                        })
+                        shutil.copyfileobj(raw, out)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+        finally:
+            os.remove(self._raw_path)
+        return rel_path, checksum
+
+    def abort(self):
+        self._raw.close()
+        if os.path.exists(self._raw_path):
+            os.remove(self._raw_path)
+
+
+def open_points(rel_path, mmap=True, root=BLOB_DIR):
+    """เปิด blob เป็น array (N, 3); mmap=True จะไม่โหลดทั้งไฟล์เข้าหน่วยความจำ"""
+    return np.load(blob_abspath(rel_path, root), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+
+def verify_points(rel_path, checksum, root=BLOB_DIR):
+    arr = open_points(rel_path, mmap=True, root=root)
+    return hashlib.sha256(np.ascontiguousarray(arr).tobytes()).hexdigest() == checksum
+
+
+def remove_points(rel_path, root=BLOB_DIR):
+    """ลบไฟล์ blob (ผู้เรียกต้องตรวจสอบเองว่าไม่มีแถวอื่นอ้างถึง checksum เดียวกัน)"""
+    path = blob_abspath(rel_path, root)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
@@ -0,0 +1,118 @@
+"""
+Calibrate ไซโลจากการสแกนตอนไซโลว่าง: fit ผนัง (จุดศูนย์กลาง/รัศมี/ความสูง)
+และเก็บปริมาตรอากาศตอนว่างเป็นความจุอ้างอิงของไซโลนั้นใน SiloGeometry
+พร้อมเลือก voxel_size ของไซโล: voxel ใหญ่สุดที่ปริมาตรคลาดจากการไม่ลดจุดไม่เกิน VOXEL_TOLERANCE
+
+    python calibrate_silo.py <device_id> [--merged-id ID] [--voxel-size CM]
+
+ไม่ระบุ --merged-id จะใช้ MergedData ล่าสุดของ device
+ระบุ --voxel-size เพื่อใช้ค่านั้นโดยไม่ sweep (0 = ไม่ลดจุด)
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+
+from run_meshing import (app, db, MergedData, SiloGeometry,
+                         load_merged_points, clean_points, prepare_points, empty_volume_m3,
+                         silo_engines)
+import silo_geometry
+
+VOXEL_CANDIDATES = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0)  # cm
+VOXEL_TOLERANCE = 0.01  # ปริมาตรคลาดได้ไม่เกิน 1% ของค่าที่ไม่ลดจุด
+
+
+def voxel_sweep(points, geometry, candidates=VOXEL_CANDIDATES, repeat=1, method=None):
+    """
+    รัน downsample -> clean -> ปริมาตร ที่ voxel 0 (อ้างอิง) และทุก candidate
+    คืน list ของ dict(voxel_size, points, seconds, volume_m3, error) โดย seconds เป็นค่าดีที่สุดจาก repeat รอบ
+    """
+    results = []
+    for voxel_size in (0.0,) + tuple(candidates):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            cleaned = prepare_points(points, voxel_size)
+            volume = empty_volume_m3(cleaned, geometry, method)
+            seconds = time.perf_counter() - t0
+            best = seconds if best is None else min(best, seconds)
+        results.append({'voxel_size': voxel_size, 'points': len(cleaned), 'seconds': best, 'volume_m3': volume})
+
+    reference = results[0]['volume_m3']
+    for row in results:
+        row['error'] = abs(row['volume_m3'] - reference) / reference if reference else 0.0
+    return results
+
+
+def choose_voxel_size(results, tolerance=VOXEL_TOLERANCE):
+    """voxel ใหญ่สุดที่คลาดไม่เกิน tolerance และเร็วกว่าไม่ลดจุด (0 ถ้าไม่มี)"""
+    baseline = results[0]['seconds']
+    accepted = [row['voxel_size'] for row in results[1:]
+                if row['error'] <= tolerance and row['seconds'] < baseline]
+    return max(accepted, default=0.0)
+
+
+def print_sweep(results, chosen=None):
+    print(f"{'voxel cm':>8} {'points':>8} {'time ms':>8} {'volume m3':>10} {'error':>7}")
+    for row in results:
+        marker = "  <-" if row['voxel_size'] == chosen else ""
+        print(f"{row['voxel_size']:>8.2f} {row['points']:>8} {row['seconds'] * 1000:>8.0f} "
+              f"{row['volume_m3']:>10.6f} {row['error']:>7.2%}{marker}")
+
+
+def calibrate(device_id, merged_id=None, voxel_size=None):
+    with app.app_context():
+        query = MergedData.query.filter_by(device_id=device_id)
+        if merged_id is not None:
+            query = query.filter_by(id=merged_id)
+        scan = query.order_by(MergedData.timestamp.desc()).first()
+        if scan is None:
+            print(f"No scan found for {device_id}")
+            return None
+
+        print(f"Calibrating {device_id} from batch {scan.batch_id} (MergedData #{scan.id})...")
+        raw_points = load_merged_points(scan)
+        points = clean_points(raw_points)
+        wall = silo_geometry.fit_wall(points)
+        if wall is None:
+            print("Could not fit the silo wall from this scan.")
+            return None
+
+        geometry = db.session.get(SiloGeometry, device_id)
+        if geometry is None:
+            geometry = SiloGeometry(device_id=device_id)
+            db.session.add(geometry)
+        for key, value in wall.items():
+            setattr(geometry, key, value)
+
+        method, _ = silo_engines(device_id)
+        if voxel_size is None:
+            results = voxel_sweep(raw_points, geometry, method=method)
+            voxel_size = choose_voxel_size(results)
+            print_sweep(results, voxel_size)
+        geometry.voxel_size = voxel_size
+
+        # ใช้ขั้นตอนเดียวกับ worker (voxel + volume engine ของไซโล) เพื่อให้ความจุอ้างอิงและ inlier ratio เทียบกันได้
+        points = prepare_points(raw_points, voxel_size)
+        geometry.inlier_ratio = silo_geometry.wall_inlier_ratio(points, geometry)
+        geometry.empty_volume_m3 = empty_volume_m3(points, geometry, method)
+        geometry.calibration_merged_id = scan.id
+        geometry.calibrated_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+        print("=" * 40)
+        print(f"Center: ({geometry.center_x:.2f}, {geometry.center_y:.2f}) cm, Radius: {geometry.radius:.2f} cm")
+        print(f"Height: {geometry.height:.2f} cm, Wall inliers: {geometry.inlier_ratio:.1%}")
+        print(f"Empty volume (capacity): {geometry.empty_volume_m3:.6f} m3 ({method})")
+        print(f"Voxel size: {geometry.voxel_size:.2f} cm")
+        print("=" * 40)
+        return geometry.empty_volume_m3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate silo geometry from an empty-silo scan")
+    parser.add_argument("device_id")
+    parser.add_argument("--merged-id", type=int, default=None)
+    parser.add_argument("--voxel-size", type=float, default=None,
+                        help="voxel size in cm for the worker's downsampling (default: sweep and pick)")
+    args = parser.parse_args()
+    calibrate(args.device_id, args.merged_id, args.voxel_size)
@@ -0,0 +1,66 @@
+"""
+ตรวจว่า voxel downsample ของ worker ไม่ทำให้ปริมาตรเพี้ยน และทำให้ worker เร็วขึ้นจริง
+fit ผนังจากไฟล์ .xyz แล้ว sweep voxel เหมือน calibrate_silo.py (แต่ไม่แตะฐานข้อมูล)
+exit code 1 ถ้า voxel ที่ตรวจ (default: VOXEL_SIZE ของ worker หรือค่าที่ sweep เลือกถ้า VOXEL_SIZE เป็น 0)
+คลาดเกิน VOXEL_TOLERANCE หรือไม่เร็วกว่าไม่ลดจุด
+
+    python check_downsampling.py [--file scan.xyz] [--voxel-size CM] [--repeat N]
+"""
+import argparse
+import os
+import sys
+
+from run_meshing import VOXEL_SIZE, clean_points
+from calibrate_silo import VOXEL_CANDIDATES, VOXEL_TOLERANCE, voxel_sweep, choose_voxel_size, print_sweep
+from xyz_parser import load_xyz
+import silo_geometry
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_SCAN = os.path.join(basedir, '..', 'sender', 'test', 'scan_data.xyz')
+
+
+class ScanGeometry:
+    """แทน SiloGeometry (ไม่ใช้ session) สำหรับ empty_volume_m3"""
+
+    def __init__(self, wall):
+        for key, value in wall.items():
+            setattr(self, key, value)
+
+
+def check(path, voxel_size=VOXEL_SIZE, repeat=3, tolerance=VOXEL_TOLERANCE):
+    points, skipped = load_xyz(path)
+    print(f"Loaded {len(points)} points from {path} (skipped {skipped} line(s))")
+    wall = silo_geometry.fit_wall(clean_points(points), seed=0)
+    if wall is None:
+        print("Could not fit the silo wall from this scan.")
+        return False
+    geometry = ScanGeometry(wall)
+
+    candidates = tuple(sorted(set(VOXEL_CANDIDATES) | ({voxel_size} if voxel_size > 0 else set())))
+    results = voxel_sweep(points, geometry, candidates, repeat=repeat)
+    chosen = choose_voxel_size(results, tolerance)
+    print_sweep(results, voxel_size if voxel_size > 0 else chosen)
+    print(f"Largest voxel within {tolerance:.0%}: {chosen:.2f} cm")
+    if voxel_size <= 0:
+        # worker ไม่ลดจุดจนกว่าจะ calibrate ต่อไซโล: ตรวจค่าที่ calibrate_silo.py จะเลือกแทน
+        voxel_size = chosen
+        if voxel_size <= 0:
+            print("No voxel size stays within tolerance; downsampling stays off.")
+            return True
+
+    baseline = results[0]
+    row = next(row for row in results if row['voxel_size'] == voxel_size)
+    ok = row['error'] <= tolerance and row['seconds'] < baseline['seconds']
+    print(f"[{'ok' if ok else 'FAIL':>4}] voxel {voxel_size:.2f} cm: volume error {row['error']:.2%} "
+          f"(limit {tolerance:.0%}), {baseline['seconds'] * 1000:.0f} -> {row['seconds'] * 1000:.0f} ms, "
+          f"{baseline['points']} -> {row['points']} points after cleaning")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if voxel downsampling shifts the volume or does not save time")
+    parser.add_argument("--file", default=DEFAULT_SCAN)
+    parser.add_argument("--voxel-size", type=float, default=VOXEL_SIZE)
+    parser.add_argument("--repeat", type=int, default=3, help="best-of-N timing per voxel size")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.file, args.voxel_size, args.repeat) else 1)
@@ -0,0 +1,132 @@
+"""
+ตรวจว่าจำนวน SQL query ต่อ request ของ endpoint ไม่โตตามจำนวน user / สาขา / ไซโล (N+1)
+เพิ่มข้อมูลทดสอบ (prefix qc_) สองขนาด เรียก endpoint ผ่าน test client แล้วเทียบจำนวน query
+ถ้าขนาดใหญ่ใช้ query มากกว่าขนาดเล็ก จะ exit code 1
+
+    python check_query_counts.py [-v]
+
+ไม่แตะฐานข้อมูลของ app: ตั้ง DATABASE_URL เป็นไฟล์ SQLite ชั่วคราวก่อน import app
+(init_db สร้าง schema / trigger เดียวกันในไฟล์นั้น) แล้วลบไฟล์ทิ้งเมื่อจบ ใช้ใน CI หรือหลังแก้ endpoint
+"""
+import argparse
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+_db_dir = tempfile.TemporaryDirectory(prefix='check_query_counts_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir.name, 'check.sqlite3')
+
+from sqlalchemy import event
+
+from app import app, db, User, UserBranchAccess, SiloMeta, LatestVolume
+
+PREFIX = 'qc_'
+SIZES = (2, 6)
+
+# (ชื่อ, path) เรียกในฐานะ admin
+ENDPOINTS = [
+    ("admin user list", "/api/admin/users"),
+    ("admin branch list", "/api/admin/all_branches"),
+    ("debug data", "/api/debug"),
+    ("volume data", "/api/volume_data"),
+    ("silo list", "/api/silos"),
+    ("overview data", "/api/overview_data"),
+]
+
+
+def seed(n):
+    """n user (role user, สาขาละ 2 สิทธิ์), n สาขา, สาขาละ 2 ไซโลพร้อม LatestVolume คืน id ของ admin ทดสอบ"""
+    admin = User(username=f'{PREFIX}admin', role='admin')
+    admin.set_password(PREFIX)
+    db.session.add(admin)
+    provinces = [f'{PREFIX}province_{i}' for i in range(n)]
+    now = datetime.now(timezone.utc)
+    for i, province in enumerate(provinces):
+        user = User(username=f'{PREFIX}user_{i}', role='user')
+        user.set_password(PREFIX)
+        user.branch_access = [UserBranchAccess(province=province),
+                              UserBranchAccess(province=provinces[(i + 1) % n])]
+        db.session.add(user)
+        for silo_no in range(2):
+            device_id = f'{PREFIX}{i}_{silo_no}'
+            db.session.add(SiloMeta(device_id=device_id, province=province, silo_no=str(silo_no), capacity=1000.0))
+            db.session.add(LatestVolume(device_id=device_id, volume_data_id=0, timestamp=now, volume=500.0))
+    db.session.commit()
+    return admin.id
+
+
+def cleanup():
+    """ลบข้อมูลของขนาดก่อนหน้า (ในฐานข้อมูลชั่วคราวเท่านั้น) autoescape: '_' ใน prefix ไม่เป็น wildcard ของ LIKE"""
+    device_ids = db.session.query(SiloMeta.device_id).filter(SiloMeta.device_id.startswith(PREFIX, autoescape=True))
+    LatestVolume.query.filter(LatestVolume.device_id.in_(device_ids.scalar_subquery())).delete(synchronize_session=False)
+    SiloMeta.query.filter(SiloMeta.device_id.startswith(PREFIX, autoescape=True)).delete(synchronize_session=False)
+    user_ids = db.session.query(User.id).filter(User.username.startswith(PREFIX, autoescape=True))
+    UserBranchAccess.query.filter(UserBranchAccess.user_id.in_(user_ids.scalar_subquery())).delete(synchronize_session=False)
+    User.query.filter(User.username.startswith(PREFIX, autoescape=True)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@contextmanager
+def count_queries(statements):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def measure(n):
+    """{ชื่อ endpoint: [SQL ที่รัน]} ที่ขนาดข้อมูล n"""
+    with app.app_context():
+        cleanup()
+        admin_id = seed(n)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+        session['username'] = f'{PREFIX}admin'
+        session['role'] = 'admin'
+
+    results = {}
+    for name, path in ENDPOINTS:
+        statements = []
+        with app.app_context(), count_queries(statements):
+            response = client.get(path)
+            response.get_data()  # endpoint แบบ stream query ระหว่างส่ง body
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+        results[name] = statements
+    return results
+
+
+def check(verbose=False):
+    try:
+        small, large = (measure(n) for n in SIZES)
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        _db_dir.cleanup()
+
+    failures = 0
+    for name, path in ENDPOINTS:
+        grew = len(large[name]) > len(small[name])
+        status = "FAIL" if grew else "ok"
+        print(f"[{status:>4}] {name} ({path}): {len(small[name])} -> {len(large[name])} queries"
+              f" at {SIZES[0]} -> {SIZES[1]} branches")
+        if verbose or grew:
+            for statement in large[name]:
+                print(f"         {' '.join(statement.split())[:160]}")
+        failures += grew
+    print(f"{failures} regression(s)" if failures else "No endpoint query count grows with the data.")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if an endpoint's query count grows with users/branches/silos")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the SQL of every endpoint")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.verbose) else 1)
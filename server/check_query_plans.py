@@ -0,0 +1,90 @@
+"""
+ตรวจ EXPLAIN QUERY PLAN ของ query ที่ถูกเรียกบ่อย (dashboard, worker, upload_chunk)
+ถ้า query ไหนกลับไปเป็น full table scan (SCAN <table> โดยไม่ใช้ index) จะ exit code 1
+
+    python check_query_plans.py [-v]
+
+รันกับฐานข้อมูลของ app (init_db สร้าง/migrate index ให้ก่อน) ใช้ใน CI หรือหลังแก้ model/query
+"""
+import argparse
+import re
+import sys
+import time
+
+from app import app, db, VolumeData, LatestVolume, SiloMeta, SiloData, MergedData, \
+    UserBranchAccess, BatchLedger
+from job_queue import NEXT_JOB_SQL
+
+TABLE_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def hot_queries():
+    """(ชื่อ, statement หรือ SQL, ตารางที่ยอมให้ scan ได้)"""
+    since = time.time()
+    return [
+        ("volume history window",
+         db.select(VolumeData).where(VolumeData.device_id == 'D', VolumeData.timestamp >= since)
+         .order_by(VolumeData.timestamp), ()),
+        ("latest volume per device (admin)",
+         # projection มีแถวละไซโล การอ่านทั้งตารางคือสิ่งที่ต้องการ
+         db.select(LatestVolume, SiloMeta).join(SiloMeta, LatestVolume.device_id == SiloMeta.device_id),
+         ('latest_volume',)),
+        ("latest volume per device (user branches)",
+         db.select(LatestVolume, SiloMeta).join(SiloMeta, LatestVolume.device_id == SiloMeta.device_id)
+         .where(SiloMeta.province.in_(['P1', 'P2'])), ()),
+        ("latest volume backfill",
+         "SELECT device_id, MAX(timestamp) FROM volume_data GROUP BY device_id", ()),
+        ("user branch access by user",
+         db.select(UserBranchAccess).where(UserBranchAccess.user_id == 1), ()),
+        ("user branch access by province",
+         db.select(db.func.count()).select_from(UserBranchAccess).where(UserBranchAccess.province == 'P'), ()),
+        ("silos by province",
+         db.select(db.func.count()).select_from(SiloMeta).where(SiloMeta.province == 'P'), ()),
+        ("chunk count for batch",
+         db.select(db.func.count(SiloData.id)).where(SiloData.batch_id == 'B'), ()),
+        ("chunk stream for merge",
+         db.select(SiloData.point_cloud).where(SiloData.batch_id == 'B').order_by(SiloData.chunk_id), ()),
+        ("batch ledger",
+         db.select(BatchLedger).where(BatchLedger.batch_id == 'B'), ()),
+        ("unprocessed scans",
+         db.select(MergedData.id, MergedData.device_id).where(MergedData.mesh_processed == False)
+         .order_by(MergedData.timestamp), ()),
+        ("latest scan of device",
+         db.select(MergedData).where(MergedData.device_id == 'D').order_by(MergedData.timestamp.desc()).limit(1), ()),
+        ("worker job pick", NEXT_JOB_SQL, ()),
+    ]
+
+
+def explain(conn, query):
+    if isinstance(query, str):
+        # ค่า parameter ไม่มีผลต่อ plan (ไม่มี sqlite_stat1) ส่ง NULL แทนทั้งหมด
+        sql = re.sub(r':\w+', '?', query)
+    else:
+        sql = str(query.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True}))
+    params = (None,) * sql.count('?')
+    return [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def check(verbose=False):
+    failures = 0
+    with app.app_context(), db.engine.connect() as conn:
+        tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name, query, allowed in hot_queries():
+            plan = explain(conn, query)
+            scans = [m.group(1) for m in map(TABLE_SCAN.match, plan)
+                     if m and m.group(1) in tables and m.group(1) not in allowed]
+            status = "FAIL" if scans else "ok"
+            print(f"[{status:>4}] {name}" + (f"  (table scan: {', '.join(scans)})" if scans else ""))
+            if verbose or scans:
+                for detail in plan:
+                    print(f"         {detail}")
+            failures += bool(scans)
+    print(f"{failures} regression(s)" if failures else "All hot queries use indexes.")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a hot query regresses to a full table scan")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every query plan")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.verbose) else 1)
@@ -0,0 +1,17 @@
+"""
+ค่า gunicorn ของ web app (gunicorn อ่านไฟล์นี้เองเมื่อรันจากโฟลเดอร์ server/)
+
+    cd server && gunicorn app:app
+
+/api/stream (SSE) ถือ connection ไว้ตลอดที่ dashboard เปิด (สูงสุด STREAM_MAX_AGE) และกินหนึ่ง worker ต่อ connection
+sync worker (default ของ gunicorn) มีหนึ่ง connection ต่อ process dashboard ไม่กี่จอก็ทำให้ request อื่นค้างหมด
+จึงต้องใช้ gthread: แต่ละ stream ใช้แค่ thread เดียว threads ต้องมากกว่าจำนวน dashboard ที่เปิดพร้อมกันต่อ process
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# stream ส่ง keepalive ทุก STREAM_KEEPALIVE วินาที timeout ต้องยาวกว่านั้น
+timeout = 60
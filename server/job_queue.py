@@ -0,0 +1,218 @@
+"""
+Job queue ระหว่าง upload_chunk (ผู้ผลิต) กับ meshing worker (ผู้บริโภค)
+
+- SQLiteJobQueue: เก็บงานในตาราง mesh_job ของฐานข้อมูลเดียวกัน (ทนต่อการ restart)
+  สถานะ: queued -> running -> done / failed, นับ attempts และมี visibility timeout
+  ถ้า worker ตายระหว่างทำงาน งานจะกลับมาให้ claim ได้อีกเมื่อหมดเวลา (lease)
+  การ claim แต่ละครั้งได้ claim_token ใหม่ complete/fail ต้องส่ง token มาด้วย
+  worker ที่เสีย lease ไปแล้วจึงเขียนทับผลของ worker ที่ reclaim ไม่ได้
+- Notifier: ปลุก worker ทันทีเมื่อมีงานใหม่ ผ่าน threading.Event (process เดียวกัน)
+  และ Unix datagram socket (ข้าม process) แทนการ sleep 60 วินาที
+"""
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+NOTIFY_SOCKET = os.path.join(basedir, 'Database', 'mesh_worker.sock')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# งานถัดไปที่ claim ได้ :limit งาน (ใช้ index ix_mesh_job_state_visible; check_query_plans.py ตรวจ plan นี้)
+NEXT_JOB_SQL = """
+    SELECT id FROM mesh_job
+    WHERE state IN (:queued, :running) AND visible_at <= :now AND attempts < :max_attempts
+    ORDER BY id LIMIT :limit
+"""
+
+
+class Notifier:
+    """ปลุก worker: in-process ด้วย Event และข้าม process ด้วย Unix socket (ถ้า OS รองรับ)"""
+
+    def __init__(self, socket_path=NOTIFY_SOCKET):
+        self.socket_path = socket_path
+        self._event = threading.Event()
+        self._sock = None
+
+    @property
+    def supports_socket(self):
+        return hasattr(socket, 'AF_UNIX') and os.name != 'nt'
+
+    def listen(self):
+        """เรียกจากฝั่ง worker ครั้งเดียวก่อนเข้า loop"""
+        if not self.supports_socket or self._sock is not None:
+            return
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.socket_path)
+        self._sock.setblocking(False)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def notify(self):
+        self._event.set()
+        if not self.supports_socket:
+            return
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+                s.sendto(b'1', self.socket_path)
+        except OSError:
+            # ไม่มี worker ฟังอยู่ งานยังอยู่ในคิว worker จะเจอเองตอน start/poll
+            pass
+
+    def wait(self, timeout):
+        """รอจนมีการ notify หรือหมดเวลา คืนค่า True ถ้าถูกปลุก"""
+        if self._event.is_set():
+            self._event.clear()
+            return True
+        if self._sock is None:
+            woke = self._event.wait(timeout)
+            self._event.clear()
+            return woke
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if not ready:
+            return False
+        # อ่านทิ้งทั้งหมด หลาย notify รวมเป็นการปลุกครั้งเดียว
+        while True:
+            try:
+                self._sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+        return True
+
+
+class SQLiteJobQueue:
+    def __init__(self, db, visibility_timeout=600, max_attempts=3, retry_delay=30, notifier=None):
+        self.db = db
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.notifier = notifier or Notifier()
+
+    def ensure_schema(self):
+        with self.db.engine.begin() as conn:
+            conn.exec_driver_sql("""
+                CREATE TABLE IF NOT EXISTS mesh_job (
+                    id INTEGER PRIMARY KEY,
+                    merged_id INTEGER NOT NULL UNIQUE,
+                    device_id VARCHAR(50),
+                    state VARCHAR(10) NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at FLOAT NOT NULL,
+                    visible_at FLOAT NOT NULL,
+                    started_at FLOAT,
+                    finished_at FLOAT,
+                    last_error TEXT
+                )
+            """)
+            existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(mesh_job)")}
+            for column, ddl in (('claim_token', 'VARCHAR(32)'), ('claimed_at', 'FLOAT')):
+                if column not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE mesh_job ADD COLUMN {column} {ddl}")
+            conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_mesh_job_state_visible ON mesh_job (state, visible_at)"
+            )
+
+    def enqueue(self, merged_id, device_id=None):
+        """เพิ่มงานใน transaction ของผู้เรียก (commit พร้อม MergedData แล้วค่อย notify)"""
+        now = time.time()
+        self.db.session.execute(text("""
+            INSERT OR IGNORE INTO mesh_job (merged_id, device_id, state, attempts, enqueued_at, visible_at)
+            VALUES (:merged_id, :device_id, :state, 0, :now, :now)
+        """), {'merged_id': merged_id, 'device_id': device_id, 'state': QUEUED, 'now': now})
+
+    def claim(self):
+        """คืน dict ของงานที่จองได้ หรือ None"""
+        jobs = self.claim_many(1)
+        return jobs[0] if jobs else None
+
+    def claim_many(self, limit):
+        """
+        จองงานถัดไปไม่เกิน limit งานในคำสั่งเดียว ทุกงานได้ lease (visibility_timeout) และ claim_token ชุดเดียวกัน
+        complete/fail ยังทำทีละงานได้ตามปกติ
+        """
+        now = time.time()
+        session = self.db.session
+        # งานที่ค้าง running เกินเวลาและใช้ attempts หมดแล้ว ให้ถือว่า failed
+        session.execute(text("""
+            UPDATE mesh_job SET state = :failed, finished_at = :now,
+                   last_error = COALESCE(last_error, 'visibility timeout exceeded')
+            WHERE state = :running AND visible_at <= :now AND attempts >= :max_attempts
+        """), {'failed': FAILED, 'running': RUNNING, 'now': now, 'max_attempts': self.max_attempts})
+        # UPDATE ... WHERE id IN (SELECT ...) เป็นคำสั่งเดียว SQLite ถือ write lock ตลอด จึง atomic
+        # แม้หลาย process จะ claim พร้อมกันก็ได้งานไม่ซ้ำกัน
+        rows = session.execute(text("""
+            UPDATE mesh_job
+            SET state = :running, attempts = attempts + 1, started_at = :now, visible_at = :deadline,
+                claim_token = :token, claimed_at = :now
+            WHERE id IN (""" + NEXT_JOB_SQL + """)
+            RETURNING id, merged_id, device_id, attempts, claim_token
+        """), {
+            'running': RUNNING, 'queued': QUEUED, 'now': now, 'token': uuid.uuid4().hex,
+            'deadline': now + self.visibility_timeout, 'max_attempts': self.max_attempts, 'limit': limit
+        }).mappings().all()
+        # RETURNING ไม่รับประกันลำดับ
+        jobs = sorted((dict(row) for row in rows), key=lambda job: job['merged_id'])
+        session.commit()
+        return jobs
+
+    def complete(self, job):
+        """ทำเครื่องหมาย done ใน transaction ของผู้เรียก (commit พร้อม VolumeData)
+
+        คืนค่า False ถ้า lease ถูก worker อื่น reclaim ไปแล้ว ผู้เรียกควร rollback
+        """
+        result = self.db.session.execute(text("""
+            UPDATE mesh_job SET state = :done, finished_at = :now, last_error = NULL
+            WHERE id = :id AND claim_token = :token
+        """), {'done': DONE, 'now': time.time(), 'id': job['id'], 'token': job['claim_token']})
+        return result.rowcount == 1
+
+    def fail(self, job, error):
+        """ถ้ายังไม่ครบ max_attempts จะกลับไป queued หลัง retry_delay"""
+        now = time.time()
+        self.db.session.execute(text("""
+            UPDATE mesh_job
+            SET state = CASE WHEN attempts >= :max_attempts THEN :failed ELSE :queued END,
+                visible_at = :retry_at,
+                finished_at = CASE WHEN attempts >= :max_attempts THEN :now ELSE NULL END,
+                last_error = :error
+            WHERE id = :id AND claim_token = :token
+        """), {
+            'max_attempts': self.max_attempts, 'failed': FAILED, 'queued': QUEUED,
+            'retry_at': now + self.retry_delay, 'now': now, 'error': str(error)[:1000],
+            'id': job['id'], 'token': job['claim_token']
+        })
+        self.db.session.commit()
+
+    def remove_device(self, device_id):
+        """ลบงานของ device ที่ถูกลบ (ใน transaction ของผู้เรียก)"""
+        self.db.session.execute(text("DELETE FROM mesh_job WHERE device_id = :device_id"),
+                                {'device_id': device_id})
+
+    def counts(self):
+        rows = self.db.session.execute(text("SELECT state, COUNT(*) FROM mesh_job GROUP BY state"))
+        return {state: count for state, count in rows}
+
+    def listen(self):
+        self.notifier.listen()
+
+    def notify(self):
+        self.notifier.notify()
+
+    def wait(self, timeout):
+        return self.notifier.wait(timeout)
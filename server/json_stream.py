@@ -0,0 +1,100 @@
+"""
+ส่ง response JSON ขนาดใหญ่แบบ stream: serialise ทีละแถวแล้วส่งออกเป็นชิ้น (ไม่สร้าง list ทั้งก้อนก่อน jsonify)
+
+- stream_json(rows, serialize): JSON array หรือ NDJSON (บรรทัดละแถว) ถ้า client ขอ Accept: application/x-ndjson
+- stream_json_object({...}): object ที่บาง field เป็น JSONRows (stream เป็น array) เช่น debug endpoint
+
+rows ควรเป็น iterator ที่อ่านจากฐานข้อมูลทีละชุด (query.yield_per / execution_options(yield_per=...))
+generator ทำงานภายใต้ stream_with_context จึงยังใช้ db.session ของ request ได้จนส่งครบ
+หน่วยความจำต่อ request จึงคงที่ ไม่ขึ้นกับจำนวนแถว
+
+error ระหว่าง stream (เช่น DB ล้มกลาง cursor) เกิดหลังส่ง status 200 และ body บางส่วนไปแล้ว
+try/except ของ endpoint จับไม่ได้ และเปลี่ยน status ไม่ได้: _guarded log error พร้อม path แล้ว raise ต่อ
+ให้ server ตัด connection โดยไม่ส่ง chunk ปิดท้าย client จึงเห็น body ไม่ครบ (JSON ไม่สมบูรณ์ / transfer ไม่ครบ)
+ไม่ใช่ array ที่สั้นลงแบบเงียบๆ
+"""
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+CHUNK_SIZE = 64 * 1024  # รวมแถวเล็กๆ เป็นชิ้นละ ~64 KB ก่อนส่ง
+YIELD_PER = 500
+
+
+class JSONRows:
+    """field ของ stream_json_object ที่ต้อง stream เป็น array"""
+
+    def __init__(self, rows, serialize=None):
+        self.rows = rows
+        self.serialize = serialize or (lambda row: row)
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def _dumps(value):
+    # provider ของ app: encode datetime ฯลฯ และเรียง key เหมือน jsonify
+    return current_app.json.dumps(value)
+
+
+def _chunked(pieces, chunk_size=CHUNK_SIZE):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _array(rows):
+    yield '['
+    separator = ''
+    for row in rows.rows:
+        yield separator + _dumps(rows.serialize(row))
+        separator = ','
+    yield ']'
+
+
+def _object(fields):
+    yield '{'
+    separator = ''
+    for key, value in fields.items():
+        yield separator + _dumps(key) + ':'
+        if isinstance(value, JSONRows):
+            yield from _array(value)
+        else:
+            yield _dumps(value)
+        separator = ','
+    yield '}'
+
+
+def _guarded(pieces):
+    sent = 0
+    try:
+        for piece in pieces:
+            sent += len(piece)
+            yield piece
+    except Exception:
+        current_app.logger.exception("JSON stream for %s failed after %d bytes, response truncated",
+                                     request.path, sent)
+        raise
+
+
+def _response(pieces, mimetype):
+    return Response(stream_with_context(_guarded(_chunked(pieces))), mimetype=mimetype)
+
+
+def stream_json(rows, serialize=None):
+    rows = JSONRows(rows, serialize)
+    if wants_ndjson():
+        return _response((_dumps(rows.serialize(row)) + '\n' for row in rows.rows), NDJSON)
+    return _response(_array(rows), 'application/json')
+
+
+def stream_json_object(fields):
+    return _response(_object(fields), 'application/json')
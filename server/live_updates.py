@@ -0,0 +1,141 @@
+"""
+Live update ของ dashboard ผ่าน Server-Sent Events (/api/stream)
+
+- publish(): worker เรียกหลัง commit VolumeData ส่ง datagram สั้นๆ ไปยัง Unix socket ของทุก web process
+  (แต่ละ gunicorn worker bind socket ของตัวเองใน STREAM_SOCKET_DIR)
+- VolumeBroker: หนึ่ง thread ต่อ web process ตื่นเมื่อได้ datagram (หรือทุก poll_interval เป็น fallback)
+  แล้ว query latest_volume ที่ใหม่กว่า cursor ครั้งเดียว กระจาย event ให้ทุก subscriber ใน process นั้น
+  จำนวน query จึงขึ้นกับอัตราการสแกน ไม่ขึ้นกับจำนวนคนที่เปิด dashboard
+
+ข้อมูลจริงอยู่ในฐานข้อมูลเสมอ datagram เป็นแค่การปลุก ถ้าหายไปก็แค่ช้าลงถึง poll_interval
+"""
+import os
+import queue
+import select
+import socket
+import threading
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+STREAM_SOCKET_DIR = os.path.join(basedir, 'Database', 'stream')
+
+
+def _supports_socket():
+    return hasattr(socket, 'AF_UNIX') and os.name != 'nt'
+
+
+def publish(socket_dir=STREAM_SOCKET_DIR):
+    """ปลุก broker ของทุก web process (เรียกหลัง commit)"""
+    if not _supports_socket() or not os.path.isdir(socket_dir):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+        for name in os.listdir(socket_dir):
+            path = os.path.join(socket_dir, name)
+            try:
+                s.sendto(b'1', path)
+            except ConnectionRefusedError:
+                # process ที่ bind ไว้ตายไปแล้ว
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                # buffer เต็ม: broker นั้นมี wake-up ค้างอยู่แล้ว
+                pass
+
+
+class Subscription:
+    def __init__(self, provinces=None, maxsize=256):
+        # provinces=None คือเห็นทุกไซโล (admin)
+        self.provinces = set(provinces) if provinces is not None else None
+        self.events = queue.Queue(maxsize=maxsize)
+
+    def wants(self, province):
+        return self.provinces is None or province in self.provinces
+
+    def get(self, timeout):
+        """event ถัดไป หรือ None ถ้าหมดเวลา (ใช้ส่ง keepalive)"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class VolumeBroker:
+    """fan-out event ของ latest_volume ให้ subscriber ใน process นี้
+
+    load_since(cursor) ต้องคืน (cursor ใหม่, [(province, payload), ...]) เรียงตาม cursor
+    """
+
+    def __init__(self, load_since, poll_interval=15, socket_dir=STREAM_SOCKET_DIR):
+        self.load_since = load_since
+        self.poll_interval = poll_interval
+        self.socket_dir = socket_dir
+        self.cursor = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._sock = None
+
+    def subscribe(self, provinces=None):
+        subscription = Subscription(provinces)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _start(self):
+        if _supports_socket():
+            os.makedirs(self.socket_dir, exist_ok=True)
+            path = os.path.join(self.socket_dir, f'{os.getpid()}.sock')
+            if os.path.exists(path):
+                os.remove(path)
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(path)
+            self._sock.setblocking(False)
+        # cursor เริ่มจากปัจจุบัน: event เก่าไม่ต้องส่ง (client โหลด snapshot เองตอนเปิดหน้า)
+        self.cursor, _ = self.load_since(None)
+        self._thread = threading.Thread(target=self._run, name='volume-broker', daemon=True)
+        self._thread.start()
+
+    def _wait(self):
+        if self._sock is None:
+            threading.Event().wait(self.poll_interval)
+            return
+        ready, _, _ = select.select([self._sock], [], [], self.poll_interval)
+        if ready:
+            # หลาย publish รวมเป็นการ query ครั้งเดียว
+            while True:
+                try:
+                    self._sock.recv(64)
+                except (BlockingIOError, InterruptedError):
+                    break
+
+    def _run(self):
+        while True:
+            self._wait()
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                self.cursor, events = self.load_since(self.cursor)
+            except Exception as e:
+                print(f"volume-broker: failed to load updates: {e}")
+                continue
+            self._dispatch(events)
+
+    def _dispatch(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for province, payload in events:
+            for subscription in subscribers:
+                if subscription.wants(province):
+                    try:
+                        subscription.events.put_nowait(payload)
+                    except queue.Full:
+                        # client อ่านไม่ทัน ทิ้ง event (reconnect จะได้ snapshot ใหม่)
+                        pass
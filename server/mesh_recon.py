@@ -1,45 +1,256 @@
 import open3d as o3d
 import numpy as np
 import copy
+from scipy import ndimage
+from xyz_parser import load_xyz
 
-def fit_circle_ransac(points_2d, iterations=5000, threshold=0.5):
+def _circles_from_triplets(p1, p2, p3):
+    """วงกลมที่ผ่าน 3 จุด (vectorised) คืน (cx, cy, radius, det)"""
+    temp = p2[:, 0]**2 + p2[:, 1]**2
+    bc = (p1[:, 0]**2 + p1[:, 1]**2 - temp) / 2
+    cd = (temp - p3[:, 0]**2 - p3[:, 1]**2) / 2
+    det = (p1[:, 0] - p2[:, 0]) * (p2[:, 1] - p3[:, 1]) - (p2[:, 0] - p3[:, 0]) * (p1[:, 1] - p2[:, 1])
+    safe_det = np.where(np.abs(det) < 1e-6, 1.0, det)
+    cx = (bc*(p2[:, 1] - p3[:, 1]) - cd*(p1[:, 1] - p2[:, 1])) / safe_det
+    cy = ((p1[:, 0] - p2[:, 0])*cd - (p2[:, 0] - p3[:, 0])*bc) / safe_det
+    radius = np.sqrt((p1[:, 0] - cx)**2 + (p1[:, 1] - cy)**2)
+    return cx, cy, radius, det
+
+def fit_circle_least_squares(points_2d):
+    """Algebraic (Kasa) fit: x^2 + y^2 + Dx + Ey + F = 0"""
+    x, y = points_2d[:, 0], points_2d[:, 1]
+    A = np.column_stack([x, y, np.ones_like(x)])
+    b = -(x**2 + y**2)
+    (D, E, F), *_ = np.linalg.lstsq(A, b, rcond=None)
+    cx, cy = -D / 2, -E / 2
+    r_sq = cx**2 + cy**2 - F
+    if r_sq <= 0: return None
+    return cx, cy, np.sqrt(r_sq)
+
+def circle_inliers(points_2d, circle, threshold=0.5):
+    cx, cy, radius = circle
+    dists = np.sqrt((points_2d[:, 0] - cx)**2 + (points_2d[:, 1] - cy)**2)
+    return np.abs(dists - radius) < threshold
+
+def fit_circle_ransac(points_2d, iterations=5000, threshold=0.5, confidence=0.999,
+                      batch_size=256, score_sample=4000, verify_top=32, seed=None,
+                      min_radius=10, max_radius=150):
     """
-    หาจุดศูนย์กลางและรัศมีของไซโล (RANSAC)
+    หาจุดศูนย์กลางและรัศมีของไซโล (RANSAC แบบ batch)
+    - สุ่ม triplet ทีละ batch แล้วคำนวณวงกลมทั้ง batch พร้อมกัน
+    - ให้คะแนน inlier บน subsample (score_sample จุด) แล้วตรวจกับทุกจุดเฉพาะ verify_top วงที่ดีที่สุด
+    - จำนวนรอบปรับตาม inlier ratio (confidence) และไม่เกิน iterations
+    - ปรับวงสุดท้ายด้วย least squares บน inliers
+    seed: int หรือ np.random.Generator เพื่อให้ผลซ้ำได้
     """
-    best_circle = None
-    best_inliers = 0
+    points_2d = np.asarray(points_2d, dtype=np.float64)[:, :2]
     n_points = len(points_2d)
     
     print(f"Fitting circle to {n_points} points...")
     
     if n_points < 10: return None
 
-    for _ in range(iterations):
-        idx = np.random.choice(n_points, 3, replace=False)
-        p1, p2, p3 = points_2d[idx]
-        
-        temp = p2[0]**2 + p2[1]**2
-        bc = (p1[0]**2 + p1[1]**2 - temp) / 2
-        cd = (temp - p3[0]**2 - p3[1]**2) / 2
-        det = (p1[0] - p2[0]) * (p2[1] - p3[1]) - (p2[0] - p3[0]) * (p1[1] - p2[1])
-        
-        if abs(det) < 1e-6: continue
-        
-        cx = (bc*(p2[1] - p3[1]) - cd*(p1[1] - p2[1])) / det
-        cy = ((p1[0] - p2[0])*cd - (p2[0] - p3[0])*bc) / det
-        radius = np.sqrt((p1[0] - cx)**2 + (p1[1] - cy)**2)
-        
-        # กรองรัศมีที่เพี้ยนเกินจริง (เช่น < 10cm หรือ > 150cm)
-        if radius < 10 or radius > 150: continue
+    rng = np.random.default_rng(seed)
+    if n_points > score_sample:
+        score_pts = points_2d[rng.choice(n_points, score_sample, replace=False)]
+    else:
+        score_pts = points_2d
+
+    # วงที่คะแนนดีที่สุดบน subsample: คอลัมน์ (cx, cy, radius, score)
+    top = np.empty((0, 4))
+    max_iterations = iterations
+    done = 0
+
+    while done < max_iterations:
+        k = min(batch_size, max_iterations - done)
+        done += k
+        idx = rng.integers(0, n_points, size=(k, 3))
+        cx, cy, radius, det = _circles_from_triplets(points_2d[idx[:, 0]], points_2d[idx[:, 1]], points_2d[idx[:, 2]])
+
+        # กรองวงที่เสื่อม และรัศมีที่เพี้ยนเกินจริง (เช่น < 10cm หรือ > 150cm)
+        valid = (np.abs(det) >= 1e-6) & (radius >= min_radius) & (radius <= max_radius)
+        if not valid.any(): continue
+        cx, cy, radius = cx[valid], cy[valid], radius[valid]
+
+        dists = np.sqrt((score_pts[None, :, 0] - cx[:, None])**2 + (score_pts[None, :, 1] - cy[:, None])**2)
+        scores = np.count_nonzero(np.abs(dists - radius[:, None]) < threshold, axis=1)
+
+        top = np.vstack([top, np.column_stack([cx, cy, radius, scores])])
+        if len(top) > verify_top:
+            top = top[np.argpartition(-top[:, 3], verify_top)[:verify_top]]
+
+        # adaptive termination: N = log(1-p) / log(1-w^3)
+        w = top[:, 3].max() / len(score_pts)
+        if w >= 1.0:
+            break
+        if w > 0:
+            needed = np.log(1 - confidence) / np.log(1 - w**3)
+            max_iterations = int(min(iterations, max(needed, done)))
+
+    if len(top) == 0:
+        return None
+
+    # ตรวจ candidate ที่เหลือกับทุกจุด
+    full_scores = [np.count_nonzero(circle_inliers(points_2d, c[:3], threshold)) for c in top]
+    best = int(np.argmax(full_scores))
+    best_circle = tuple(top[best, :3])
+    best_inliers = full_scores[best]
+
+    # refine ด้วย least squares ถ้าได้ inliers ไม่น้อยลง
+    inliers = circle_inliers(points_2d, best_circle, threshold)
+    refined = fit_circle_least_squares(points_2d[inliers]) if best_inliers >= 3 else None
+    if refined is not None and min_radius <= refined[2] <= max_radius:
+        if np.count_nonzero(circle_inliers(points_2d, refined, threshold)) >= best_inliers:
+            best_circle = refined
+
+    return tuple(float(v) for v in best_circle)
+
+def extract_surface_grid(points, grid_res):
+    """
+    Grid Max Z แบบ vectorised: เก็บจุดที่สูงที่สุดต่อช่องตาราง (grid_res x grid_res)
+    ผลเหมือน loop เดิมทุกประการ (ถ้า z เท่ากันใช้จุดที่มาก่อน, เรียงตามลำดับที่เจอช่องครั้งแรก)
+    คืนค่า (surface_points, noise_mask) โดย noise_mask เป็น True สำหรับจุดที่จมอยู่ใต้ผิว
+    """
+    n_points = len(points)
+    if n_points == 0:
+        return points[:0], np.zeros(0, dtype=bool)
+
+    grid_x = np.floor(points[:, 0] / grid_res).astype(np.int64)
+    grid_y = np.floor(points[:, 1] / grid_res).astype(np.int64)
+    index = np.arange(n_points)
+
+    # เรียงตามช่อง -> z มากไปน้อย -> ลำดับเดิม แล้วตัวแรกของแต่ละช่องคือจุดสูงสุด
+    order = np.lexsort((index, -points[:, 2], grid_y, grid_x))
+    sorted_x, sorted_y = grid_x[order], grid_y[order]
+    is_first = np.ones(n_points, dtype=bool)
+    is_first[1:] = (sorted_x[1:] != sorted_x[:-1]) | (sorted_y[1:] != sorted_y[:-1])
+    winners = order[is_first]
+
+    # เรียงช่องตามจุดแรกที่เจอ (เหมือนลำดับ insertion ของ dict ใน loop เดิม)
+    cell_id = np.cumsum(is_first) - 1
+    first_seen = np.full(len(winners), n_points, dtype=np.int64)
+    np.minimum.at(first_seen, cell_id, order)
+    winners = winners[np.argsort(first_seen, kind='stable')]
+
+    noise_mask = np.ones(n_points, dtype=bool)
+    noise_mask[winners] = False
+    return points[winners], noise_mask
+
+def voxel_downsample(points, voxel_size):
+    """
+    Voxel grid แบบ vectorised: แทนจุดทั้งหมดในแต่ละ voxel (voxel_size ลูกบาศก์) ด้วยจุดที่สูงสุด (z มากสุด)
+    ทำให้ความหนาแน่นสม่ำเสมอ (สแกนเนอร์ pan-tilt ได้จุดซ้ำ/หนาแน่นมากใกล้เซนเซอร์)
+    ใช้จุดจริงแทนจุดเฉลี่ย: heightmap ใช้ max z ต่อช่อง จุดเฉลี่ยดึงผิววัสดุลงและทำให้ปริมาตรอากาศเพี้ยน
+    voxel_size <= 0 คืน points เดิม ลำดับผลเรียงตาม voxel
+    """
+    n_points = len(points)
+    if voxel_size <= 0 or n_points == 0:
+        return points
+
+    keys = np.floor(points[:, :3] / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    dims = keys.max(axis=0) + 1
+    # รวม index 3 แกนเป็นเลขเดียว เรียงตาม (voxel, z) ครั้งเดียว จุดสุดท้ายของแต่ละ voxel คือจุดที่สูงสุด
+    flat = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+    order = np.lexsort((points[:, 2], flat))
+    sorted_flat = flat[order]
+    is_last = np.ones(n_points, dtype=bool)
+    is_last[:-1] = sorted_flat[1:] != sorted_flat[:-1]
+    return points[order[is_last]]
+
+def heightmap_empty_volume(points, cx, cy, radius, grid_res=0.5, lid_z=None, margin=1.5):
+    """
+    ปริมาตรว่าง (cm^3) จาก heightmap แทนการทำ Poisson mesh
+    = ผลรวมของ (lid_z - surface_z) x พื้นที่ช่อง สำหรับทุกช่องที่อยู่ในวงกลมผนัง
+    ช่องที่ไม่มีจุดถูกเติมด้วยความสูงของช่องที่มีค่าใกล้ที่สุด (nearest)
+    คืนค่า (volume_cm3, info)
+    """
+    if lid_z is None:
+        lid_z = np.max(points[:, 2])
+
+    dists = np.sqrt((points[:, 0] - cx)**2 + (points[:, 1] - cy)**2)
+    surface, _ = extract_surface_grid(points[dists < radius - margin], grid_res)
+
+    # ตารางครอบวงกลม ใช้ index แบบเดียวกับ extract_surface_grid
+    x0 = int(np.floor((cx - radius) / grid_res))
+    y0 = int(np.floor((cy - radius) / grid_res))
+    nx = int(np.floor((cx + radius) / grid_res)) - x0 + 1
+    ny = int(np.floor((cy + radius) / grid_res)) - y0 + 1
+
+    centers_x = (np.arange(nx) + x0 + 0.5) * grid_res
+    centers_y = (np.arange(ny) + y0 + 0.5) * grid_res
+    in_circle = (centers_x[:, None] - cx)**2 + (centers_y[None, :] - cy)**2 <= radius**2
+
+    heights = np.full((nx, ny), np.nan)
+    if len(surface) > 0:
+        ix = np.floor(surface[:, 0] / grid_res).astype(np.int64) - x0
+        iy = np.floor(surface[:, 1] / grid_res).astype(np.int64) - y0
+        heights[ix, iy] = surface[:, 2]
+
+    holes = in_circle & np.isnan(heights)
+    known = ~np.isnan(heights)
+    info = {
+        'cells': int(in_circle.sum()),
+        'surface_cells': int((in_circle & known).sum()),
+        'filled_cells': int(holes.sum()),
+    }
+    if holes.any() and known.any():
+        # nearest: index ของช่องที่มีค่าใกล้ที่สุดสำหรับทุกช่อง
+        _, (nearest_x, nearest_y) = ndimage.distance_transform_edt(~known, return_indices=True)
+        heights[holes] = heights[nearest_x[holes], nearest_y[holes]]
+    elif not known.any():
+        heights[in_circle] = lid_z  # ไม่มีผิวเลย ถือว่าว่างเป็นศูนย์
+
+    depth = np.clip(lid_z - heights[in_circle], 0, None)
+    volume_cm3 = float(np.sum(depth) * grid_res**2)
+    return volume_cm3, info
+
+def poisson_empty_volume(surface_points, cx, cy, radius, lid_z, grid_res=0.5):
+    """ปริมาตรว่าง (cm^3) ด้วย Poisson mesh ของผิว + ฝาปิด (ช้า ใช้ตรวจสอบ) คืนค่า (volume_cm3, mesh)"""
+    pcd_surface = o3d.geometry.PointCloud()
+    pcd_surface.points = o3d.utility.Vector3dVector(surface_points)
+
+    # -------------------------------------------------------
+    # 3. สร้างฝาปิด (Lid)
+    # -------------------------------------------------------
+    # ฝาปิดละเอียดเท่ากับ Grid เพื่อความเนียน
+    lid_res = grid_res 
+    lx, ly = np.meshgrid(np.arange(cx - radius, cx + radius, lid_res),
+                         np.arange(cy - radius, cy + radius, lid_res), indexing='ij')
+    in_lid = (lx - cx)**2 + (ly - cy)**2 <= radius**2
+    lid_points = np.column_stack([lx[in_lid], ly[in_lid], np.full(in_lid.sum(), lid_z)])
+    
+    pcd_lid = o3d.geometry.PointCloud()
+    pcd_lid.points = o3d.utility.Vector3dVector(lid_points)
+
+    # -------------------------------------------------------
+    # 4. สร้าง Mesh (High Depth Poisson)
+    # -------------------------------------------------------
+    pcd_final = pcd_surface + pcd_lid
+    # รัศมี Search สำหรับ Normal ต้องเหมาะสมกับ Grid Res
+    pcd_final.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=5.0, max_nn=30))
+    pcd_final.orient_normals_consistent_tangent_plane(100)
 
-        dists = np.sqrt((points_2d[:, 0] - cx)**2 + (points_2d[:, 1] - cy)**2)
-        inliers = np.sum(np.abs(dists - radius) < threshold)
+    print("Reconstructing High Fidelity Mesh (Depth=11)...")
+    # depth=11 ให้รายละเอียดสูง เหมาะกับ Grid 0.5 cm
+    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+        pcd_final, depth=11, width=0, scale=1.1, linear_fit=False
+    )
+    
+    # ตัดขอบ Mesh ที่เกินออกมา (Trim Low Density)
+    densities = np.asarray(densities)
+    # ตัดน้อยๆ (0.5%) เพื่อเก็บขอบไว้
+    density_threshold = np.percentile(densities, 0.5) 
+    mesh.remove_vertices_by_mask(densities < density_threshold)
+
+    # -------------------------------------------------------
+    # 5. คำนวณปริมาตร
+    # -------------------------------------------------------
+    if not mesh.is_watertight():
+        print("Info: Closing minor holes with Convex Hull...")
+        mesh, _ = mesh.compute_convex_hull()
         
-        if inliers > best_inliers:
-            best_inliers = inliers
-            best_circle = (cx, cy, radius)
-            
-    return best_circle
+    return mesh.get_volume(), mesh
 
 def process_silo_high_fidelity(filename, manual_diameter_cm=None, grid_res=0.5):
     print(f"Loading {filename}...")
@@ -47,9 +258,11 @@ def process_silo_high_fidelity(filename, manual_diameter_cm=None, grid_res=0.5):
         pcd = o3d.io.read_point_cloud(filename)
     except:
         try:
-            pts = np.loadtxt(filename)
+            pts, skipped = load_xyz(filename)
+            if skipped:
+                print(f"Skipped {skipped} malformed line(s)")
             pcd = o3d.geometry.PointCloud()
-            pcd.points = o3d.utility.Vector3dVector(pts[:, :3])
+            pcd.points = o3d.utility.Vector3dVector(pts)
         except Exception as e:
             print(f"Error: {e}")
             return
@@ -94,27 +307,8 @@ def process_silo_high_fidelity(filename, manual_diameter_cm=None, grid_res=0.5):
     # -------------------------------------------------------
     print(f"Filtering Surface with Grid Resolution: {grid_res} cm...")
     
-    grid_map = {}
-    noise_points = [] 
-
-    for p in points_inside:
-        x, y, z = p
-        # คำนวณ Index ของตาราง
-        grid_x = int(np.floor(x / grid_res))
-        grid_y = int(np.floor(y / grid_res))
-        key = (grid_x, grid_y)
-        
-        if key not in grid_map:
-            grid_map[key] = p
-        else:
-            # เก็บเฉพาะจุดที่สูงที่สุดในช่องตารางนั้น
-            if z > grid_map[key][2]:
-                noise_points.append(grid_map[key]) 
-                grid_map[key] = p
-            else:
-                noise_points.append(p) 
-
-    surface_points = np.array(list(grid_map.values()))
+    surface_points, noise_mask = extract_surface_grid(points_inside, grid_res)
+    noise_points = points_inside[noise_mask]
     print(f"Final Surface Points: {len(surface_points)}")
 
     # รวมขยะเพื่อแสดงผล (จุดนอกวง + จุดที่จม)
@@ -136,58 +330,16 @@ def process_silo_high_fidelity(filename, manual_diameter_cm=None, grid_res=0.5):
     pcd_waste.paint_uniform_color([1, 0, 0])   
     # o3d.visualization.draw_geometries([pcd_surface, pcd_waste], window_name="Debug: Green=Surface, Red=Noise")
 
-    # -------------------------------------------------------
-    # 3. สร้างฝาปิด (Lid)
-    # -------------------------------------------------------
     max_z_sensor = np.max(points[:, 2])
-    # ฝาปิดละเอียดเท่ากับ Grid เพื่อความเนียน
-    lid_res = grid_res 
-    x_range = np.arange(cx - radius, cx + radius, lid_res)
-    y_range = np.arange(cy - radius, cy + radius, lid_res)
-    
-    lid_points = []
-    for lx in x_range:
-        for ly in y_range:
-            if (lx - cx)**2 + (ly - cy)**2 <= radius**2:
-                lid_points.append([lx, ly, max_z_sensor])
-    
-    pcd_lid = o3d.geometry.PointCloud()
-    pcd_lid.points = o3d.utility.Vector3dVector(np.array(lid_points))
-
-    # -------------------------------------------------------
-    # 4. สร้าง Mesh (High Depth Poisson)
-    # -------------------------------------------------------
-    pcd_final = pcd_surface + pcd_lid
-    # รัศมี Search สำหรับ Normal ต้องเหมาะสมกับ Grid Res
-    pcd_final.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=5.0, max_nn=30))
-    pcd_final.orient_normals_consistent_tangent_plane(100)
-
-    print("Reconstructing High Fidelity Mesh (Depth=11)...")
-    # depth=11 ให้รายละเอียดสูง เหมาะกับ Grid 0.5 cm
-    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-        pcd_final, depth=11, width=0, scale=1.1, linear_fit=False
-    )
-    
-    # ตัดขอบ Mesh ที่เกินออกมา (Trim Low Density)
-    densities = np.asarray(densities)
-    # ตัดน้อยๆ (0.5%) เพื่อเก็บขอบไว้
-    density_threshold = np.percentile(densities, 0.5) 
-    mesh.remove_vertices_by_mask(densities < density_threshold)
-
-    # -------------------------------------------------------
-    # 5. คำนวณปริมาตร
-    # -------------------------------------------------------
-    if not mesh.is_watertight():
-        print("Info: Closing minor holes with Convex Hull...")
-        mesh, _ = mesh.compute_convex_hull()
-        
-    volume_cm3 = mesh.get_volume()
+    volume_cm3, mesh = poisson_empty_volume(surface_points, cx, cy, radius, max_z_sensor, grid_res)
+    heightmap_cm3, _ = heightmap_empty_volume(points, cx, cy, radius, grid_res, lid_z=max_z_sensor)
     volume_m3 = volume_cm3 / 1_000_000.0
     volume_liters = volume_cm3 / 1000.0
 
     print("="*40)
     print(f"Measured Empty Volume: {volume_m3:.6f} m3")
     print(f"Measured Empty Volume: {volume_liters:.2f} Liters")
+    print(f"Heightmap Empty Volume: {heightmap_cm3 / 1_000_000.0:.6f} m3")
     print("="*40)
 
     # --- Visualization ---
@@ -204,6 +356,7 @@ def process_silo_high_fidelity(filename, manual_diameter_cm=None, grid_res=0.5):
     return volume_m3
 
 # --- Run ---
-filename = "S001_01-20251122_09_CMD.xyz"
-# ใช้ Grid Res 0.5 cm ตามที่ตกลงกันครับ
-process_silo_high_fidelity(filename, manual_diameter_cm=50.0, grid_res=0.5)
\ No newline at end of file
+if __name__ == "__main__":
+    filename = "S001_01-20251122_09_CMD.xyz"
+    # ใช้ Grid Res 0.5 cm ตามที่ตกลงกันครับ
+    process_silo_high_fidelity(filename, manual_diameter_cm=50.0, grid_res=0.5)
@@ -0,0 +1,131 @@
+"""
+ย้าย MergedData แถวเก่าที่เก็บเป็นข้อความ (merged_points) ไปเป็นไบนารี (merged_blob)
+และรายงานขนาดที่ประหยัดได้กับเวลา parse ที่ลดลง
+
+    python migrate_point_clouds.py [--compression zlib|lz4|none] [--keep-text]
+    python migrate_point_clouds.py --to-blob-store
+
+--to-blob-store ย้ายทั้งแถว text และ merged_blob ออกไปเป็นไฟล์ .npy ใน blob store
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+
+from app import app, db, MergedData
+from point_codec import parse_xyz_text, encode_points, decode_points
+from blob_store import put_points, open_points
+
+
+def migrate(compression="zlib", keep_text=False, batch_size=20):
+    text_bytes = 0
+    blob_bytes = 0
+    loadtxt_time = 0.0
+    decode_time = 0.0
+    migrated = 0
+
+    with app.app_context():
+        ids = [row.id for row in db.session.query(MergedData.id).filter(
+            MergedData.merged_blob.is_(None),
+            MergedData.merged_points.isnot(None)
+        ).order_by(MergedData.id)]
+        print(f"Found {len(ids)} legacy text rows")
+
+        for start in range(0, len(ids), batch_size):
+            rows = MergedData.query.filter(MergedData.id.in_(ids[start:start + batch_size])).all()
+            for row in rows:
+                points = parse_xyz_text(row.merged_points)
+                blob = encode_points(points, compression=compression)
+
+                t0 = time.perf_counter()
+                np.loadtxt(io.StringIO(row.merged_points), dtype=np.float64)
+                loadtxt_time += time.perf_counter() - t0
+                t0 = time.perf_counter()
+                decode_points(blob)
+                decode_time += time.perf_counter() - t0
+
+                text_bytes += len(row.merged_points.encode("utf-8"))
+                blob_bytes += len(blob)
+                row.merged_blob = blob
+                row.total_points = len(points)
+                if not keep_text:
+                    row.merged_points = None
+                migrated += 1
+            db.session.commit()
+            print(f"Migrated {migrated}/{len(ids)} rows")
+
+        if not keep_text and migrated:
+            # คืนพื้นที่จาก text ที่ลบไปแล้ว
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql("VACUUM")
+
+    if migrated:
+        print("=" * 40)
+        print(f"Storage: {text_bytes / 1e6:.2f} MB text -> {blob_bytes / 1e6:.2f} MB binary "
+              f"({100.0 * (1 - blob_bytes / text_bytes):.1f}% smaller)")
+        print(f"Parse:   loadtxt {loadtxt_time:.3f} s -> frombuffer {decode_time:.3f} s "
+              f"({loadtxt_time / max(decode_time, 1e-9):.0f}x faster)")
+        print("=" * 40)
+    return migrated
+
+
+def migrate_to_blob_store(batch_size=20):
+    db_bytes = 0
+    loadtxt_time = 0.0
+    mmap_time = 0.0
+    migrated = 0
+
+    with app.app_context():
+        ids = [row.id for row in db.session.query(MergedData.id).filter(
+            MergedData.blob_path.is_(None),
+            (MergedData.merged_blob.isnot(None)) | (MergedData.merged_points.isnot(None))
+        ).order_by(MergedData.id)]
+        print(f"Found {len(ids)} rows stored inside SQLite")
+
+        for start in range(0, len(ids), batch_size):
+            rows = MergedData.query.filter(MergedData.id.in_(ids[start:start + batch_size])).all()
+            for row in rows:
+                if row.merged_blob is not None:
+                    points = decode_points(row.merged_blob)
+                    db_bytes += len(row.merged_blob)
+                else:
+                    t0 = time.perf_counter()
+                    points = parse_xyz_text(row.merged_points)
+                    loadtxt_time += time.perf_counter() - t0
+                    db_bytes += len(row.merged_points.encode("utf-8"))
+
+                row.blob_path, row.blob_checksum = put_points(points)
+                row.total_points = len(points)
+                row.merged_blob = None
+                row.merged_points = None
+
+                t0 = time.perf_counter()
+                np.asarray(open_points(row.blob_path, mmap=True))
+                mmap_time += time.perf_counter() - t0
+                migrated += 1
+            db.session.commit()
+            print(f"Migrated {migrated}/{len(ids)} rows")
+
+        if migrated:
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql("VACUUM")
+
+    if migrated:
+        print("=" * 40)
+        print(f"Moved {db_bytes / 1e6:.2f} MB of point payload out of SQLite")
+        print(f"Load:    text parse {loadtxt_time:.3f} s, mmap load {mmap_time:.3f} s")
+        print("=" * 40)
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert legacy MergedData text rows to binary blobs")
+    parser.add_argument("--compression", default="zlib", choices=["zlib", "lz4", "none"])
+    parser.add_argument("--keep-text", action="store_true", help="keep merged_points after converting")
+    parser.add_argument("--to-blob-store", action="store_true", help="move point payloads into Database/blobs")
+    args = parser.parse_args()
+    if args.to_blob_store:
+        migrate_to_blob_store()
+    else:
+        migrate(compression=args.compression, keep_text=args.keep_text)
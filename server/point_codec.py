@@ -0,0 +1,112 @@
+"""
+รูปแบบไบนารีสำหรับเก็บ point cloud (float32 Nx3) ในฐานข้อมูล
+
+Layout: header 12 bytes + payload
+    magic (4s) | version (B) | dtype (B) | compression (B) | pad (x) | n_points (I)
+
+payload ที่ไม่บีบอัดจะถูกอ่านกลับด้วย np.frombuffer แบบ zero-copy
+"""
+import struct
+import zlib
+
+import numpy as np
+
+from xyz_parser import parse_xyz
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # lz4 เป็น optional
+    lz4_frame = None
+
+MAGIC = b"SPCB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBxI")
+
+DTYPE_CODES = {1: np.dtype("<f4"), 2: np.dtype("<f8")}
+DTYPE_IDS = {dt: code for code, dt in DTYPE_CODES.items()}
+
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_LZ4 = 2
+COMPRESSION_NAMES = {None: COMPRESS_NONE, "none": COMPRESS_NONE, "zlib": COMPRESS_ZLIB, "lz4": COMPRESS_LZ4}
+
+
+def parse_xyz_text(text, stats=None):
+    """แปลงข้อความ "x y z\\n" เป็น array float32 (N, 3) ข้ามบรรทัดที่เสีย (นับไว้ใน stats['skipped'])"""
+    points, skipped = parse_xyz(text, dtype=np.float32)
+    if stats is not None:
+        stats['skipped'] = stats.get('skipped', 0) + skipped
+    return points
+
+
+def iter_xyz_blocks(texts, stats=None):
+    """parse ข้อความทีละ chunk โดยต่อบรรทัดที่ถูกตัดกลางขอบ chunk เข้ากับ chunk ถัดไป
+
+    texts: iterable ของ str (เช่น SiloData.point_cloud เรียงตาม chunk_id)
+    yield array float32 (N, 3) ต่อ chunk
+    """
+    carry = ""
+    for text in texts:
+        if carry:
+            text = carry + text
+        cut = text.rfind("\n") + 1
+        carry = text[cut:]
+        if cut:
+            yield parse_xyz_text(text[:cut], stats)
+    if carry.strip():
+        yield parse_xyz_text(carry, stats)
+
+
+def encode_points(points, compression="zlib", dtype=np.float32):
+    """เข้ารหัส array (N, 3) เป็น bytes พร้อม header"""
+    dt = np.dtype(dtype).newbyteorder("<")
+    if dt not in DTYPE_IDS:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    if compression not in COMPRESSION_NAMES:
+        raise ValueError(f"Unknown compression: {compression}")
+    method = COMPRESSION_NAMES[compression]
+    if method == COMPRESS_LZ4 and lz4_frame is None:
+        raise ValueError("lz4 is not installed")
+
+    arr = np.ascontiguousarray(np.asarray(points).reshape(-1, 3), dtype=dt)
+    payload = arr.tobytes()
+    if method == COMPRESS_ZLIB:
+        payload = zlib.compress(payload, 6)
+    elif method == COMPRESS_LZ4:
+        payload = lz4_frame.compress(payload)
+
+    return HEADER.pack(MAGIC, VERSION, DTYPE_IDS[dt], method, arr.shape[0]) + payload
+
+
+def decode_points(blob):
+    """ถอดรหัส bytes กลับเป็น array (N, 3) (read-only ถ้าไม่บีบอัด)"""
+    if blob is None or len(blob) < HEADER.size:
+        raise ValueError("Point blob is empty or truncated")
+    magic, version, dtype_id, method, n_points = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not a point blob (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported point blob version: {version}")
+    dt = DTYPE_CODES.get(dtype_id)
+    if dt is None:
+        raise ValueError(f"Unsupported dtype id: {dtype_id}")
+
+    if method == COMPRESS_NONE:
+        arr = np.frombuffer(blob, dtype=dt, count=n_points * 3, offset=HEADER.size)
+    else:
+        payload = memoryview(blob)[HEADER.size:]
+        if method == COMPRESS_ZLIB:
+            raw = zlib.decompress(payload)
+        elif method == COMPRESS_LZ4:
+            if lz4_frame is None:
+                raise ValueError("lz4 is not installed")
+            raw = lz4_frame.decompress(payload)
+        else:
+            raise ValueError(f"Unknown compression id: {method}")
+        arr = np.frombuffer(raw, dtype=dt, count=n_points * 3)
+
+    return arr.reshape(n_points, 3)
+
+
+def is_point_blob(blob):
+    return blob is not None and len(blob) >= HEADER.size and bytes(blob[:4]) == MAGIC
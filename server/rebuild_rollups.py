@@ -0,0 +1,51 @@
+"""
+ตรวจ / สร้าง province_rollup ใหม่จาก latest_volume
+
+    python rebuild_rollups.py           # คำนวณใหม่ทั้งตาราง
+    python rebuild_rollups.py --check   # เทียบกับค่าที่คำนวณใหม่ exit code 1 ถ้าไม่ตรง (ไม่แก้ข้อมูล)
+
+ปกติ trigger ดูแล rollup เอง ใช้สคริปต์นี้ตรวจความถูกต้องหรือแก้หลังแก้ข้อมูลด้วยมือโดยปิด trigger
+"""
+import argparse
+import math
+import sys
+
+from app import app, db, PROVINCE_ROLLUP_SQL, rebuild_province_rollup
+
+COLUMNS = ('silo_count', 'total_capacity', 'total_used', 'low_capacity_count')
+
+
+def compare(conn):
+    """คืนรายการ (province, column, ค่าใน rollup, ค่าที่ถูกต้อง) ที่ไม่ตรงกัน"""
+    stored = {row[0]: row[1:] for row in conn.exec_driver_sql(
+        "SELECT province, " + ", ".join(COLUMNS) + " FROM province_rollup WHERE silo_count > 0")}
+    expected = {row[0]: row[1:] for row in conn.exec_driver_sql(PROVINCE_ROLLUP_SQL)}
+    mismatches = []
+    for province in sorted(stored.keys() | expected.keys()):
+        have = stored.get(province, (0,) * len(COLUMNS))
+        want = expected.get(province, (0,) * len(COLUMNS))
+        for column, a, b in zip(COLUMNS, have, want):
+            # total_* สะสมด้วยการบวก/ลบทีละไซโล ยอมให้คลาดเคลื่อนทศนิยมเล็กน้อย
+            if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6):
+                mismatches.append((province, column, a, b))
+    return mismatches
+
+
+def main(check_only=False):
+    with app.app_context(), db.engine.begin() as conn:
+        mismatches = compare(conn)
+        for province, column, have, want in mismatches:
+            print(f"[diff] {province}.{column}: rollup {have} != expected {want}")
+        if check_only:
+            print(f"{len(mismatches)} mismatch(es)" if mismatches else "province_rollup is consistent.")
+            return not mismatches
+        count = rebuild_province_rollup(conn)
+        print(f"Rebuilt province_rollup for {count} province(s)")
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or rebuild the per-province overview rollups")
+    parser.add_argument("--check", action="store_true", help="only compare, exit 1 on mismatch")
+    args = parser.parse_args()
+    sys.exit(0 if main(args.check) else 1)
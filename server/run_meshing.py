@@ -1,12 +1,23 @@
+import copy
 import numpy as np
 import open3d as o3d
-from scipy.spatial import ConvexHull
 from datetime import datetime, timezone
 import json
 import os
-import io
+import time
+from types import SimpleNamespace
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy 
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from point_codec import decode_points
+from xyz_parser import parse_xyz
+from blob_store import open_points
+from job_queue import SQLiteJobQueue
+import silo_geometry
+import live_updates
+import surface_diff
+import volume_engines
+from mesh_recon import voxel_downsample
 
 # ====================================================================
 # 1. DATABASE & APP SETUP (SQLite)
@@ -14,13 +25,37 @@ from flask_sqlalchemy import SQLAlchemy
 basedir = os.path.abspath(os.path.dirname(__file__))
 app = Flask(__name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'Database', 'Server_db.sqlite3') 
+# ฐานข้อมูลเดียวกับ web app (DATABASE_URL เหมือน app.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'Database', 'Server_db.sqlite3'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'connect_args': {'timeout': 30}  # หลาย worker process เขียน DB พร้อมกัน
+}
 db = SQLAlchemy(app)
+mesh_queue = SQLiteJobQueue(db)
 
 # --- GLOBAL CONSTANTS ---
-TOTAL_SILO_CAPACITY_M3 = 0.288583 
+TOTAL_SILO_CAPACITY_M3 = 0.288583 # ใช้เมื่อไซโลยังไม่ได้ calibrate (SiloGeometry.empty_volume_m3)
 CEMENT_DENSITY = 1440.0 # kg/m^3 
+# engine คำนวณปริมาตรอากาศ (volume_engines.ENGINES) ของไซโลที่ไม่ได้ตั้ง SiloMeta.volume_engine
+# heightmap (default) ต้องมี SiloGeometry ถ้ายังไม่มีใช้ Convex Hull แทน
+VOLUME_METHOD = os.getenv('VOLUME_METHOD', 'heightmap')
+# engine ตรวจสอบของไซโลที่ไม่ได้ตั้ง SiloMeta.verify_engine เช่น 'poisson': คำนวณคู่กันแล้ว log ส่วนต่าง
+# engine ราคาแพงรันเฉพาะทุก VERIFY_EVERY สแกน (ตาม MergedData.id)
+VERIFY_METHOD = os.getenv('VOLUME_VERIFY_METHOD', '')
+VERIFY_EVERY = int(os.getenv('VOLUME_VERIFY_EVERY', 20))
+HEIGHTMAP_GRID_RES = 0.5 # cm
+# voxel (cm) สำหรับลดจุดก่อนกรอง outlier ใช้เมื่อไซโลยังไม่มี SiloGeometry.voxel_size (0 = ไม่ลด)
+# default ปิด: ค่าที่ปลอดภัยขึ้นกับความหนาแน่นของสแกนแต่ละไซโล ให้ calibrate_silo.py sweep แล้วเก็บต่อไซโล
+# (สแกนทดสอบ: 0.5 cm คลาด 0.74%, 0.75 cm 7.9%, 1 cm 17% เพราะ voxel ใหญ่กว่าช่อง grid ทำให้ช่องผิวหายไป)
+VOXEL_SIZE = float(os.getenv('VOXEL_SIZE', 0.0))
+# สแกนที่ผิวเปลี่ยนไม่เกินสัดส่วนนี้ของช่อง (เทียบสแกนก่อนหน้า) ปรับปริมาตรจากช่องที่เปลี่ยนโดยไม่กรอง/คำนวณใหม่ (0 = ปิด)
+INCREMENTAL_MAX_CHANGED = float(os.getenv('INCREMENTAL_MAX_CHANGED', 0.05))
+# ปรับแบบ incremental ติดกันได้ไม่เกินนี้ แล้วคำนวณเต็มหนึ่งครั้ง (กันความคลาดสะสม)
+INCREMENTAL_MAX_RUN = int(os.getenv('INCREMENTAL_MAX_RUN', 10))
+# จำนวนงานต่อรอบของ backlog mode (worker.py --backlog) ทั้งรอบต้องเสร็จภายใน visibility timeout ของคิว
+BACKLOG_BATCH_SIZE = int(os.getenv('BACKLOG_BATCH_SIZE', 32))
 # ---------------------------------------------
 
 # ====================================================================
@@ -28,6 +63,8 @@ CEMENT_DENSITY = 1440.0 # kg/m^3
 # ====================================================================
 class SiloMeta(db.Model):
     device_id = db.Column(db.String(50), primary_key=True) 
+    volume_engine = db.Column(db.String(20))
+    verify_engine = db.Column(db.String(20))
     __tablename__ = 'silo_meta'
 
 class MergedData(db.Model):
@@ -37,6 +74,9 @@ class MergedData(db.Model):
     batch_id = db.Column(db.String(100))
     total_points = db.Column(db.Integer)
     merged_points = db.Column(db.Text)
+    merged_blob = db.Column(db.LargeBinary)
+    blob_path = db.Column(db.String(200))
+    blob_checksum = db.Column(db.String(64))
     mesh_processed = db.Column(db.Boolean, default=False, nullable=False)
 
 class VolumeData(db.Model):
@@ -45,86 +85,532 @@ class VolumeData(db.Model):
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     volume = db.Column(db.Float)
     volume_percentage = db.Column(db.Float)
+    air_volume_m3 = db.Column(db.Float)
+
+class LatestVolume(db.Model):
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    volume_data_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    volume = db.Column(db.Float)
+    volume_percentage = db.Column(db.Float)
+
+class SiloGeometry(db.Model):
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    center_x = db.Column(db.Float)
+    center_y = db.Column(db.Float)
+    radius = db.Column(db.Float)
+    floor_z = db.Column(db.Float)
+    lid_z = db.Column(db.Float)
+    height = db.Column(db.Float)
+    empty_volume_m3 = db.Column(db.Float)
+    inlier_ratio = db.Column(db.Float)
+    calibration_merged_id = db.Column(db.Integer)
+    calibrated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    voxel_size = db.Column(db.Float)
+
+class SurfaceSnapshot(db.Model):
+    device_id = db.Column(db.String(50), db.ForeignKey('silo_meta.device_id'), primary_key=True)
+    merged_id = db.Column(db.Integer, nullable=False)
+    grid_res = db.Column(db.Float, nullable=False)
+    x0 = db.Column(db.Integer, nullable=False)
+    y0 = db.Column(db.Integer, nullable=False)
+    nx = db.Column(db.Integer, nullable=False)
+    ny = db.Column(db.Integer, nullable=False)
+    heights = db.Column(db.LargeBinary, nullable=False)
+    air_volume_m3 = db.Column(db.Float, nullable=False)
+    volume_engine = db.Column(db.String(20))
+    voxel_size = db.Column(db.Float)
+    calibrated_at = db.Column(db.DateTime)
+    incremental_run = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
     
 # ====================================================================
 # 3. WORKER FUNCTION
 # ====================================================================
+def enqueue_unqueued_scans():
+    """เพิ่มงานให้ MergedData ที่ยังไม่ประมวลผลแต่ไม่มีใน mesh_job (เช่น แถวก่อนมีคิว)"""
+    with app.app_context():
+        mesh_queue.ensure_schema()
+        pending = db.session.query(MergedData.id, MergedData.device_id).filter(
+            MergedData.mesh_processed == False
+        ).order_by(MergedData.timestamp.asc()).all()
+        for merged_id, device_id in pending:
+            mesh_queue.enqueue(merged_id, device_id)
+        db.session.commit()
+        return len(pending)
+
+def load_merged_points(job):
+    if job.blob_path:
+        # mmap: payload ไม่ต้องผ่าน DB connection
+        return np.asarray(open_points(job.blob_path, mmap=True), dtype=np.float64)
+    if job.merged_blob is not None:
+        return decode_points(job.merged_blob).astype(np.float64)
+    # legacy rows (ยังไม่ได้ migrate เป็น binary)
+    points, skipped = parse_xyz(job.merged_points)
+    if skipped:
+        print(f"-> Skipped {skipped} malformed line(s) in legacy point text")
+    return points
+
+class StageTimer:
+    """เวลาและจำนวนจุดหลังแต่ละขั้นตอนของงานหนึ่งงาน (พิมพ์สรุปบรรทัดเดียวใน log ของ worker)"""
+
+    def __init__(self):
+        self.stages = []
+        self._last = time.perf_counter()
+
+    def mark(self, name, points=None):
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last, None if points is None else len(points)))
+        self._last = now
+
+    def summary(self):
+        parts = []
+        for name, seconds, count in self.stages:
+            parts.append(f"{name} {seconds * 1000:.0f} ms" + (f" ({count} pts)" if count is not None else ""))
+        total = sum(seconds for _, seconds, _ in self.stages)
+        return " | ".join(parts) + f" | total {total * 1000:.0f} ms"
+
+def prepare_points(points, voxel_size, stages=None):
+    """voxel downsample แล้วกรอง outlier (ทั้งสองขั้นโตเร็วกว่าเชิงเส้นตามจำนวนจุด จึงลดจุดก่อน)"""
+    if stages is None:
+        stages = StageTimer()
+    downsampled = voxel_downsample(points, voxel_size)
+    stages.mark("downsample", downsampled)
+    cleaned = clean_points(downsampled)
+    stages.mark("clean", cleaned)
+    return cleaned
+
+def clean_points(points):
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd_clean, ind = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
+    return np.asarray(pcd_clean.points)
+
+def engines_for(silo):
+    """(engine หลัก, engine ตรวจสอบ) จากแถว SiloMeta (None ได้) หรือ VOLUME_METHOD / VERIFY_METHOD"""
+    method = (silo.volume_engine if silo is not None else None) or VOLUME_METHOD
+    verify_method = (silo.verify_engine if silo is not None else None) or VERIFY_METHOD
+    return method, verify_method
+
+def silo_engines(device_id):
+    return engines_for(db.session.get(SiloMeta, device_id))
+
+def empty_volume_m3(cleaned_points, geometry, method=None, verify_method=None, scan_id=None):
+    """
+    ปริมาตรอากาศในไซโล (m^3) ด้วย engine method (default VOLUME_METHOD)
+    verify_method: engine ที่คำนวณคู่กันแล้ว log ส่วนต่าง ตามรอบของ cost (volume_engines.verification_due)
+    """
+    engine = volume_engines.resolve_engine(method or VOLUME_METHOD, geometry)
+    air_volume, info = volume_engines.estimate_air_m3(engine, cleaned_points, geometry, HEIGHTMAP_GRID_RES)
+    print(f"Volume engine {engine.name}: {air_volume:.6f} m3 {info}")
+
+    if verify_method:
+        verify = volume_engines.get_engine(verify_method)
+        if verify is None:
+            print(f"[verify] Unknown volume engine: {verify_method}")
+        elif (verify.name != engine.name and verify.can_run(geometry)
+                and volume_engines.verification_due(verify, scan_id, VERIFY_EVERY)):
+            verify_volume, _ = volume_engines.estimate_air_m3(verify, cleaned_points, geometry, HEIGHTMAP_GRID_RES)
+            print(f"[verify] {engine.name}: {air_volume:.6f} m3, {verify.name}: {verify_volume:.6f} m3")
+    return air_volume
+
+GEOMETRY_FIELDS = ('center_x', 'center_y', 'radius', 'floor_z', 'lid_z', 'height', 'empty_volume_m3',
+                   'inlier_ratio', 'calibration_merged_id', 'calibrated_at', 'voxel_size')
+SNAPSHOT_FIELDS = ('merged_id', 'grid_res', 'x0', 'y0', 'nx', 'ny', 'air_volume_m3', 'volume_engine',
+                   'voxel_size', 'calibrated_at', 'incremental_run')
+
+class DeviceState:
+    """
+    ค่าต่อไซโลที่ pipeline ใช้ (จาก SiloMeta / SiloGeometry / SurfaceSnapshot) เป็น object ธรรมดา
+    compute_scan จึงไม่แตะฐานข้อมูลและส่งข้าม process ได้ save_device_state เขียนส่วนที่เปลี่ยนกลับ
+    """
+
+    def __init__(self, device_id, method, verify_method, geometry=None, snapshot=None):
+        self.device_id = device_id
+        self.method = method
+        self.verify_method = verify_method
+        self.geometry = geometry  # SimpleNamespace ของ GEOMETRY_FIELDS หรือ None
+        self.snapshot = snapshot  # SimpleNamespace ของ SNAPSHOT_FIELDS + heights (array) หรือ None
+        self.geometry_changed = False
+        self.snapshot_changed = False
+
+    @property
+    def voxel_size(self):
+        """voxel ที่ calibrate ไว้ของไซโล (SiloGeometry.voxel_size) หรือ VOXEL_SIZE"""
+        if self.geometry is not None and self.geometry.voxel_size is not None:
+            return self.geometry.voxel_size
+        return VOXEL_SIZE
+
+    @property
+    def tracks_surface(self):
+        """ใช้ surface diff ได้: มีวงผนัง (frame ของ grid) และ engine วัดช่องว่างเหนือผิว"""
+        return (INCREMENTAL_MAX_CHANGED > 0 and self.geometry is not None
+                and volume_engines.resolve_engine(self.method, self.geometry).surface_based)
+
+def device_state(device_id, silo, geometry, snapshot):
+    """DeviceState จากแถว SiloMeta / SiloGeometry / SurfaceSnapshot (แต่ละตัวเป็น None ได้)"""
+    method, verify_method = engines_for(silo)
+    if geometry is not None:
+        geometry = SimpleNamespace(**{field: getattr(geometry, field) for field in GEOMETRY_FIELDS})
+    if snapshot is not None:
+        heights = surface_diff.decode_heights(snapshot.heights, snapshot.nx, snapshot.ny)
+        snapshot = SimpleNamespace(heights=heights, **{field: getattr(snapshot, field) for field in SNAPSHOT_FIELDS})
+    return DeviceState(device_id, method, verify_method, geometry, snapshot)
+
+def load_device_state(device_id):
+    return device_state(device_id, db.session.get(SiloMeta, device_id), db.session.get(SiloGeometry, device_id),
+                        db.session.get(SurfaceSnapshot, device_id))
+
+def save_device_state(state):
+    """เขียน SiloGeometry / SurfaceSnapshot ที่ compute_scan เปลี่ยน ใน transaction ของผู้เรียก"""
+    if state.geometry_changed:
+        geometry = db.session.get(SiloGeometry, state.device_id)
+        if geometry is None:
+            geometry = SiloGeometry(device_id=state.device_id)
+            db.session.add(geometry)
+        for field in GEOMETRY_FIELDS:
+            setattr(geometry, field, getattr(state.geometry, field))
+    if state.snapshot_changed:
+        save_surface_snapshot(state.device_id, state.snapshot)
+
+def record_latest_volume(entry):
+    """upsert LatestVolume ของ device ใน transaction เดียวกับ VolumeData (entry ต้อง flush แล้ว)
+
+    ไม่เขียนทับถ้าแถวที่มีอยู่ใหม่กว่า (เช่น งาน retry ที่เสร็จช้ากว่างานถัดไป)
+    """
+    values = {
+        'device_id': entry.device_id,
+        'volume_data_id': entry.id,
+        'timestamp': entry.timestamp,
+        'volume': entry.volume,
+        'volume_percentage': entry.volume_percentage,
+    }
+    stmt = sqlite_insert(LatestVolume).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LatestVolume.device_id],
+        set_={key: stmt.excluded[key] for key in values if key != 'device_id'},
+        where=LatestVolume.timestamp <= stmt.excluded.timestamp,
+    )
+    db.session.execute(stmt)
+
+def usable_snapshot(state, scan_id):
+    """heightmap ของสแกนก่อนหน้าที่เทียบกับ scan_id ได้ (frame, engine, voxel และการ calibrate เดียวกัน) หรือ None"""
+    snapshot, geometry = state.snapshot, state.geometry
+    if snapshot is None or snapshot.merged_id >= scan_id:
+        return None
+    frame = (HEIGHTMAP_GRID_RES,) + surface_diff.grid_frame(geometry, HEIGHTMAP_GRID_RES)
+    if (snapshot.grid_res, snapshot.x0, snapshot.y0, snapshot.nx, snapshot.ny) != frame:
+        return None
+    if (snapshot.volume_engine, snapshot.voxel_size, snapshot.calibrated_at) != (
+            state.method, state.voxel_size, geometry.calibrated_at):
+        return None
+    return snapshot
+
+def incremental_air_volume(state, scan_id, heights):
+    """
+    ถ้าผิวเปลี่ยนจากสแกนก่อนหน้าไม่เกิน INCREMENTAL_MAX_CHANGED ของช่อง
+    คืน (ปริมาตรอากาศ m^3, heightmap ที่อัปเดตเฉพาะช่องที่เปลี่ยน, จำนวน incremental ติดกัน) ไม่งั้นคืน None
+    """
+    snapshot = usable_snapshot(state, scan_id)
+    if snapshot is None:
+        return None
+    if snapshot.incremental_run >= INCREMENTAL_MAX_RUN:
+        print(f"Surface diff: {snapshot.incremental_run} incremental updates in a row, running full reconstruction")
+        return None
+
+    previous = snapshot.heights.copy()
+    changed, fraction = surface_diff.changed_cells(previous, heights)
+    if fraction is None:
+        print(f"Surface diff: too little overlap with MergedData #{snapshot.merged_id}")
+        return None
+    print(f"Surface diff vs MergedData #{snapshot.merged_id}: {fraction:.1%} of cells changed")
+    if fraction > INCREMENTAL_MAX_CHANGED:
+        return None
+
+    region = surface_diff.update_region(previous, heights, changed)
+    delta_cm3 = surface_diff.air_delta_cm3(previous, heights, region, state.geometry, HEIGHTMAP_GRID_RES)
+    previous[region] = heights[region]
+    return snapshot.air_volume_m3 + delta_cm3 / 1_000_000.0, previous, snapshot.incremental_run + 1
+
+def save_surface_snapshot(device_id, snapshot):
+    """upsert SurfaceSnapshot ใน transaction ของงาน ไม่เขียนทับ snapshot ของสแกนที่ใหม่กว่า"""
+    values = {field: getattr(snapshot, field) for field in SNAPSHOT_FIELDS}
+    values.update(device_id=device_id, heights=surface_diff.encode_heights(snapshot.heights),
+                  updated_at=datetime.now(timezone.utc))
+    stmt = sqlite_insert(SurfaceSnapshot).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SurfaceSnapshot.device_id],
+        set_={key: stmt.excluded[key] for key in values if key != 'device_id'},
+        where=SurfaceSnapshot.merged_id < stmt.excluded.merged_id,
+    )
+    db.session.execute(stmt)
+
+def update_geometry(state, points):
+    """
+    วงผนังของไซโลใน state คืน True ถ้าเพิ่ง fit (frame ของ grid เปลี่ยน)
+    - ยังไม่มี: fit ผนังจากสแกนนี้ (ยังไม่มี empty_volume_m3 จนกว่าจะรัน calibrate_silo.py)
+    - มีแล้ว: เช็ค drift ด้วย inlier ratio แล้ว fit ผนังใหม่เฉพาะตอนที่เพี้ยน
+    """
+    geometry = state.geometry
+    if geometry is None:
+        wall = silo_geometry.fit_wall(points)
+        if wall is None:
+            return False
+        state.geometry = SimpleNamespace(**dict(dict.fromkeys(GEOMETRY_FIELDS), **wall))
+        state.geometry.calibrated_at = datetime.now(timezone.utc)
+        state.geometry_changed = True
+        print(f"Fitted silo wall for {state.device_id}: r={wall['radius']:.2f} cm (inliers {wall['inlier_ratio']:.1%})")
+        return True
+
+    drifted, ratio = silo_geometry.has_drifted(points, geometry)
+    if not drifted:
+        return False
+    print(f"Wall inlier ratio dropped to {ratio:.1%} (calibrated {geometry.inlier_ratio:.1%}), re-fitting wall...")
+    wall = silo_geometry.fit_wall(points)
+    if wall is None:
+        return False
+    for key in ('center_x', 'center_y', 'radius', 'inlier_ratio'):
+        setattr(geometry, key, wall[key])
+    geometry.calibrated_at = datetime.now(timezone.utc)
+    state.geometry_changed = True
+    return True
+
+def compute_scan(points, state, scan_id, stages):
+    """
+    ส่วนคำนวณของงานหนึ่งงาน ไม่แตะฐานข้อมูล (รันใน process pool ได้) คืน (ปริมาตรอากาศ m^3, จำนวน incremental ติดกัน)
+    อัปเดต state.geometry / state.snapshot ตามผล ผู้เรียกเขียนกลับด้วย save_device_state
+    """
+    # SURFACE DIFF: ไซโลนิ่ง (ผิวเปลี่ยนน้อย) ปรับปริมาตรจากช่องที่เปลี่ยน ข้ามการกรองและคำนวณเต็ม
+    heights = incremental = None
+    if state.tracks_surface:
+        heights = surface_diff.surface_heights(points, state.geometry, HEIGHTMAP_GRID_RES)
+        incremental = incremental_air_volume(state, scan_id, heights)
+        stages.mark("diff")
+
+    if incremental is not None:
+        air_volume, heights, incremental_run = incremental
+        print(f"-> Incremental update ({incremental_run} in a row), skipped cleaning and reconstruction.")
+    else:
+        # DOWNSAMPLE, CLEAN AND FULL VOLUME CALCULATION (engine ของไซโล)
+        print(f"Downsampling (voxel {state.voxel_size} cm) and cleaning dust...")
+        cleaned_points = prepare_points(points, state.voxel_size, stages)
+        refitted = update_geometry(state, cleaned_points)
+        stages.mark("geometry")
+        air_volume = empty_volume_m3(cleaned_points, state.geometry, state.method, state.verify_method,
+                                     scan_id=scan_id)
+        stages.mark("volume")
+        incremental_run = 0
+        if state.tracks_surface and (heights is None or refitted):
+            heights = surface_diff.surface_heights(points, state.geometry, HEIGHTMAP_GRID_RES)
+
+    if state.tracks_surface:
+        x0, y0, nx, ny = surface_diff.grid_frame(state.geometry, HEIGHTMAP_GRID_RES)
+        state.snapshot = SimpleNamespace(
+            merged_id=scan_id, grid_res=HEIGHTMAP_GRID_RES, x0=x0, y0=y0, nx=nx, ny=ny, heights=heights,
+            air_volume_m3=air_volume, volume_engine=state.method, voxel_size=state.voxel_size,
+            calibrated_at=state.geometry.calibrated_at, incremental_run=incremental_run,
+        )
+        state.snapshot_changed = True
+    return air_volume, incremental_run
+
+def scan_totals(air_volume, geometry):
+    """(mass_kg, volume_percentage) จากปริมาตรอากาศและความจุของไซโล"""
+    # ความจุต่อไซโลจากการ calibrate (ถ้ายังไม่มีใช้ค่า default)
+    capacity_m3 = TOTAL_SILO_CAPACITY_M3
+    if geometry is not None and geometry.empty_volume_m3:
+        capacity_m3 = geometry.empty_volume_m3
+
+    material_volume = max(capacity_m3 - air_volume, 0.0)
+    mass_kg = material_volume * CEMENT_DENSITY
+    volume_percentage = (material_volume / capacity_m3) * 100.0
+    volume_percentage = max(0.0, min(100.0, volume_percentage))
+    return mass_kg, volume_percentage
+
+def record_scan(job, air_volume, mass_kg, volume_percentage):
+    """mesh_processed + VolumeData ของงาน ใน transaction ของผู้เรียก คืน VolumeData (ยังไม่ flush)"""
+    job.mesh_processed = True
+    entry = VolumeData(
+        timestamp=datetime.now(timezone.utc),
+        device_id=job.device_id,
+        volume=mass_kg,
+        volume_percentage=volume_percentage,
+        air_volume_m3=air_volume,
+    )
+    db.session.add(entry)
+    return entry
+
 def run_mesh_reconstruction():
     """
-    Finds the next unprocessed point cloud, calculates the volume, percentage, and mass, 
-    and updates DB tables.
+    Claims the next job from the mesh queue, calculates the volume, percentage, and mass, 
+    and updates DB tables. Returns True if a job was handled.
     """
     with app.app_context():
         
-        job = MergedData.query.filter_by(mesh_processed=False).order_by(MergedData.timestamp.asc()).first()
-        
-        if not job:
+        claimed = mesh_queue.claim()
+        if not claimed:
             return False
+
+        job = db.session.get(MergedData, claimed['merged_id'])
+        if job is None or job.mesh_processed:
+            # ถูกลบไปแล้ว หรือทำไปแล้ว (เช่น worker เก่าทำเสร็จหลังหมด visibility timeout)
+            mesh_queue.complete(claimed)
+            db.session.commit()
+            return True
             
-        print(f"\n--- Job Found: Device {job.device_id}, Batch {job.batch_id} ---")
+        print(f"\n--- Job Found: Device {job.device_id}, Batch {job.batch_id} (attempt {claimed['attempts']}) ---")
         
         try:
-            # 1. LOAD AND CLEAN POINTS
-            data_stream = io.StringIO(job.merged_points)
-            points = np.loadtxt(data_stream, dtype=np.float64)
+            # 1. LOAD POINTS
+            stages = StageTimer()
+            points = load_merged_points(job)
+            stages.mark("load", points)
             
             if points.shape[0] < 100:
                  raise ValueError("Insufficient points for meshing after loading.")
-            
-            pcd = o3d.geometry.PointCloud()
-            pcd.points = o3d.utility.Vector3dVector(points)
-            print(f"Loaded {len(points)} points. Cleaning dust...")
-            pcd_clean, ind = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
-            cleaned_points = np.asarray(pcd_clean.points)
-            
-            # 2. VOLUME CALCULATION (Hybrid Convex Hull)
-            hull = ConvexHull(cleaned_points)
-            air_volume = hull.volume
+            print(f"Loaded {len(points)} points.")
+
+            # 2. SURFACE DIFF หรือ DOWNSAMPLE + CLEAN + VOLUME (engine ของไซโล)
+            state = load_device_state(job.device_id)
+            air_volume, _ = compute_scan(points, state, job.id, stages)
 
             # 3. FINAL CALCULATIONS
-            if air_volume > TOTAL_SILO_CAPACITY_M3 * 10: 
-                air_volume /= 1_000_000_000.0
-            
-            material_volume = TOTAL_SILO_CAPACITY_M3 - air_volume
-            
-            if material_volume < 0:
-                material_volume = 0.0 
-            
-            # --- NEW MASS CALCULATION ---
-            mass_kg = material_volume * CEMENT_DENSITY
-            # ----------------------------
-            
-            volume_percentage = (material_volume / TOTAL_SILO_CAPACITY_M3) * 100.0
-            volume_percentage = max(0.0, min(100.0, volume_percentage))
+            mass_kg, volume_percentage = scan_totals(air_volume, state.geometry)
             
             # --- 4. DATABASE UPDATES ---
             
-            job.mesh_processed = True
-            
-            new_volume_entry = VolumeData(
-                timestamp=datetime.now(timezone.utc),
-                device_id=job.device_id,
-                volume=mass_kg,
-                volume_percentage=volume_percentage,
-               
-            )
-            db.session.add(new_volume_entry)
+            if not mesh_queue.complete(claimed):
+                # lease หมดและ worker อื่น reclaim ไปแล้ว ปล่อยให้ worker นั้นบันทึกผล
+                db.session.rollback()
+                print(f"-> Lease lost for batch {job.batch_id}, discarding result.")
+                return True
+
+            new_volume_entry = record_scan(job, air_volume, mass_kg, volume_percentage)
+            db.session.flush()
+            record_latest_volume(new_volume_entry)
+            save_device_state(state)
             db.session.commit()
+            live_updates.publish()  # ปลุก /api/stream ของทุก web process
             
             print(f"-> SUCCESSFULLY processed. Volume saved: {mass_kg:.2f} kg")
            # print(f"-> Mass calculated: {mass_kg:.2f} kg")
             print(f"-> Percentage: {volume_percentage:.2f}% full.")
+            print(f"-> Stages: {stages.summary()}")
             
             return True 
             
         except Exception as e:
             db.session.rollback()
+            mesh_queue.fail(claimed, e)
             print(f"-> FAILED processing batch {job.batch_id}. Error: {e}")
-            return False 
+            return True 
+
+# ====================================================================
+# 4. BACKLOG MODE (หลายงานต่อรอบ สำหรับไล่งานค้างหลังระบบล่ม)
+# ====================================================================
+def compute_device_scans(task):
+    """
+    งานใน process pool: สแกนทั้งหมดของไซโลเดียวเรียงตาม MergedData.id ผ่าน compute_scan ต่อกัน
+    (snapshot และวงผนังของสแกนก่อนใช้กับสแกนถัดไป) task = (DeviceState, [(merged_id, points), ...])
+    คืน (DeviceState, [(merged_id, air_volume หรือ None, error หรือ None, สรุปเวลา)])
+    """
+    state, scans = task
+    results = []
+    for merged_id, points in scans:
+        before = copy.deepcopy(state)  # สแกนที่ล้มเหลวต้องไม่ทิ้งผลครึ่งทางไว้ให้สแกนถัดไป
+        stages = StageTimer()
+        try:
+            air_volume, _ = compute_scan(points, state, merged_id, stages)
+            results.append((merged_id, air_volume, None, stages.summary()))
+        except Exception as e:
+            state = before
+            results.append((merged_id, None, f"{type(e).__name__}: {e}", stages.summary()))
+    return state, results
+
+def run_mesh_backlog(limit=BACKLOG_BATCH_SIZE, pool=None):
+    """
+    claim สูงสุด limit งานในคำสั่งเดียว โหลด MergedData และค่าต่อไซโลด้วย query ชุดเดียว
+    คำนวณใน pool (ไซโลละ task, pool=None รันใน process นี้) แล้วบันทึก VolumeData / mesh_processed
+    ของทุกงานใน transaction เดียว คืนจำนวนงานที่ claim ได้
+    """
+    with app.app_context():
+        claims = mesh_queue.claim_many(limit)
+        if not claims:
+            return 0
+        started = time.perf_counter()
+        by_merged_id = {claimed['merged_id']: claimed for claimed in claims}
+        jobs = {job.id: job for job in MergedData.query.filter(MergedData.id.in_(by_merged_id))}
+
+        # งานที่ถูกลบหรือทำไปแล้ว ปิดงานเลยเหมือน run_mesh_reconstruction
+        for merged_id, claimed in by_merged_id.items():
+            job = jobs.get(merged_id)
+            if job is None or job.mesh_processed:
+                jobs.pop(merged_id, None)
+                mesh_queue.complete(claimed)
+
+        failures = []
+        scans = {}
+        for merged_id in sorted(jobs):
+            job = jobs[merged_id]
+            try:
+                points = load_merged_points(job)
+                if points.shape[0] < 100:
+                    raise ValueError("Insufficient points for meshing after loading.")
+            except Exception as e:
+                failures.append((by_merged_id[merged_id], e))
+                continue
+            scans.setdefault(job.device_id, []).append((merged_id, points))
+
+        device_ids = list(scans)
+        silos = {row.device_id: row for row in SiloMeta.query.filter(SiloMeta.device_id.in_(device_ids))}
+        geometries = {row.device_id: row for row in SiloGeometry.query.filter(SiloGeometry.device_id.in_(device_ids))}
+        snapshots = {row.device_id: row for row in
+                     SurfaceSnapshot.query.filter(SurfaceSnapshot.device_id.in_(device_ids))}
+        tasks = [(device_state(device_id, silos.get(device_id), geometries.get(device_id), snapshots.get(device_id)),
+                  device_scans) for device_id, device_scans in scans.items()]
+        print(f"\n--- Backlog: {len(claims)} job(s), {sum(len(s) for s in scans.values())} scan(s) "
+              f"of {len(tasks)} silo(s) ---")
+
+        outputs = pool.map(compute_device_scans, tasks) if pool is not None else map(compute_device_scans, tasks)
+
+        saved = 0
+        lost = 0
+        latest = {}
+        for state, results in outputs:
+            device_lost = False
+            for merged_id, air_volume, error, summary in results:
+                claimed = by_merged_id[merged_id]
+                if error is not None:
+                    failures.append((claimed, error))
+                    continue
+                if not mesh_queue.complete(claimed):
+                    # worker อื่น reclaim ไปแล้ว ปล่อยให้ worker นั้นบันทึกผล (และ snapshot ของไซโลนี้)
+                    device_lost = True
+                    lost += 1
+                    continue
+                mass_kg, volume_percentage = scan_totals(air_volume, state.geometry)
+                latest[state.device_id] = record_scan(jobs[merged_id], air_volume, mass_kg, volume_percentage)
+                saved += 1
+                print(f"[#{merged_id} {state.device_id}] {volume_percentage:.2f}% full | {summary}")
+            if not device_lost:
+                save_device_state(state)
+
+        db.session.flush()
+        for entry in latest.values():
+            record_latest_volume(entry)
+        db.session.commit()
+        if saved:
+            live_updates.publish()
+
+        for claimed, error in failures:
+            mesh_queue.fail(claimed, error)
+            print(f"-> FAILED MergedData #{claimed['merged_id']}. Error: {error}")
+        print(f"-> Backlog pass: {saved} saved, {len(failures)} failed, {lost} lease(s) lost "
+              f"in {time.perf_counter() - started:.1f} s")
+        return len(claims)
 
 # ====================================================================
-# 4. ENTRY POINT (for worker.py)
+# 5. ENTRY POINT (for worker.py)
 # ====================================================================
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""
+เรขาคณิตของผนังไซโล (จุดศูนย์กลาง, รัศมี, ความสูง) ต่อ device_id
+
+ผนังไซโลไม่เปลี่ยนระหว่างการสแกน จึง fit RANSAC ครั้งเดียวตอน calibrate แล้วเก็บไว้ใน SiloGeometry
+การสแกนครั้งต่อไปแค่เช็ค inlier ratio กับวงที่เก็บไว้ (vectorised ครั้งเดียว)
+ถ้า ratio ลดลงต่ำกว่า DRIFT_TOLERANCE ของตอน calibrate ค่อย fit ใหม่
+"""
+import numpy as np
+
+from mesh_recon import fit_circle_ransac, circle_inliers
+
+WALL_THRESHOLD = 0.5   # cm เหมือน fit_circle_ransac
+DRIFT_TOLERANCE = 0.6  # inlier ratio < 60% ของตอน calibrate ถือว่าเพี้ยน
+
+
+def fit_wall(points, seed=None):
+    """fit ผนังจาก point cloud (N, 3) หน่วย cm คืน dict หรือ None"""
+    points_xy = points[:, :2]
+    circle = fit_circle_ransac(points_xy, threshold=WALL_THRESHOLD, seed=seed)
+    if circle is None:
+        return None
+    cx, cy, radius = circle
+    floor_z = float(np.min(points[:, 2]))
+    lid_z = float(np.max(points[:, 2]))
+    return {
+        'center_x': cx,
+        'center_y': cy,
+        'radius': radius,
+        'floor_z': floor_z,
+        'lid_z': lid_z,
+        'height': lid_z - floor_z,
+        'inlier_ratio': float(np.mean(circle_inliers(points_xy, circle, WALL_THRESHOLD))),
+    }
+
+
+def wall_inlier_ratio(points, geometry):
+    circle = (geometry.center_x, geometry.center_y, geometry.radius)
+    return float(np.mean(circle_inliers(points[:, :2], circle, WALL_THRESHOLD)))
+
+
+def has_drifted(points, geometry, tolerance=DRIFT_TOLERANCE):
+    """คืน (drifted, current_ratio)"""
+    if not geometry.inlier_ratio:
+        return False, 0.0
+    ratio = wall_inlier_ratio(points, geometry)
+    return ratio < geometry.inlier_ratio * tolerance, ratio
@@ -6,6 +6,11 @@ let siloDetailChart = null;
 let selectedSilos = new Set();
 let currentViewType = 'chart';
 
+// จำนวนจุดสูงสุดของกราฟประวัติ (server ลดจุดให้ด้วย LTTB)
+const HISTORY_MAX_POINTS = 300;
+// ประวัติของไซโลในสาขาที่เลือก โหลดครั้งเดียวจาก /api/volume_history (device_id -> [{timestamp, volume, ...}])
+let siloHistoryCache = new Map();
+
 // Colors for different silos
 const siloColors = [
     '#F97316', '#0EA5E9', '#10B981', '#8B5CF6', '#F59E0B', '#EF4444',
@@ -120,15 +125,10 @@ async function checkLoginStatus() {
 async function fetchBranches() {
     try {
         console.log('🔍 Fetching volume data from /api/volume_data');
-        const response = await fetch('/api/volume_data', {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        const { data, changed } = await fetchJSONIfChanged('/api/volume_data');
+        if (!changed) {
+            return null;  // ไม่เปลี่ยนตั้งแต่ poll ครั้งก่อน
         }
-        
-        const data = await response.json();
         console.log('📈 API response:', data);
         
         if (!Array.isArray(data)) {
@@ -264,7 +264,7 @@ function updateBreadcrumb() {
 
 async function fetchSiloHistory(deviceId) {
     try {
-        const response = await fetch(`/api/volume_history/${deviceId}`);
+        const response = await fetch(`/api/volume_history/${deviceId}?max_points=${HISTORY_MAX_POINTS}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -275,6 +275,34 @@ async function fetchSiloHistory(deviceId) {
     }
 }
 
+async function fetchBranchHistory(branch) {
+    // ไซโลทั้งสาขาใน request เดียว (columnar) แทนการเรียก fetchSiloHistory ทีละไซโล
+    siloHistoryCache = new Map();
+    const deviceIds = ((branch && branch.silos) || []).map(silo => silo.device_id);
+    if (deviceIds.length === 0) return;
+    try {
+        const params = new URLSearchParams({
+            device_ids: deviceIds.join(','),
+            max_points: HISTORY_MAX_POINTS
+        });
+        const response = await fetch(`/api/volume_history?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        for (const [deviceId, columns] of Object.entries(data.series)) {
+            const timestamps = columns.timestamp || [];
+            siloHistoryCache.set(deviceId, timestamps.map((timestamp, i) => ({
+                timestamp: timestamp,
+                volume: columns.volume[i],
+                volume_percentage: columns.volume_percentage[i]
+            })));
+        }
+    } catch (error) {
+        console.error('Error fetching branch history:', error);
+    }
+}
+
 function generateDemoHistory(deviceId) {
     const history = [];
     const now = new Date();
@@ -360,6 +388,7 @@ async function selectBranch(branchId) {
         
         await renderBranches();
         await renderSilos();
+        fetchBranchHistory(branches[selectedBranch]);
         updateBranchInfo();
         updateBranchSummary();
         updateBreadcrumb();
@@ -908,6 +937,10 @@ async function loadInitialData() {
     showLoading();
     try {
         const branchesData = await fetchBranches();
+        if (branchesData === null) {
+            console.log('⏸️ Volume data unchanged, keeping current view');
+            return;
+        }
         console.log('📊 Branches data received:', branchesData);
         
         branches = {};
@@ -944,6 +977,7 @@ async function loadInitialData() {
         
         if (selectedBranch && branches[selectedBranch]) {
             await renderSilos();
+            fetchBranchHistory(branches[selectedBranch]);
             updateBranchInfo();
             updateBranchSummary();
             updateBreadcrumb();
@@ -980,7 +1014,7 @@ async function showSiloDetail(siloId) {
         document.getElementById('detail-lastUpdated').textContent = new Date(silo.last_updated).toLocaleString('th-TH');
 
         // Fetch and render history chart
-        const history = await fetchSiloHistory(silo.device_id);
+        const history = siloHistoryCache.get(silo.device_id) || await fetchSiloHistory(silo.device_id);
         renderSiloDetailChart(history);
 
         // Show modal
@@ -1010,18 +1044,47 @@ function showNoDataMessage() {
     `;
 }
 
+// Live updates: server push แถวของ /api/volume_data ที่เปลี่ยน (SSE) แทนการ poll ทุก 30 วินาที
+function applyVolumeUpdate(row) {
+    const branch = branches[row.province];
+    const silo = branch && branch.silos.find(s => s.device_id === row.device_id);
+    if (!silo) {
+        // ไซโล/สาขาใหม่ที่ยังไม่อยู่ในหน้า: โหลด snapshot ใหม่
+        loadInitialData();
+        return;
+    }
+
+    const currentAmount = row.volume || 0;
+    branch.total_used += currentAmount - silo.current_amount;
+    if (silo.is_low_capacity) {
+        branch.low_capacity_silos--;
+    }
+    silo.current_amount = currentAmount;
+    silo.percentage = (currentAmount / silo.capacity) * 100;
+    silo.last_updated = row.timestamp;
+    silo.is_low_capacity = silo.percentage < 35;
+    if (silo.is_low_capacity) {
+        branch.low_capacity_silos++;
+    }
+    siloHistoryCache.delete(row.device_id);
+
+    renderBranches();
+    if (row.province === selectedBranch) {
+        renderSilos();
+        updateBranchSummary();
+    }
+}
+
 // Initialize when page loads
 document.addEventListener('DOMContentLoaded', function() {
     console.log('🚀 Admin Dashboard initializing...');
     loadInitialData();
     
-    // Set up periodic refresh every 30 seconds
-    setInterval(() => {
-        if (!document.hidden) {
-            console.log('🔄 Auto-refreshing data...');
-            loadInitialData();
-        }
-    }, 30000);
+    // live_data.js: SSE หรือ poll ทุก 30 วินาทีถ้า browser ไม่มี EventSource
+    startLiveVolumeUpdates((row) => {
+        console.log('📡 Live update:', row.device_id);
+        applyVolumeUpdate(row);
+    }, loadInitialData);
 });
 
 // Handle page visibility change
@@ -0,0 +1,60 @@
+// ใช้ร่วมกันระหว่าง dashboard: conditional GET (ETag/304) และ live update ผ่าน SSE (/api/stream)
+// โหลดไฟล์นี้ก่อน script ของหน้า (admin_dashboard.html, overview_dashboard.html)
+
+// ETag ของ poll แต่ละตัว (key -> {etag, data}): ถ้าข้อมูลไม่เปลี่ยน server ตอบ 304 โดยไม่ query
+const conditionalCache = new Map();
+
+async function fetchJSONIfChanged(url, key = url) {
+    const cached = conditionalCache.get(key);
+    const response = await fetch(url, {
+        credentials: 'include',
+        cache: 'no-store',
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    if (response.status === 304 && cached) {
+        return { data: cached.data, changed: false };
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        conditionalCache.set(key, { etag, data });
+    } else {
+        conditionalCache.delete(key);
+    }
+    return { data, changed: true };
+}
+
+// Live updates: server push แถวของ /api/volume_data ที่เปลี่ยน (SSE) แทนการ poll ทุก 30 วินาที
+// onUpdate(row): อัปเดตหน้าจากแถวเดียว, reload(): โหลด snapshot ทั้งหมดใหม่ (ได้ 304 ถ้าไม่เปลี่ยน)
+function subscribeVolumeStream(onUpdate, reload) {
+    if (!window.EventSource) {
+        return false;
+    }
+    const source = new EventSource('/api/stream');
+    let connected = false;
+    source.addEventListener('open', () => {
+        // reconnect: อาจพลาด event ระหว่างหลุด ดึง snapshot ใหม่
+        if (connected) {
+            reload();
+        }
+        connected = true;
+    });
+    source.addEventListener('volume', (event) => {
+        onUpdate(JSON.parse(event.data));
+    });
+    return true;
+}
+
+function startLiveVolumeUpdates(onUpdate, reload) {
+    if (!subscribeVolumeStream(onUpdate, reload)) {
+        // browser ที่ไม่มี EventSource: poll ทุก 30 วินาทีเหมือนเดิม
+        setInterval(() => {
+            if (!document.hidden) {
+                reload();
+            }
+        }, 30000);
+    }
+}
@@ -1,3 +1,4 @@
+// ต้องโหลด live_data.js ก่อนไฟล์นี้ (fetchJSONIfChanged, startLiveVolumeUpdates)
 // Global variables
 let overviewData = {};
 let allSilosData = [];
@@ -43,13 +44,10 @@ function showToast(message, type = 'success') {
 async function fetchOverviewData() {
     try {
         console.log('🔄 Fetching overview data from API...');
-        const response = await fetch('/api/volume_data');
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        const { data, changed } = await fetchJSONIfChanged('/api/volume_data', 'overview');
+        if (!changed) {
+            return null;  // ไม่เปลี่ยนตั้งแต่ poll ครั้งก่อน
         }
-        
-        const data = await response.json();
         console.log('📊 Overview API response:', data);
         
         if (!Array.isArray(data)) {
@@ -156,13 +154,10 @@ function processOverviewData(data) {
 async function fetchAllSilos() {
     try {
         console.log('🔄 Fetching all silos data...');
-        const response = await fetch('/api/volume_data');
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        const { data, changed } = await fetchJSONIfChanged('/api/volume_data', 'allSilos');
+        if (!changed) {
+            return null;  // ไม่เปลี่ยนตั้งแต่ poll ครั้งก่อน
         }
-        
-        const data = await response.json();
         console.log('📋 All silos data response:', data);
         
         if (!Array.isArray(data)) {
@@ -453,7 +448,9 @@ async function loadOverviewData() {
     showLoading();
     try {
         console.log('🔄 Loading overview data...');
-        overviewData = await fetchOverviewData();
+        const data = await fetchOverviewData();
+        if (data === null) return;
+        overviewData = data;
         console.log('📊 Overview data loaded:', overviewData);
         
         // ตรวจสอบว่ามีข้อมูลหรือไม่
@@ -482,7 +479,9 @@ async function loadAllSilos() {
     showLoading();
     try {
         console.log('🔄 Loading all silos data...');
-        allSilosData = await fetchAllSilos();
+        const data = await fetchAllSilos();
+        if (data === null) return;
+        allSilosData = data;
         console.log('📋 All silos data loaded:', allSilosData);
         
         renderAllSilosTable(allSilosData);
@@ -498,18 +497,30 @@ async function loadAllSilos() {
     }
 }
 
+// Live updates: server push แถวของ /api/volume_data ที่เปลี่ยน (SSE) แทนการ poll ทุก 30 วินาที
+function applyVolumeUpdate(row) {
+    const index = allSilosData.findIndex(silo => silo.device_id === row.device_id);
+    if (index >= 0) {
+        allSilosData[index] = row;
+    } else {
+        allSilosData.push(row);
+    }
+    overviewData = processOverviewData(allSilosData);
+    updateSummaryCards(overviewData);
+    renderBranchesTable(overviewData.branches);
+    renderAllSilosTable(allSilosData);
+}
+
 // Load data when page loads
 document.addEventListener('DOMContentLoaded', function() {
     loadOverviewData();
     loadAllSilos();
     
-    // Set up periodic refresh every 30 seconds - เหมือนกับ admin
-    setInterval(() => {
-        if (!document.hidden) {
-            loadOverviewData();
-            loadAllSilos();
-        }
-    }, 30000);
+    // live_data.js: SSE หรือ poll ทุก 30 วินาทีถ้า browser ไม่มี EventSource
+    startLiveVolumeUpdates(applyVolumeUpdate, () => {
+        loadOverviewData();
+        loadAllSilos();
+    });
 });
 
 // Handle page visibility change - เหมือนกับ admin
@@ -0,0 +1,98 @@
+"""
+เทียบผิววัสดุระหว่างสแกนต่อเนื่องของไซโลเดียวกัน เพื่อข้ามการกรอง outlier และคำนวณปริมาตรเต็มเมื่อไซโลนิ่ง
+
+- surface_heights: heightmap หยาบ (max z ต่อช่อง grid ในวงผนัง) จากจุดดิบ แล้ว median 3x3 ลบจุดฝุ่นเดี่ยว
+  ใช้ frame เดียวกับ heightmap_empty_volume (ช่องละ grid_res, อ้างอิงจากวงผนังใน SiloGeometry)
+- changed_cells: ช่องที่ผิวขยับเกิน CHANGE_THRESHOLD_CM เทียบกับช่องรอบข้างใน heightmap ของสแกนก่อนหน้า
+- air_delta_cm3: ปริมาตรอากาศที่เปลี่ยนจากบริเวณที่เปลี่ยนเท่านั้น (update_region, ผิวลง = อากาศเพิ่ม)
+  ด้วยพจน์ต่อช่องเดียวกับ engine heightmap
+
+heightmap เก็บเป็น float32 บีบอัด zlib (~ไม่กี่ KB ต่อไซโล) ใน SurfaceSnapshot
+"""
+import zlib
+
+import numpy as np
+from scipy import ndimage
+
+CHANGE_THRESHOLD_CM = 1.0  # ผิวขยับเกินนี้ถือว่าช่องเปลี่ยน
+MIN_OVERLAP = 0.5          # ช่องที่มีค่าทั้งสองสแกนต้องไม่น้อยกว่าสัดส่วนนี้ของสแกนก่อน ไม่งั้นถือว่าเทียบไม่ได้
+WALL_MARGIN = 1.5          # cm เหมือน heightmap_empty_volume
+
+
+def grid_frame(geometry, grid_res):
+    """(x0, y0, nx, ny) ของตารางที่ครอบวงผนัง"""
+    cx, cy, radius = geometry.center_x, geometry.center_y, geometry.radius
+    x0 = int(np.floor((cx - radius) / grid_res))
+    y0 = int(np.floor((cy - radius) / grid_res))
+    nx = int(np.floor((cx + radius) / grid_res)) - x0 + 1
+    ny = int(np.floor((cy + radius) / grid_res)) - y0 + 1
+    return x0, y0, nx, ny
+
+
+def surface_heights(points, geometry, grid_res):
+    """max z ต่อช่อง (nx, ny) float32 ช่องที่ไม่มีจุดเป็น NaN"""
+    x0, y0, nx, ny = grid_frame(geometry, grid_res)
+    cx, cy = geometry.center_x, geometry.center_y
+    inside = (points[:, 0] - cx)**2 + (points[:, 1] - cy)**2 < (geometry.radius - WALL_MARGIN)**2
+    points = points[inside]
+
+    heights = np.full((nx, ny), -np.inf, dtype=np.float32)
+    ix = np.floor(points[:, 0] / grid_res).astype(np.int64) - x0
+    iy = np.floor(points[:, 1] / grid_res).astype(np.int64) - y0
+    np.maximum.at(heights, (ix, iy), points[:, 2].astype(np.float32))
+    known = np.isfinite(heights)
+    if not known.any():
+        return np.full((nx, ny), np.nan, dtype=np.float32)
+
+    # median 3x3 ต้องไม่มีช่องว่าง: เติมช่องว่างด้วยช่องที่มีค่าใกล้ที่สุดก่อน แล้วคืน NaN ภายหลัง
+    _, (nearest_x, nearest_y) = ndimage.distance_transform_edt(~known, return_indices=True)
+    filtered = ndimage.median_filter(heights[nearest_x, nearest_y], size=3)
+    filtered[~known] = np.nan
+    return filtered
+
+
+def changed_cells(previous, current, threshold=CHANGE_THRESHOLD_CM):
+    """
+    คืน (mask ช่องที่เปลี่ยน, สัดส่วนที่เปลี่ยน) สัดส่วนเป็น None ถ้าสองสแกนทับกันน้อยเกินจะเทียบได้
+    ช่องเปลี่ยนเมื่อค่าใหม่อยู่นอกช่วง min..max ของช่องรอบข้าง 3x3 ในสแกนก่อน +- threshold
+    (ผิวที่ชันหรือขอบกอง: จุดขยับ xy เล็กน้อยระหว่างสแกนไม่ถูกนับว่าเปลี่ยน)
+    """
+    known = ~np.isnan(previous)
+    both = known & ~np.isnan(current)
+    overlap = int(np.count_nonzero(both))
+    if overlap == 0 or overlap < MIN_OVERLAP * np.count_nonzero(known):
+        return np.zeros(previous.shape, dtype=bool), None
+    low = ndimage.minimum_filter(np.where(known, previous, np.inf), size=3)
+    high = ndimage.maximum_filter(np.where(known, previous, -np.inf), size=3)
+    changed = both & ((current < low - threshold) | (current > high + threshold))
+    return changed, np.count_nonzero(changed) / overlap
+
+
+def update_region(previous, current, changed):
+    """ช่องที่ต้องปรับ: ช่องที่เปลี่ยนขยายออก 1 ช่อง (ขอบของบริเวณที่เปลี่ยนอยู่ในช่วงของช่องรอบข้างจึงไม่ถูกนับ)"""
+    both = ~np.isnan(previous) & ~np.isnan(current)
+    return ndimage.binary_dilation(changed) & both
+
+
+def air_delta_cm3(previous, current, region, geometry, grid_res):
+    """
+    ปริมาตรอากาศที่เพิ่มขึ้น (cm^3) จากช่องใน region ด้วยพจน์ต่อช่องเดียวกับ heightmap_empty_volume:
+    (lid_z - ผิว) ตัดที่ศูนย์ เฉพาะช่องที่จุดกลางอยู่ในวงผนัง
+    """
+    x0, y0, _, _ = grid_frame(geometry, grid_res)
+    ix, iy = np.nonzero(region)
+    in_circle = (((ix + x0 + 0.5) * grid_res - geometry.center_x)**2
+                 + ((iy + y0 + 0.5) * grid_res - geometry.center_y)**2 <= geometry.radius**2)
+    ix, iy = ix[in_circle], iy[in_circle]
+    lid_z = geometry.lid_z
+    before = np.clip(lid_z - previous[ix, iy].astype(np.float64), 0, None)
+    after = np.clip(lid_z - current[ix, iy].astype(np.float64), 0, None)
+    return float(np.sum(after - before) * grid_res**2)
+
+
+def encode_heights(heights):
+    return zlib.compress(np.ascontiguousarray(heights, dtype='<f4').tobytes())
+
+
+def decode_heights(blob, nx, ny):
+    return np.frombuffer(zlib.decompress(blob), dtype='<f4').reshape(nx, ny).copy()
@@ -0,0 +1,133 @@
+"""
+engine คำนวณปริมาตรอากาศในไซโล (VolumeEstimator) ที่ลงทะเบียนไว้ เลือกต่อไซโลได้ที่ SiloMeta.volume_engine
+
+ทุก engine รับ point cloud ที่กรองแล้ว (หน่วย cm) กับ SiloGeometry (หรือ None) คืน (volume_cm3, info)
+estimate_air_m3 แปลงเป็น m^3 ที่เดียว ทุก engine จึงใช้หน่วยเดียวกัน
+
+cost บอกว่ารันบ่อยได้แค่ไหน:
+- COST_CHEAP: รันได้ทุกสแกน
+- COST_EXPENSIVE: เมื่อใช้เป็น engine ตรวจสอบ (SiloMeta.verify_engine) รันเฉพาะทุก ๆ N สแกน (verification_due)
+
+algorithm (mesh_recon / scipy) import ตอนคำนวณ เพื่อให้ web app อ่านชื่อและ cost ของ engine ได้โดยไม่โหลด open3d
+"""
+import numpy as np
+
+COST_CHEAP = 'cheap'
+COST_EXPENSIVE = 'expensive'
+CM3_PER_M3 = 1_000_000.0
+FALLBACK_ENGINE = 'hull'  # ใช้แทน engine ที่ต้องมี SiloGeometry เมื่อไซโลยังไม่มี
+
+ENGINES = {}
+
+
+def register(cls):
+    ENGINES[cls.name] = cls()
+    return cls
+
+
+def get_engine(name):
+    return ENGINES.get(name)
+
+
+def describe_engines():
+    return [{'name': engine.name, 'cost': engine.cost, 'requires_geometry': engine.requires_geometry}
+            for engine in ENGINES.values()]
+
+
+class VolumeEstimator:
+    name = None
+    cost = COST_CHEAP
+    requires_geometry = False  # ต้องมีวงผนัง/ระดับฝาจาก SiloGeometry
+    surface_based = False      # ปริมาตร = ผลรวมช่องว่างเหนือผิวต่อช่อง grid (ปรับด้วย surface_diff แบบ incremental ได้)
+
+    def can_run(self, geometry):
+        return geometry is not None or not self.requires_geometry
+
+    def estimate_cm3(self, points, geometry, grid_res):
+        """คืน (ปริมาตรอากาศ cm^3, info dict สำหรับ log)"""
+        raise NotImplementedError
+
+
+@register
+class ConvexHullEstimator(VolumeEstimator):
+    """Convex Hull ของทุกจุด (วิธีเดิมของ worker)"""
+    name = 'hull'
+
+    def estimate_cm3(self, points, geometry, grid_res):
+        from scipy.spatial import ConvexHull
+        hull = ConvexHull(points)
+        return float(hull.volume), {'hull_vertices': len(hull.vertices)}
+
+
+@register
+class HeightmapEstimator(VolumeEstimator):
+    """ผลรวม (lid_z - ผิว) ต่อช่อง grid ในวงผนัง"""
+    name = 'heightmap'
+    requires_geometry = True
+    surface_based = True
+
+    def estimate_cm3(self, points, geometry, grid_res):
+        from mesh_recon import heightmap_empty_volume
+        return heightmap_empty_volume(points, geometry.center_x, geometry.center_y, geometry.radius,
+                                      grid_res=grid_res, lid_z=geometry.lid_z)
+
+
+@register
+class PoissonEstimator(VolumeEstimator):
+    """Poisson mesh ของผิว + ฝาปิด (แม่นแต่ช้า ใช้ตรวจสอบ)"""
+    name = 'poisson'
+    cost = COST_EXPENSIVE
+    requires_geometry = True
+    surface_based = True
+
+    def estimate_cm3(self, points, geometry, grid_res):
+        from mesh_recon import extract_surface_grid, poisson_empty_volume
+        cx, cy, radius = geometry.center_x, geometry.center_y, geometry.radius
+        dists = np.sqrt((points[:, 0] - cx)**2 + (points[:, 1] - cy)**2)
+        surface, _ = extract_surface_grid(points[dists < radius - 1.5], grid_res)
+        volume_cm3, mesh = poisson_empty_volume(surface, cx, cy, radius, geometry.lid_z, grid_res)
+        return float(volume_cm3), {'surface_points': len(surface), 'triangles': len(mesh.triangles)}
+
+
+@register
+class CylinderEstimator(VolumeEstimator):
+    """ทรงกระบอก pi r^2 h: h = ฝา - ค่ามัธยฐานของผิว (ไม่มี SiloGeometry ใช้รัศมีจาก bounding box)"""
+    name = 'cylinder'
+
+    def estimate_cm3(self, points, geometry, grid_res):
+        from mesh_recon import extract_surface_grid
+        if geometry is not None:
+            cx, cy, radius, lid_z = geometry.center_x, geometry.center_y, geometry.radius, geometry.lid_z
+            dists = np.sqrt((points[:, 0] - cx)**2 + (points[:, 1] - cy)**2)
+            points = points[dists < radius - 1.5]
+        else:
+            extent = points.max(axis=0) - points.min(axis=0)
+            radius = float(extent[0] + extent[1]) / 4.0
+            lid_z = float(np.max(points[:, 2]))
+        surface, _ = extract_surface_grid(points, grid_res)
+        surface_z = float(np.median(surface[:, 2])) if len(surface) else lid_z
+        height = max(float(lid_z) - surface_z, 0.0)
+        return float(np.pi * radius**2 * height), {'radius': radius, 'height': height}
+
+
+def resolve_engine(name, geometry):
+    """engine ตามชื่อ ถ้าต้องใช้ SiloGeometry แต่ยังไม่มี ใช้ FALLBACK_ENGINE แทน"""
+    engine = get_engine(name)
+    if engine is None:
+        raise ValueError(f"Unknown volume engine: {name}")
+    if not engine.can_run(geometry):
+        engine = ENGINES[FALLBACK_ENGINE]
+    return engine
+
+
+def estimate_air_m3(engine, points, geometry, grid_res):
+    """คืน (ปริมาตรอากาศ m^3, info)"""
+    volume_cm3, info = engine.estimate_cm3(points, geometry, grid_res)
+    return volume_cm3 / CM3_PER_M3, info
+
+
+def verification_due(engine, scan_id, every):
+    """engine ราคาถูกตรวจได้ทุกสแกน engine ราคาแพงตรวจเฉพาะ scan_id ที่หารด้วย every ลงตัว"""
+    if engine.cost == COST_CHEAP:
+        return True
+    return every > 0 and scan_id is not None and scan_id % every == 0
@@ -0,0 +1,196 @@
+"""
+ประวัติปริมาตรสำหรับกราฟ: ทำงานระดับ SQL (ไม่สร้าง ORM object ทีละแถว) และจำกัดจำนวนจุดเสมอ
+
+- bucket (เช่น 5m/1h/1d): GROUP BY ช่วงเวลาใน SQLite คืน min/avg/max/last ต่อ bucket
+  ถ้าหน้าต่างยาวจน bucket เกิน max_points จะขยาย bucket ให้อัตโนมัติ
+- ไม่ระบุ bucket: อ่านแถวดิบ (tuple) แล้วลดจุดด้วย LTTB ถ้าเกิน max_points
+- max_points=all (export): ไม่จำกัดจุด iter_raw_points อ่านทีละชุดให้ stream ออกไป
+"""
+import math
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import bindparam, text, DateTime
+
+DEFAULT_WINDOW = timedelta(days=7)
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+MIN_POINTS = 3  # LTTB ต้องมีจุดแรก จุดสุดท้าย และอย่างน้อยหนึ่ง bucket
+
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+BUCKET_PATTERN = re.compile(r'^(\d+)([smhd])$')
+
+_WINDOW_PARAMS = (
+    bindparam('device_ids', expanding=True),
+    bindparam('start', type_=DateTime()),
+    bindparam('end', type_=DateTime()),
+)
+
+RAW_SQL = text("""
+    SELECT device_id, timestamp, volume, volume_percentage
+    FROM volume_data
+    WHERE device_id IN :device_ids AND timestamp >= :start AND timestamp < :end
+    ORDER BY device_id, timestamp
+""").bindparams(*_WINDOW_PARAMS)
+
+# ROW_NUMBER หาแถวสุดท้ายของแต่ละ bucket (last) ในการอ่านรอบเดียว
+BUCKET_SQL = text("""
+    WITH w AS (
+        SELECT device_id, timestamp, volume, volume_percentage,
+               CAST(strftime('%s', timestamp) AS INTEGER) / :bucket AS b,
+               ROW_NUMBER() OVER (
+                   PARTITION BY device_id, CAST(strftime('%s', timestamp) AS INTEGER) / :bucket
+                   ORDER BY timestamp DESC
+               ) AS rn
+        FROM volume_data
+        WHERE device_id IN :device_ids AND timestamp >= :start AND timestamp < :end
+    )
+    SELECT device_id, b, COUNT(*), MIN(volume), AVG(volume), MAX(volume),
+           MAX(CASE WHEN rn = 1 THEN volume END),
+           AVG(volume_percentage),
+           MAX(CASE WHEN rn = 1 THEN volume_percentage END)
+    FROM w
+    GROUP BY device_id, b
+    ORDER BY device_id, b
+""").bindparams(*_WINDOW_PARAMS)
+
+
+def parse_bucket(value):
+    """'5m' -> 300 (วินาที)"""
+    match = BUCKET_PATTERN.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket '{value}' (expected e.g. 5m, 1h, 1d)")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def parse_time(value):
+    """ISO 8601 -> datetime UTC แบบ naive (รูปแบบเดียวกับที่เก็บใน volume_data)"""
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp '{value}' (expected ISO 8601)")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_window(args):
+    """อ่าน from/to/bucket/max_points จาก request.args คืน (start, end, bucket_seconds, max_points)"""
+    end = parse_time(args['to']) if args.get('to') else datetime.now(timezone.utc).replace(tzinfo=None)
+    start = parse_time(args['from']) if args.get('from') else end - DEFAULT_WINDOW
+    if start >= end:
+        raise ValueError("'from' must be earlier than 'to'")
+    if args.get('max_points') == 'all':
+        # export: ไม่ลดจุด (ผู้เรียกต้อง stream ด้วย iter_raw_points)
+        max_points = None
+    else:
+        try:
+            max_points = int(args.get('max_points', DEFAULT_MAX_POINTS))
+        except ValueError:
+            raise ValueError("'max_points' must be an integer or 'all'")
+        max_points = max(MIN_POINTS, min(max_points, MAX_POINTS_LIMIT))
+
+    bucket = parse_bucket(args['bucket']) if args.get('bucket') else None
+    if bucket is not None and max_points is not None:
+        # จำนวน bucket ต้องไม่เกิน max_points ไม่ว่าหน้าต่างจะยาวแค่ไหน
+        bucket = max(bucket, math.ceil((end - start).total_seconds() / max_points))
+    return start, end, bucket, max_points
+
+
+def _iso(timestamp):
+    # SQLite เก็บ 'YYYY-MM-DD HH:MM:SS.ffffff' ทำให้เป็นรูปแบบเดียวกับ datetime.isoformat()
+    return timestamp.replace(' ', 'T')
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets คืน index ของจุดที่เลือก (เรียงตามเวลา)"""
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < MIN_POINTS:
+        # น้อยกว่าสามจุดไม่มีสามเหลี่ยมให้เลือก: เก็บแค่จุดแรก/จุดสุดท้าย ไม่คืนทั้งชุด
+        return np.array([0, n - 1][:max(threshold, 1)])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # ค่าเฉลี่ยของ bucket ถัดไปเป็นจุดยอดที่สามของสามเหลี่ยม
+        nxt_lo, nxt_hi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[nxt_lo:nxt_hi].mean()
+        avg_y = y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def raw_series(session, device_ids, start, end, max_points):
+    """{device_id: [ {timestamp, volume, volume_percentage}, ... ]} ลดจุดด้วย LTTB"""
+    rows = session.execute(RAW_SQL, {'device_ids': list(device_ids), 'start': start, 'end': end}).all()
+    grouped = {}
+    for device_id, timestamp, volume, percentage in rows:
+        grouped.setdefault(device_id, []).append((timestamp, volume, percentage))
+
+    series = {}
+    for device_id, points in grouped.items():
+        if len(points) > max_points:
+            epoch = np.array([datetime.fromisoformat(p[0]).timestamp() for p in points])
+            values = np.array([p[1] if p[1] is not None else np.nan for p in points], dtype=np.float64)
+            keep = lttb(epoch, np.nan_to_num(values), max_points)
+            points = [points[i] for i in keep]
+        series[device_id] = [{
+            "timestamp": _iso(timestamp),
+            "volume": volume,
+            "volume_percentage": percentage
+        } for timestamp, volume, percentage in points]
+    return series
+
+
+def iter_raw_points(session, device_id, start, end, yield_per=500):
+    """แถวดิบทั้งหมดของ device ในหน้าต่าง (ไม่ลดจุด) อ่านจาก cursor ทีละ yield_per แถว สำหรับ export แบบ stream"""
+    rows = session.execute(RAW_SQL.execution_options(yield_per=yield_per),
+                           {'device_ids': [device_id], 'start': start, 'end': end})
+    for _, timestamp, volume, percentage in rows:
+        yield {
+            "timestamp": _iso(timestamp),
+            "volume": volume,
+            "volume_percentage": percentage
+        }
+
+
+def bucketed_series(session, device_ids, start, end, bucket):
+    """{device_id: [ {timestamp (ต้น bucket), count, min, avg, max, last, ...}, ... ]}"""
+    rows = session.execute(BUCKET_SQL, {
+        'device_ids': list(device_ids), 'start': start, 'end': end, 'bucket': bucket
+    }).all()
+    series = {}
+    for device_id, b, count, vmin, vavg, vmax, vlast, pavg, plast in rows:
+        series.setdefault(device_id, []).append({
+            "timestamp": datetime.fromtimestamp(b * bucket, timezone.utc).replace(tzinfo=None).isoformat(),
+            "count": count,
+            "min": vmin,
+            "avg": vavg,
+            "max": vmax,
+            "last": vlast,
+            # กราฟเดิมใช้ volume/volume_percentage จึงใส่ค่าเฉลี่ยของ bucket ไว้ด้วย
+            "volume": vavg,
+            "volume_percentage": pavg,
+            "last_percentage": plast
+        })
+    return series
+
+
+def columnar(points):
+    """[{k: v}, ...] -> {k: [v, ...]} ลดขนาด payload ของ batch endpoint (ไม่ซ้ำชื่อ key ทุกแถว)"""
+    if not points:
+        return {}
+    return {key: [point[key] for point in points] for key in points[0]}
+
+
+def history_series(session, device_ids, start, end, bucket, max_points):
+    if bucket is not None:
+        return bucketed_series(session, device_ids, start, end, bucket)
+    return raw_series(session, device_ids, start, end, max_points)
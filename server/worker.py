@@ -1,29 +1,145 @@
-import time
-from run_meshing import run_mesh_reconstruction
-
-def main_worker_loop():
-    print("--- Starting Mesh Reconstruction Worker ---")
-    print("Worker will check for new scans every 60 seconds.")
-    print("To stop, press Ctrl+C")
-    
-    while True:
-        try:
-            # Run the meshing function
-            # It will return True if it did work, False if it found no jobs
-            work_done = run_mesh_reconstruction()
-            
-            if work_done:
-                print("Work complete. Checking again immediately...")
-                # Don't sleep, check right away if there's more in the queue
-                continue 
-            else:
-                # No work found, sleep for 60 seconds
-                time.sleep(60)
-
-        except Exception as e:
-            print(f"An error occurred in the worker loop: {e}")
-            print("Restarting loop in 60 seconds...")
-            time.sleep(60)
-
-if __name__ == "__main__":
-    main_worker_loop()
\ No newline at end of file
+import argparse
+import multiprocessing as mp
+
+from run_meshing import (run_mesh_reconstruction, run_mesh_backlog, enqueue_unqueued_scans, mesh_queue,
+                         BACKLOG_BATCH_SIZE)
+
+# worker ถูกปลุกทันทีเมื่อ try_merge เพิ่มงาน; ค่านี้เป็นแค่ fallback poll
+# (เช่น งานที่รอ retry หรือระบบที่ไม่มี Unix socket)
+POLL_INTERVAL = 60
+
+def main_worker_loop():
+    print("--- Starting Mesh Reconstruction Worker ---")
+    print(f"Worker waits on the mesh job queue (fallback poll every {POLL_INTERVAL} seconds).")
+    print("To stop, press Ctrl+C")
+
+    mesh_queue.listen()
+    pending = enqueue_unqueued_scans()
+    print(f"{pending} unprocessed scan(s) in queue at startup.")
+
+    try:
+        while True:
+            try:
+                # It will return True if it handled a job, False if the queue is empty
+                work_done = run_mesh_reconstruction()
+
+                if work_done:
+                    # Don't wait, check right away if there's more in the queue
+                    continue
+                else:
+                    # No work found, block until try_merge notifies us (or fallback poll)
+                    mesh_queue.wait(POLL_INTERVAL)
+
+            except Exception as e:
+                print(f"An error occurred in the worker loop: {e}")
+                print(f"Restarting loop in {POLL_INTERVAL} seconds...")
+                mesh_queue.wait(POLL_INTERVAL)
+    finally:
+        mesh_queue.notifier.close()
+
+# ------------------ Multi-process mode ------------------
+def pool_process_loop(index, wake_gen, wake_cond):
+    """loop ของ process ลูกแต่ละตัว: claim งานจากคิวแบบ atomic จนคิวว่าง แล้วรอ parent ปลุก"""
+    print(f"[worker {index}] started")
+    while True:
+        try:
+            seen = wake_gen.value
+            if run_mesh_reconstruction():
+                continue
+            with wake_cond:
+                # ถ้ามีการปลุกระหว่างที่เรา claim อยู่ ไม่ต้องรอ
+                if wake_gen.value == seen:
+                    wake_cond.wait(POLL_INTERVAL)
+        except Exception as e:
+            print(f"[worker {index}] error in loop: {e}")
+            with wake_cond:
+                wake_cond.wait(POLL_INTERVAL)
+
+def main_pool_loop(processes):
+    print(f"--- Starting Mesh Reconstruction Worker Pool ({processes} processes) ---")
+    print("To stop, press Ctrl+C")
+
+    # spawn: แต่ละ process เปิด DB connection / Open3D ของตัวเอง ไม่แชร์ของที่ fork มา
+    ctx = mp.get_context('spawn')
+    wake_gen = ctx.Value('i', 0)
+    wake_cond = ctx.Condition(wake_gen.get_lock())
+
+    mesh_queue.listen()
+    pending = enqueue_unqueued_scans()
+    print(f"{pending} unprocessed scan(s) in queue at startup.")
+
+    workers = [
+        ctx.Process(target=pool_process_loop, args=(i, wake_gen, wake_cond), daemon=True)
+        for i in range(processes)
+    ]
+    for p in workers:
+        p.start()
+
+    try:
+        while True:
+            # parent เป็นคนเดียวที่ฟัง socket แล้วกระจายการปลุกให้ทุก process
+            woke = mesh_queue.wait(POLL_INTERVAL)
+            with wake_cond:
+                if woke:
+                    wake_gen.value += 1
+                wake_cond.notify_all()
+            for i, p in enumerate(workers):
+                if not p.is_alive():
+                    # งานที่ process นี้ถืออยู่จะถูก reclaim เมื่อ lease หมด
+                    print(f"[worker {i}] exited with code {p.exitcode}, restarting")
+                    workers[i] = ctx.Process(target=pool_process_loop, args=(i, wake_gen, wake_cond), daemon=True)
+                    workers[i].start()
+    except KeyboardInterrupt:
+        print("Stopping worker pool...")
+    finally:
+        for p in workers:
+            p.terminate()
+        mesh_queue.notifier.close()
+
+# ------------------ Backlog mode ------------------
+def main_backlog_loop(batch_size, processes):
+    """
+    ไล่งานค้าง (เช่น หลังระบบล่ม): claim ทีละ batch_size งาน คำนวณใน pool (ไซโลละ task)
+    แล้วบันทึกผลทั้งรอบใน transaction เดียว คิวว่างแล้วรอการปลุกเหมือน main_worker_loop
+    """
+    print(f"--- Starting Mesh Reconstruction Worker (backlog mode, {batch_size} jobs/pass, {processes} processes) ---")
+    print("To stop, press Ctrl+C")
+
+    mesh_queue.listen()
+    pending = enqueue_unqueued_scans()
+    print(f"{pending} unprocessed scan(s) in queue at startup.")
+
+    # spawn: เหตุผลเดียวกับ main_pool_loop; process เดียวรันใน process นี้เลย
+    pool = mp.get_context('spawn').Pool(processes) if processes > 1 else None
+    try:
+        while True:
+            try:
+                if run_mesh_backlog(batch_size, pool):
+                    continue
+                mesh_queue.wait(POLL_INTERVAL)
+            except Exception as e:
+                print(f"An error occurred in the backlog loop: {e}")
+                print(f"Restarting loop in {POLL_INTERVAL} seconds...")
+                mesh_queue.wait(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print("Stopping backlog worker...")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        mesh_queue.notifier.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mesh reconstruction worker")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of worker processes (default: 1, single-process loop)")
+    parser.add_argument("--backlog", type=int, nargs='?', const=BACKLOG_BATCH_SIZE, default=0, metavar="JOBS",
+                        help=f"claim and save up to JOBS jobs per pass (default: {BACKLOG_BATCH_SIZE}), "
+                             "computing them with --processes worker processes")
+    args = parser.parse_args()
+
+    if args.backlog > 0:
+        main_backlog_loop(args.backlog, args.processes)
+    elif args.processes > 1:
+        main_pool_loop(args.processes)
+    else:
+        main_worker_loop()
@@ -0,0 +1,100 @@
+"""
+อ่านข้อความ point cloud "x y z" ต่อบรรทัด (ไฟล์ .xyz, SiloData.point_cloud, MergedData.merged_points แถวเก่า)
+
+- ทางเร็ว: np.loadtxt (C parser ของ numpy) ตรวจจำนวน column ทุกบรรทัดอยู่แล้ว
+  (บรรทัดสั้นกับบรรทัดยาวรวมกันได้ token ครบแต่ทำให้จุดถัดไปเลื่อนทั้งหมด จึงเช็คแค่จำนวนรวมไม่ได้)
+  ข้อมูลที่ดีจึงเร็วเท่า loadtxt เดิม ถ้า loadtxt raise เพราะบรรทัดเสีย ค่อยเข้าทางที่คัดบรรทัด
+- ข้อมูลจาก serial ที่มีบรรทัดขาด/เสีย (เช่น "12.5 3", "[STATUS] ..."): นับ token และตัวอักษรที่ไม่ใช่ตัวเลข
+  ต่อบรรทัดแบบ vectorised บน bytes เก็บเฉพาะบรรทัดที่มีตัวเลขครบ columns ค่า แล้ว parse ด้วยทางเร็ว
+  และรายงานจำนวนบรรทัดที่ข้าม (บรรทัดว่างไม่นับ)
+- แถวที่ไม่ใช่ค่าจำกัด (nan, inf, 1e999) ถูกข้ามเหมือนบรรทัดเสีย ไม่ว่าไฟล์จะมีบรรทัดเสียอื่นหรือไม่
+"""
+import io
+import warnings
+
+import numpy as np
+
+
+def _fromstring(data, dtype):
+    """array 1 มิติ หรือ None ถ้ามี token ที่ไม่ใช่ตัวเลข"""
+    with warnings.catch_warnings():
+        # numpy เตือน (และในอนาคตจะ raise) เมื่ออ่านไม่ถึงท้ายข้อความ
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(data, dtype=dtype, sep=' ')
+        except (DeprecationWarning, ValueError):
+            return None
+
+
+# byte ที่อยู่ในตัวเลขได้ (0-9 . + - e E) บรรทัดที่มี byte อื่นนอกจาก whitespace ถือว่าเสีย
+_NUMERIC = np.zeros(256, dtype=bool)
+_NUMERIC[np.frombuffer(b'0123456789.+-eE', dtype=np.uint8)] = True
+
+
+def _valid_lines(data, columns):
+    """ตรวจทุกบรรทัดแบบ vectorised คืน (line ของแต่ละ byte, บรรทัดที่ใช้ได้, บรรทัดว่าง)"""
+    a = np.frombuffer(data, dtype=np.uint8)
+    newline = a == 10
+    space = a <= 32
+    line = np.cumsum(newline) - newline  # newline นับเป็นของบรรทัดตัวเอง
+    n_lines = int(line[-1]) + 1
+    starts = ~space
+    starts[1:] &= space[:-1]
+    tokens = np.bincount(line[starts], minlength=n_lines)
+    bad_bytes = np.bincount(line[~space & ~_NUMERIC[a]], minlength=n_lines)
+    return line, (tokens == columns) & (bad_bytes == 0), tokens == 0
+
+
+def _parse_lines(lines, dtype, columns):
+    """ทางช้าสุด: แปลงทีละบรรทัด คืน (points, skipped)"""
+    rows = []
+    skipped = 0
+    for line in lines:
+        parts = line.split()
+        try:
+            rows.append([float(part) for part in parts])
+        except ValueError:
+            skipped += 1
+    return np.array(rows, dtype=dtype).reshape(-1, columns), skipped
+
+
+def _finite_rows(points, skipped):
+    """ตัดแถวที่มี nan/inf (เช่น 1e999 ที่ล้น float) นับรวมกับบรรทัดที่ข้าม"""
+    finite = np.isfinite(points).all(axis=1)
+    if finite.all():
+        return points, skipped
+    return points[finite], skipped + int(np.count_nonzero(~finite))
+
+
+def parse_xyz(text, dtype=np.float64, columns=3):
+    """แปลงข้อความเป็น (points (N, columns), จำนวนบรรทัดที่ข้าม)"""
+    if isinstance(text, str):
+        text = text.encode('utf-8', errors='ignore')
+    data = bytes(text).strip() if text else b''
+    if not data:
+        return np.empty((0, columns), dtype=dtype), 0
+
+    try:
+        points = np.loadtxt(io.BytesIO(data), dtype=dtype, ndmin=2, comments=None)
+    except ValueError:
+        points = None
+    if points is not None and points.shape[1] == columns:
+        return _finite_rows(points, 0)
+
+    # มีบรรทัดว่าง บรรทัดขาด หรือ token เสีย: คัดเฉพาะบรรทัดที่ใช้ได้ (vectorised) แล้วเข้าทางเร็วอีกครั้ง
+    line, valid, blank = _valid_lines(data, columns)
+    skipped = int(np.count_nonzero(~valid & ~blank))
+    n_valid = int(np.count_nonzero(valid))
+    kept = np.frombuffer(data, dtype=np.uint8)[valid[line]].tobytes()
+    values = _fromstring(kept, dtype)
+    if values is not None and values.size == n_valid * columns:
+        return _finite_rows(values.reshape(n_valid, columns), skipped)
+    # ตัวอักษรถูกแต่รูปแบบเลขผิด (เช่น "1-2", "..") ซึ่งพบน้อยมาก
+    points, bad = _parse_lines(kept.decode('ascii').splitlines(), dtype, columns)
+    return _finite_rows(points, skipped + bad)
+
+
+def load_xyz(path, dtype=np.float64, columns=3):
+    """อ่านไฟล์ .xyz คืน (points, จำนวนบรรทัดที่ข้าม)"""
+    with open(path, 'rb') as f:
+        return parse_xyz(f.read(), dtype=dtype, columns=columns)